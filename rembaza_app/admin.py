@@ -1,22 +1,205 @@
+import hashlib
+import time
+
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import WaterTable, MonthWorks, SeverageTable
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import caches
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models.functions import Substr
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from . import aggregation, search
+from .models import MonthSummary, MonthWorks, Work, WorkRollup, YearSummary, YEAR_CHOICES
+from .pivot import sum_summ, sum_volume
+
+"""Длина описания работы в списке админ-панели"""
+DESCRIPTION_LENGTH = 80
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, который хранит количество строк выборки в кэше REMBAZA_CACHE_ALIAS
+    на REMBAZA_ADMIN_COUNT_TIMEOUT секунд: COUNT(*) по многолетней таблице выполняется
+    один раз для каждого набора фильтров, а не при каждом открытии страницы списка
+    (у SQLite нет оценки количества строк планировщиком, поэтому используется кэш)"""
+
+    @cached_property
+    def count(self):
+        sql, params = self.object_list.query.sql_with_params()
+        key = 'rembaza:admin_count:' + hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+        cache = caches[getattr(settings, 'REMBAZA_CACHE_ALIAS', 'default')]
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, getattr(settings, 'REMBAZA_ADMIN_COUNT_TIMEOUT', 60))
+        return count
+
+
+class ConfirmForm(forms.Form):
+    """Подтверждение массового удаления"""
+
+
+class MoveForm(forms.Form):
+    year = forms.TypedChoiceField(label='Год', choices=YEAR_CHOICES, coerce=int)
+    month = forms.TypedChoiceField(label='Месяц', choices=MonthWorks.MONTH_CHOICES, coerce=int)
+
+
+class ReclassifyForm(forms.Form):
+    type_work = forms.TypedChoiceField(label='Вид работ', choices=MonthWorks.TYPE_CHOICES, coerce=int)
+
+
+class MonthWorksChangeList(ChangeList):
+    """Список работ читает из базы только показываемые колонки, а описание - первыми символами"""
+
+    def get_queryset(self, request, *args, **kwargs):
+        return (super().get_queryset(request, *args, **kwargs)
+                .only('id', 'type_work', 'year', 'month', 'completed_works', 'volume', 'summ')
+                .annotate(short_description=Substr('description', 1, DESCRIPTION_LENGTH + 1)))
+
 
 @admin.register(MonthWorks)
 class MonthWorksAdmin(admin.ModelAdmin):
-    list_display = ('year', 'month', 'completed_works', 'description', 'volume', 'summ')
+    """Список работ на многолетней таблице:
+     - без полного COUNT(*) для строки "показано N из M" и без подсчета строк по фильтрам,
+     - количество строк для страниц берется из кэша (CachedCountPaginator),
+     - поиск по наименованию и описанию идет через полнотекстовый индекс (search.filter_works),
+     - под таблицей итоги объема и суммы по текущему фильтру одним агрегатным запросом,
+     - массовые удаление, перенос и смена вида работ выполняются с одним пересчетом затронутых итогов
+     (aggregation.bulk_delete, aggregation.bulk_change) вместо обновления итогов на каждую запись,
+     удаление записывается в историю админ-панели, как у стандартного удаления"""
+    list_display = ('year', 'month', 'completed_works', 'description_preview', 'volume', 'summ')
     list_filter = ('type_work', 'year', 'month')
-    search_fields = ['completed_works']
+    search_fields = ['completed_works', 'description']
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    actions = ['delete_works', 'move_works', 'reclassify_works']
+
+    def get_changelist(self, request, **kwargs):
+        return MonthWorksChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return search.filter_works(queryset, search_term), False
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def bulk_action(self, request, queryset, form_class, title, apply):
+        """Промежуточная страница массового действия: форма параметров, затем выполнение
+        одним запросом; выбранные записи передаются скрытыми полями, как у стандартного удаления"""
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            started = time.perf_counter()
+            count = apply(queryset, form.cleaned_data)
+            self.message_user(request, f"{title}: записей {count} за {time.perf_counter() - started:.2f} с")
+            return None
+        return TemplateResponse(request, 'admin/rembaza_app/monthworks/bulk_action.html', {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            'form': form,
+            'count': queryset.count(),
+            'action': request.POST.get('action'),
+            'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Удалить выбранные работы', permissions=['delete'])
+    def delete_works(self, request, queryset):
+        return self.bulk_action(request, queryset, ConfirmForm, 'Удаление работ',
+                                lambda works, data: self.delete_logged(request, works))
+
+    def delete_logged(self, request, queryset):
+        """Запись удаления в историю (LogEntry) и удаление в одной транзакции"""
+        with transaction.atomic():
+            self.log_deletions(request, queryset)
+            return aggregation.bulk_delete(queryset)
+
+    @admin.action(description='Перенести выбранные работы в другой месяц', permissions=['change'])
+    def move_works(self, request, queryset):
+        return self.bulk_action(request, queryset, MoveForm, 'Перенос работ',
+                                lambda works, data: aggregation.bulk_change(works, **data))
+
+    @admin.action(description='Изменить вид работ', permissions=['change'])
+    def reclassify_works(self, request, queryset):
+        return self.bulk_action(request, queryset, ReclassifyForm, 'Смена вида работ',
+                                lambda works, data: aggregation.bulk_change(works, **data))
+
+    @admin.display(description='Описание')
+    def description_preview(self, obj):
+        text = obj.short_description
+        return text if len(text) <= DESCRIPTION_LENGTH else text[:DESCRIPTION_LENGTH] + '…'
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None:
+            response.context_data['totals'] = cl.queryset.order_by().aggregate(
+                total_volume=sum_volume(), total_summ=sum_summ())
+        return response
+
+
+@admin.register(Work)
+class WorkAdmin(admin.ModelAdmin):
+    """Справочник работ пополняется автоматически по наименованиям записей, поэтому доступен только для просмотра"""
+    list_display = ('name',)
+    search_fields = ['name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(WorkRollup)
+class WorkRollupAdmin(admin.ModelAdmin):
+    """Итоги заполняются автоматически, поэтому доступны только для просмотра"""
+    list_display = ('year', 'type_work', 'month', 'work', 'volume', 'summ')
+    list_filter = ('type_work', 'year', 'month')
+    list_select_related = ('work',)
+    search_fields = ['work__name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(YearSummary)
+class YearSummaryAdmin(admin.ModelAdmin):
+    """Годовые итоги заполняются автоматически, поэтому доступны только для просмотра"""
+    list_display = ('year', 'type_work', 'work', 'first_quarter', 'second_quarter',
+                    'third_quarter', 'fourth_quarter', 'year_total', 'year_total_vol')
+    list_filter = ('type_work', 'year')
+    list_select_related = ('work',)
+    search_fields = ['work__name']
 
+    def has_add_permission(self, request):
+        return False
 
-@admin.register(WaterTable)
-class WaterTableAdmin(admin.ModelAdmin):
-    list_display = ('year', 'completed_works', 'year_total')
-    search_fields = ['completed_works']
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
-@admin.register(SeverageTable)
-class SeverageTableAdmin(admin.ModelAdmin):
-    list_display = ('year', 'completed_works', 'year_total')
-    search_fields = ['completed_works']
+@admin.register(MonthSummary)
+class MonthSummaryAdmin(admin.ModelAdmin):
+    """Итоги месяцев заполняются автоматически, поэтому доступны только для просмотра"""
+    list_display = ('year', 'month', 'type_work', 'count', 'volume', 'summ')
+    list_filter = ('type_work', 'year')
 
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
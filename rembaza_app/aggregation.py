@@ -0,0 +1,500 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum, Value
+
+from . import page_cache
+from .models import DirtyWork, MonthSummary, MonthWorks, WorkRollup, YearSummary
+from .pivot import QUARTER_FIELDS, QUARTER_VOL_FIELDS, THOUSANDTHS, quarter_of, year_summary_annotations
+
+"""Сервис инкрементального обновления свернутых итогов WorkRollup:
+ - каждая запись MonthWorks вносит свой объем и сумму в строку WorkRollup
+ с тем же видом работ, годом, работой из справочника Work и месяцем;
+ строка итогов находится по индексу из целых чисел, а не по сравнению наименований,
+ - при создании, изменении или удалении записи к строке применяется только разница
+ между новым и старым вкладом одним запросом UPDATE без чтения строки,
+ - прежний вклад берется из записи в базе, заблокированной до конца транзакции сохранения,
+ поэтому параллельные изменения одной записи не теряют и не удваивают разницу,
+ - квартальные и годовые суммы и объемы работы той же разницей поддерживаются в YearSummary
+ (для сравнения лет), количество, объем и сумма работ месяца по виду работ - в MonthSummary;
+ годовые таблицы по месяцам строит pivot.year_table,
+ - в отложенных режимах (REMBAZA_AGGREGATION_MODE) сигналы только отмечают работу
+ как измененную, а итоги каждой отмеченной работы пересчитываются один раз:
+ после фиксации транзакции ('on_commit') или командой run_aggregator ('queue'),
+ - в режиме 'queue' страницы года и вида работ с работами в очереди не кэшируются (см. has_pending):
+ run_aggregator работает отдельным процессом и не может сбросить кэш страниц в памяти процесса сайта"""
+
+"""Режимы обновления итогов"""
+IMMEDIATE = 'immediate'
+ON_COMMIT = 'on_commit'
+QUEUE = 'queue'
+MODES = (IMMEDIATE, ON_COMMIT, QUEUE)
+
+"""Поля MonthWorks, от которых зависит вклад записи в итоги"""
+STATE_FIELDS = ('type_work', 'year', 'month', 'work_id', 'volume', 'summ')
+
+"""Поля ключа строки WorkRollup"""
+KEY_FIELDS = ('type_work', 'year', 'work_id', 'month')
+
+"""Поля ключа строки YearSummary"""
+SUMMARY_KEY_FIELDS = ('type_work', 'year', 'work_id')
+
+"""Поля значений YearSummary"""
+SUMMARY_FIELDS = (tuple(QUARTER_FIELDS.values()) + ('year_total',)
+                  + tuple(QUARTER_VOL_FIELDS.values()) + ('year_total_vol',))
+
+"""Поля ключа и значений MonthSummary"""
+MONTH_KEY_FIELDS = ('type_work', 'year', 'month')
+MONTH_FIELDS = ('count', 'volume', 'summ')
+
+
+def _volume(value):
+    """Объем с точностью поля; сумма объемов из SQLite приходит без округления"""
+    return Decimal(str(value or 0)).quantize(THOUSANDTHS)
+
+
+def _summ(value):
+    """Сумма может прийти как float (значение по умолчанию), строка или Decimal"""
+    return Decimal(str(value or 0))
+
+
+def snapshot(instance):
+    """Снимок полей записи MonthWorks, влияющих на итоги"""
+    return {field: getattr(instance, field) for field in STATE_FIELDS}
+
+
+def stored_state(instance):
+    """Состояние записи в базе до сохранения или удаления:
+     - читается одним запросом по pk с блокировкой строки (select_for_update) до конца транзакции,
+     поэтому параллельное сохранение той же записи дождется фиксации и увидит уже новое состояние
+     (SQLite блокировку строк не поддерживает, там транзакции записи выполняются по очереди),
+     - значения, загруженные в объект ранее, не используются: к этому моменту они могли устареть"""
+    if instance.pk is None:
+        return None
+    return MonthWorks.objects.select_for_update().filter(pk=instance.pk).values(*STATE_FIELDS).first()
+
+
+def _add(model, key, values, create):
+    """Прибавление значений к строке model с ключом key одним запросом UPDATE:
+     - если строки еще нет, создает ее (кроме create=False),
+     - если строку одновременно создала параллельная транзакция (нарушение уникального ключа),
+     значения прибавляются к ней повторным UPDATE"""
+    rows = model.objects.filter(**key)
+    changes = {field: F(field) + Value(value) for field, value in values.items()}
+    if rows.update(**changes) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **values)
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def apply_delta(type_work, year, work_id, month, volume, summ, count=0, ensure=False, create=True):
+    """Прибавление разницы объема и суммы к строке WorkRollup, к сумме и объему квартала и года в YearSummary
+    и разницы количества, объема и суммы к итогам месяца в MonthSummary:
+     - каждая строка изменяется одним запросом UPDATE, отсутствующая создается
+     (кроме вычитания вклада, create=False),
+     - нулевая разница пропускается, если не требуется создать строки (ensure)"""
+    if not (volume or summ or count or ensure):
+        return
+    work = {'type_work': type_work, 'year': year, 'work_id': work_id}
+    _add(WorkRollup, dict(work, month=month), {'volume': volume, 'summ': summ}, create)
+    quarter = quarter_of(month)
+    _add(YearSummary, work, {QUARTER_FIELDS[quarter]: summ, 'year_total': summ,
+                             QUARTER_VOL_FIELDS[quarter]: volume, 'year_total_vol': volume}, create)
+    _add(MonthSummary, {'type_work': type_work, 'year': year, 'month': month},
+         {'count': count, 'volume': volume, 'summ': summ}, create)
+
+
+def prune(type_work, year, work_id, month, exclude_pk=None):
+    """Удаление строки WorkRollup, если за месяц не осталось ни одной записи MonthWorks,
+    строки YearSummary, если за год по работе не осталось строк WorkRollup,
+    и строки MonthSummary, если в месяце по виду работ не осталось записей (count = 0);
+    вызывается после вычитания вклада, которое уже заблокировало строки итогов"""
+    key = {'type_work': type_work, 'year': year, 'work_id': work_id, 'month': month}
+    remaining = MonthWorks.objects.filter(**key)
+    if exclude_pk is not None:
+        remaining = remaining.exclude(pk=exclude_pk)
+    if not remaining.exists():
+        WorkRollup.objects.filter(**key).delete()
+        MonthSummary.objects.filter(type_work=type_work, year=year, month=month, count__lte=0).delete()
+        del key['month']
+        if not WorkRollup.objects.filter(**key).exists():
+            YearSummary.objects.filter(**key).delete()
+
+
+def apply_change(old, new, exclude_pk=None):
+    """Применение изменения записи MonthWorks к итогам в одной транзакции:
+     - внутри транзакции сохранения записи отдельная точка сохранения не создается,
+     ошибка откатывает и запись, и итоги,
+     - old - состояние записи до изменения (None при создании),
+     - new - состояние после изменения (None при удалении),
+     - если вид работ, год, месяц и работа не менялись, применяется одна разница,
+     иначе старый вклад вычитается, а новый прибавляется"""
+    with transaction.atomic(savepoint=False):
+        if old and new and all(old[f] == new[f] for f in KEY_FIELDS):
+            apply_delta(new['type_work'], new['year'], new['work_id'], new['month'],
+                        _volume(new['volume']) - _volume(old['volume']),
+                        _summ(new['summ']) - _summ(old['summ']))
+            return
+        if old:
+            apply_delta(old['type_work'], old['year'], old['work_id'], old['month'],
+                        -_volume(old['volume']), -_summ(old['summ']), count=-1, create=False)
+            prune(old['type_work'], old['year'], old['work_id'], old['month'], exclude_pk=exclude_pk)
+        if new:
+            apply_delta(new['type_work'], new['year'], new['work_id'], new['month'],
+                        _volume(new['volume']), _summ(new['summ']), count=1, ensure=True)
+
+
+def grouped_totals(queryset):
+    """Итоги одним запросом GROUP BY type_work, year, work_id, month:
+     - возвращает словарь {(вид работ, год, id работы, месяц): (объем, сумма)}"""
+    rows = (queryset.order_by()
+            .values_list(*KEY_FIELDS)
+            .annotate(total_volume=Sum('volume'), total_summ=Sum('summ')))
+    return {tuple(row[:4]): (_volume(row[4]), _summ(row[5])) for row in rows}
+
+
+def _sync(rows, totals, batch_size):
+    """Приведение строк WorkRollup к итогам:
+     - rows - существующие строки в пределах пересчета,
+     - totals - итоги по ключам в тех же пределах,
+     - строки с изменившимися итогами обновляются, недостающие создаются, лишние удаляются,
+     - сбрасывается кэш страниц, у которых изменились итоги"""
+    pending = dict(totals)
+    to_update, to_delete = [], []
+    changes = set()
+    for row in rows:
+        values = pending.pop(tuple(getattr(row, field) for field in KEY_FIELDS), None)
+        if values is None:
+            to_delete.append(row.pk)
+            changes.add((row.type_work, row.year, row.month))
+            continue
+        if (row.volume, row.summ) != values:
+            changes.add((row.type_work, row.year, row.month))
+            row.volume, row.summ = values
+            to_update.append(row)
+    to_create = [WorkRollup(volume=volume, summ=summ, **dict(zip(KEY_FIELDS, key)))
+                 for key, (volume, summ) in pending.items()]
+
+    WorkRollup.objects.bulk_update(to_update, ['volume', 'summ'], batch_size=batch_size)
+    WorkRollup.objects.bulk_create(to_create, batch_size=batch_size)
+    if to_delete:
+        WorkRollup.objects.filter(pk__in=to_delete).delete()
+    page_cache.invalidate(changes | {(row.type_work, row.year, row.month) for row in to_create})
+    return len(to_update), len(to_create), len(to_delete)
+
+
+def summary_totals(queryset):
+    """Суммы и объемы по кварталам и за год по строкам WorkRollup одним запросом GROUP BY type_work, year, work_id:
+     - возвращает словарь {(вид работ, год, id работы): значения полей SUMMARY_FIELDS}"""
+    rows = (queryset.order_by()
+            .values(*SUMMARY_KEY_FIELDS)
+            .annotate(**year_summary_annotations()))
+    return {tuple(row[field] for field in SUMMARY_KEY_FIELDS): tuple(row[field] for field in SUMMARY_FIELDS)
+            for row in rows}
+
+
+def _sync_summaries(rows, totals, batch_size):
+    """Приведение строк YearSummary к суммам по WorkRollup: изменившиеся обновляются,
+    недостающие создаются, лишние удаляются"""
+    pending = dict(totals)
+    to_update, to_delete = [], []
+    for row in rows:
+        values = pending.pop(tuple(getattr(row, field) for field in SUMMARY_KEY_FIELDS), None)
+        if values is None:
+            to_delete.append(row.pk)
+        elif tuple(getattr(row, field) for field in SUMMARY_FIELDS) != values:
+            for field, value in zip(SUMMARY_FIELDS, values):
+                setattr(row, field, value)
+            to_update.append(row)
+    YearSummary.objects.bulk_update(to_update, SUMMARY_FIELDS, batch_size=batch_size)
+    YearSummary.objects.bulk_create(
+        [YearSummary(**dict(zip(SUMMARY_KEY_FIELDS, key)), **dict(zip(SUMMARY_FIELDS, values)))
+         for key, values in pending.items()],
+        batch_size=batch_size)
+    if to_delete:
+        YearSummary.objects.filter(pk__in=to_delete).delete()
+
+
+def month_totals(queryset):
+    """Итоги месяцев по записям MonthWorks одним запросом GROUP BY type_work, year, month:
+     - возвращает словарь {(вид работ, год, месяц): (количество, объем, сумма)}"""
+    rows = (queryset.order_by()
+            .values_list(*MONTH_KEY_FIELDS)
+            .annotate(count=Count('pk'), total_volume=Sum('volume'), total_summ=Sum('summ')))
+    return {tuple(row[:3]): (row[3], _volume(row[4]), _summ(row[5])) for row in rows}
+
+
+def _sync_months(rows, totals, batch_size):
+    """Приведение строк MonthSummary к итогам по MonthWorks: изменившиеся обновляются,
+    недостающие создаются, лишние удаляются"""
+    pending = dict(totals)
+    to_update, to_delete = [], []
+    for row in rows:
+        values = pending.pop(tuple(getattr(row, field) for field in MONTH_KEY_FIELDS), None)
+        if values is None:
+            to_delete.append(row.pk)
+        elif (row.count, row.volume, row.summ) != values:
+            row.count, row.volume, row.summ = values
+            to_update.append(row)
+    MonthSummary.objects.bulk_update(to_update, MONTH_FIELDS, batch_size=batch_size)
+    MonthSummary.objects.bulk_create(
+        [MonthSummary(**dict(zip(MONTH_KEY_FIELDS, key)), **dict(zip(MONTH_FIELDS, values)))
+         for key, values in pending.items()],
+        batch_size=batch_size)
+    if to_delete:
+        MonthSummary.objects.filter(pk__in=to_delete).delete()
+
+
+def recompute_months(months, batch_size=500):
+    """Пересчет итогов месяцев по набору (вид работ, год, месяц) одним сгруппированным запросом"""
+    months = set(months)
+    if not months:
+        return
+
+    def scope(queryset):
+        return queryset.filter(type_work__in={key[0] for key in months}, year__in={key[1] for key in months},
+                               month__in={key[2] for key in months})
+    totals = {key: values for key, values in month_totals(scope(MonthWorks.objects.all())).items() if key in months}
+    _sync_months([row for row in scope(MonthSummary.objects.all())
+                  if (row.type_work, row.year, row.month) in months], totals, batch_size)
+
+
+def _filter_works(queryset, works):
+    """Отбор строк по набору работ (вид работ, год, id работы)"""
+    return queryset.filter(
+        type_work__in={key[0] for key in works},
+        year__in={key[1] for key in works},
+        work_id__in={key[2] for key in works},
+    )
+
+
+def recompute(works, batch_size=500):
+    """Пересчет итогов по набору работ (вид работ, год, id работы):
+     - итоги по всем работам считаются одним сгруппированным запросом,
+     - существующие строки обновляются bulk_update, недостающие создаются bulk_create,
+     - строки, по которым не осталось записей MonthWorks, удаляются,
+     - затем так же приводятся годовые итоги YearSummary этих работ
+     и итоги MonthSummary месяцев, в которых эти работы были или есть"""
+    works = set(works)
+    if not works:
+        return
+    totals = {key: values for key, values in grouped_totals(_filter_works(MonthWorks.objects.all(), works)).items()
+              if key[:3] in works}
+    with transaction.atomic():
+        rows = [row for row in _filter_works(WorkRollup.objects.all(), works)
+                if (row.type_work, row.year, row.work_id) in works]
+        _sync(rows, totals, batch_size)
+        summaries = {key: values for key, values in summary_totals(_filter_works(WorkRollup.objects.all(), works)).items()
+                     if key in works}
+        _sync_summaries([row for row in _filter_works(YearSummary.objects.all(), works)
+                         if (row.type_work, row.year, row.work_id) in works], summaries, batch_size)
+        recompute_months({(row.type_work, row.year, row.month) for row in rows}
+                         | {(key[0], key[1], key[3]) for key in totals}, batch_size)
+
+
+"""Поля MonthWorks, которые можно изменить массовым действием"""
+BULK_FIELDS = ('type_work', 'year', 'month')
+
+
+def _bulk_scope(queryset):
+    """Записи выборки без аннотаций и сортировки (выборка может прийти из списка админ-панели)"""
+    return MonthWorks.objects.filter(pk__in=queryset.order_by().values('pk'))
+
+
+def _affected(works):
+    """Затронутые сочетания (вид работ, год, id работы, месяц) одним запросом DISTINCT"""
+    return set(works.order_by().values_list(*KEY_FIELDS).distinct())
+
+
+def bulk_delete(queryset):
+    """Массовое удаление записей MonthWorks без обновления итогов на каждую запись:
+     - в одной транзакции запоминаются затронутые работы, записи удаляются QuerySet.delete()
+     при отключенных обработчиках итогов (suppressed) и одним сгруппированным проходом
+     пересчитываются итоги этих работ (recompute),
+     - возвращает количество удаленных записей"""
+    works = _bulk_scope(queryset)
+    with transaction.atomic(), suppressed():
+        affected = _affected(works)
+        deleted = works.delete()[1].get(MonthWorks._meta.label, 0)
+        recompute({key[:3] for key in affected})
+    page_cache.invalidate({(type_work, year, month) for type_work, year, _, month in affected})
+    return deleted
+
+
+def bulk_change(queryset, **changes):
+    """Массовое изменение вида работ, года или месяца записей MonthWorks одним запросом UPDATE:
+     - сигналы на каждую запись не отправляются, итоги прежних и новых работ
+     пересчитываются одним сгруппированным проходом в той же транзакции,
+     - возвращает количество измененных записей"""
+    unknown = set(changes) - set(BULK_FIELDS)
+    if unknown:
+        raise ValueError(f"Поля нельзя изменить массово: {', '.join(sorted(unknown))}")
+    works = _bulk_scope(queryset)
+    with transaction.atomic():
+        affected = _affected(works)
+        moved = {tuple(changes.get(field, value) for field, value in zip(KEY_FIELDS, key)) for key in affected}
+        updated = works.update(**changes)
+        recompute({key[:3] for key in affected | moved})
+    page_cache.invalidate({(type_work, year, month) for type_work, year, _, month in affected | moved})
+    return updated
+
+
+def _scope(queryset, year):
+    return queryset if year is None else queryset.filter(year=year)
+
+
+def rebuild(year=None, batch_size=500):
+    """Полное перестроение итогов за год (или за все годы) по данным MonthWorks:
+     - одним запросом GROUP BY считаются итоги по всем строкам,
+     - годовые итоги YearSummary перестраиваются по обновленным строкам WorkRollup,
+     итоги месяцев MonthSummary - по записям MonthWorks,
+     - возвращает (обновлено, создано, удалено) строк WorkRollup"""
+    totals = grouped_totals(_scope(MonthWorks.objects.all(), year))
+    with transaction.atomic():
+        result = _sync(_scope(WorkRollup.objects.all(), year), totals, batch_size)
+        _sync_summaries(_scope(YearSummary.objects.all(), year),
+                        summary_totals(_scope(WorkRollup.objects.all(), year)), batch_size)
+        _sync_months(_scope(MonthSummary.objects.all(), year),
+                     month_totals(_scope(MonthWorks.objects.all(), year)), batch_size)
+    return result
+
+
+def verify(year=None):
+    """Сравнение сохраненных итогов с пересчитанными по MonthWorks без записи в базу:
+     - возвращает список расхождений (ключ строки, сохранено, ожидается),
+     - для отсутствующей или лишней строки вместо значений указывается None,
+     - годовые итоги YearSummary сверяются с суммами по MonthWorks так же,
+     ключ строки WorkRollup - (вид работ, год, id работы, месяц),
+     ключ строки YearSummary - (вид работ, год, id работы, None),
+     ключ строки MonthSummary - (вид работ, год, None, месяц)"""
+    differences = []
+    months = month_totals(_scope(MonthWorks.objects.all(), year))
+    for row in _scope(MonthSummary.objects.all(), year).order_by(*MONTH_KEY_FIELDS):
+        key = tuple(getattr(row, field) for field in MONTH_KEY_FIELDS)
+        expected = months.pop(key, None)
+        stored = (row.count, row.volume, row.summ)
+        if stored != expected:
+            differences.append(((key[0], key[1], None, key[2]), stored, expected))
+    for key in sorted(months):
+        differences.append(((key[0], key[1], None, key[2]), None, months[key]))
+
+    summaries = summary_totals(_scope(MonthWorks.objects.all(), year))
+    for row in _scope(YearSummary.objects.all(), year).order_by(*SUMMARY_KEY_FIELDS):
+        key = tuple(getattr(row, field) for field in SUMMARY_KEY_FIELDS)
+        expected = summaries.pop(key, None)
+        stored = tuple(getattr(row, field) for field in SUMMARY_FIELDS)
+        if stored != expected:
+            differences.append((key + (None,), stored, expected))
+    for key in sorted(summaries):
+        differences.append((key + (None,), None, summaries[key]))
+
+    totals = grouped_totals(_scope(MonthWorks.objects.all(), year))
+    for row in _scope(WorkRollup.objects.all(), year).order_by(*KEY_FIELDS):
+        key = tuple(getattr(row, field) for field in KEY_FIELDS)
+        expected = totals.pop(key, None)
+        stored = (row.volume, row.summ)
+        if stored != expected:
+            differences.append((key, stored, expected))
+    for key in sorted(totals):
+        differences.append((key, None, totals[key]))
+    return differences
+
+
+_local = threading.local()
+
+
+def mode():
+    """Текущий режим обновления итогов из настройки REMBAZA_AGGREGATION_MODE"""
+    value = getattr(settings, 'REMBAZA_AGGREGATION_MODE', IMMEDIATE)
+    if value not in MODES:
+        raise ValueError(f"Неизвестный режим обновления итогов: {value}")
+    return value
+
+
+def work_key(state):
+    """Ключ работы (вид работ, год, id работы) по снимку записи"""
+    return state['type_work'], state['year'], state['work_id']
+
+
+def mark_dirty(works):
+    """Отметка работ (вид работ, год, id работы) для отложенного пересчета:
+     - в режиме 'on_commit' работы копятся в памяти потока и пересчитываются после фиксации транзакции,
+     - в режиме 'queue' работы записываются в очередь DirtyWork в той же транзакции"""
+    works = set(works)
+    if not works:
+        return
+    if mode() == QUEUE:
+        DirtyWork.objects.bulk_create([DirtyWork(type_work=type_work, year=year, work_id=work_id)
+                                       for type_work, year, work_id in works])
+        return
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = set()
+    pending |= works
+    """Обработчик регистрируется при каждой отметке: после отката транзакции ее обработчики
+    отбрасываются, а отметки остаются и пересчитываются при следующей фиксации"""
+    transaction.on_commit(flush_pending)
+
+
+def flush_pending():
+    """Пересчет работ, отмеченных в этом потоке; повторные вызовы после пересчета ничего не делают"""
+    works = getattr(_local, 'pending', None)
+    _local.pending = None
+    if works:
+        recompute(works)
+
+
+@contextmanager
+def suppressed():
+    """Блок, в котором сигналы MonthWorks не обновляют итоги и не сбрасывают кэш страниц:
+    вызывающий код сам пересчитывает затронутые работы (см. bulk_delete)"""
+    _local.suppressed = getattr(_local, 'suppressed', 0) + 1
+    try:
+        yield
+    finally:
+        _local.suppressed -= 1
+
+
+def is_suppressed():
+    return getattr(_local, 'suppressed', 0) > 0
+
+
+def _pending_queryset(year, type_works):
+    queryset = DirtyWork.objects.filter(year=year)
+    if type_works is not None:
+        queryset = queryset.filter(type_work__in=type_works)
+    return queryset
+
+
+def has_pending(year, type_works=None):
+    """Есть ли в очереди DirtyWork работы года (и видов работ type_works), итоги которых
+    еще не пересчитаны; вне режима 'queue' очередь не используется и запрос не выполняется"""
+    return mode() == QUEUE and _pending_queryset(year, type_works).exists()
+
+
+async def ahas_pending(year, type_works=None):
+    """Асинхронный вариант has_pending"""
+    return mode() == QUEUE and await _pending_queryset(year, type_works).aexists()
+
+
+def process_queue(batch_size=500):
+    """Обработка очереди DirtyWork:
+     - работы, отмеченные до начала обработки, пересчитываются по одному разу,
+     - обработанные строки очереди удаляются; отметки, добавленные во время пересчета, остаются
+     до следующего вызова,
+     - возвращает количество пересчитанных работ"""
+    last = DirtyWork.objects.aggregate(last=Max('pk'))['last']
+    if last is None:
+        return 0
+    queued = DirtyWork.objects.filter(pk__lte=last)
+    works = set(queued.values_list('type_work', 'year', 'work_id').distinct())
+    with transaction.atomic():
+        recompute(works, batch_size)
+        queued.delete()
+    return len(works)
@@ -0,0 +1,133 @@
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from .models import MonthWorks
+from .pagination import keyset_page, page_url
+from .pivot import (WATER, SEVERAGE, comparison_params, year_comparison, year_summary, year_table,
+                    year_table_columns)
+
+"""JSON API отчетов только для чтения:
+ - повторяет страницы year_detail, monthworks_list, watertable_view, severagetable_view, compare_view,
+ - ?fields=a,b ограничивает колонки ответа; в запрос к базе попадают только они,
+ - списки отдаются порциями по ?limit= строк с курсором ?cursor= из поля next,
+ - строки сериализуются прямо из values() без создания объектов моделей,
+ - ответы сжимаются gzip, если клиент это поддерживает"""
+
+"""Ограничения размера порции"""
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+"""Колонки работ за месяц"""
+MONTHWORKS_FIELDS = ('id', 'type_work', 'year', 'month', 'completed_works', 'description', 'volume', 'summ')
+
+"""Колонки итогов года по видам работ и месяцам"""
+YEAR_SUMMARY_FIELDS = ('type_work', 'month', 'count', 'total_volume', 'total_summ')
+
+
+class ApiError(Exception):
+    pass
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder, json_dumps_params={'ensure_ascii': False})
+
+
+def api_view(view):
+    """Общая обработка запросов API: только GET, gzip, ошибки параметров - ответ 400"""
+    @gzip_page
+    @require_GET
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as e:
+            return _json({'error': str(e)}, status=400)
+    return wrapper
+
+
+def requested_fields(request, allowed):
+    """Колонки из параметра ?fields=, по умолчанию все"""
+    value = request.GET.get('fields')
+    if not value:
+        return list(allowed)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ApiError(f"Неизвестные поля: {', '.join(unknown)}")
+    return fields
+
+
+def paginate(request, queryset, key_field, fields):
+    """Порция строк после курсора по возрастанию key_field (см. pagination.keyset_page):
+     - key_field всегда читается из базы для курсора, но отдается, только если запрошен"""
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        raise ApiError('Некорректный limit')
+    if limit < 1:
+        raise ApiError('Некорректный limit')
+    try:
+        page = keyset_page(queryset, key_field, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        raise ApiError(str(e))
+    rows = page.rows
+    if key_field not in fields:
+        for row in rows:
+            del row[key_field]
+    next_url = page_url(request, page.next_cursor, param='cursor')
+    return {'results': rows, 'next': next_url and request.build_absolute_uri(next_url)}
+
+
+@api_view
+def year_detail_api(request, year):
+    """Количество работ, объем и сумма по видам работ и месяцам года"""
+    fields = requested_fields(request, YEAR_SUMMARY_FIELDS)
+    rows = [{field: row[field] for field in fields} for row in year_summary(year)]
+    return _json({'year': year, 'results': rows})
+
+
+@api_view
+def monthworks_api(request, year, month):
+    """Работы за месяц"""
+    fields = requested_fields(request, MONTHWORKS_FIELDS)
+    queryset = (MonthWorks.objects.filter(year=year, month=month).order_by('id')
+                .values(*dict.fromkeys(['id'] + fields)))
+    return _json(dict(paginate(request, queryset, 'id', fields), year=year, month=month))
+
+
+def _year_table_api(request, type_work, year):
+    allowed = ['year'] + [field for field, _ in year_table_columns()]
+    fields = requested_fields(request, allowed)
+    queryset = year_table(type_work, year, fields=fields)
+    page = paginate(request, queryset, 'completed_works', fields)
+    if 'year' not in fields:
+        for row in page['results']:
+            del row['year']
+    return _json(dict(page, year=year))
+
+
+@api_view
+def watertable_api(request, year):
+    """Годовая таблица по водоснабжению"""
+    return _year_table_api(request, WATER, year)
+
+
+@api_view
+def severagetable_api(request, year):
+    """Годовая таблица по водоотведению"""
+    return _year_table_api(request, SEVERAGE, year)
+
+
+@api_view
+def compare_api(request):
+    """Сравнение лет по работам: суммы по кварталам, за год и изменение к предыдущему году"""
+    try:
+        year_from, year_to, types = comparison_params(request.GET)
+    except ValueError as e:
+        raise ApiError(str(e))
+    return _json({'year_from': year_from, 'year_to': year_to,
+                  'results': year_comparison(year_from, year_to, types)})
@@ -7,6 +7,8 @@ class RembazaAppConfig(AppConfig):
 
     def ready(self):
         """Загрузка функций обработчиков сигнала при старте приложения"""
+        from .signals import remember_loaded_state
         from .signals import update_aggregate_tables
-        from .signals import calculate_totals
         from .signals import delete_from_aggregate_tables
+        from .signals import configure_sqlite
+        from .signals import ensure_search_index
@@ -0,0 +1,56 @@
+from django.http import HttpResponseBadRequest
+from django.template.response import TemplateResponse
+
+from . import tables
+from .page_cache import cached_page
+from .pagination import akeyset_page, is_fragment
+from .pivot import WATER, SEVERAGE, month_summary, year_summary
+from .views import (year_detail_context, monthworks_queryset, render_monthworks_page, render_year_table_page,
+                    year_view as sync_year_view)
+
+"""Асинхронные варианты страниц отчетов для запуска через ASGI (rembaza_pr/asgi.py):
+ - имена и поведение совпадают с представлениями из views.py, контекст строится теми же функциями,
+ - строки читаются асинхронным ORM (async for), кэш страниц - асинхронной веткой cached_page,
+ поэтому обработка запроса не занимает поток на все время запроса,
+ - адреса переключаются на эти представления настройкой REMBAZA_ASYNC_VIEWS (см. urls.py);
+ по умолчанию она выключена и под ASGI: пока синхронные middleware переводят каждый запрос в поток,
+ кэшированные страницы отдаются быстрее синхронными представлениями (см. команду loadtest)"""
+
+
+async def year_view(request):
+    return sync_year_view(request)
+
+
+@cached_page('year_detail')
+async def year_detail(request, year):
+    rows = [row async for row in year_summary(year)]
+    return TemplateResponse(request, 'rembaza_app/year_detail.html', year_detail_context(year, rows))
+
+
+@cached_page('monthworks_list')
+async def monthworks_list(request, year, month):
+    try:
+        page = await akeyset_page(monthworks_queryset(year, month), 'id', request.GET.get('after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    summary_rows = [] if is_fragment(request) else [row async for row in month_summary(year, month)]
+    return render_monthworks_page(request, year, month, page, summary_rows)
+
+
+async def year_table_view(request, type_work, year):
+    try:
+        page = await akeyset_page(tables.year_table_rows(type_work, year), 'completed_works',
+                                  request.GET.get('after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return render_year_table_page(request, type_work, year, page)
+
+
+@cached_page('watertable')
+async def watertable_view(request, year):
+    return await year_table_view(request, WATER, year)
+
+
+@cached_page('severagetable')
+async def severagetable_view(request, year):
+    return await year_table_view(request, SEVERAGE, year)
@@ -0,0 +1,410 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import OperationalError, connection, connections
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from . import aggregation, tables, urls
+from .models import MonthWorks, Work
+from .perf import percentile
+from .pivot import WATER, year_table
+
+"""Замеры производительности представлений и цепочки сигналов:
+ - seed заполняет базу синтетическими работами нужного объема,
+ - measure_urls для каждого адреса из rembaza_app/urls.py считает запросы к базе,
+ время и пиковую память при пустом и заполненном кэше страниц,
+ - measure_signals считает скорость создания, изменения и удаления работ через сигналы,
+ - measure_concurrency замеряет задержки чтения годовой таблицы во время параллельной записи
+ (нужна база в файле, а не в памяти),
+ - measure_table_rendering сравнивает время отрисовки строк годовой таблицы разными способами,
+ - measure_server_load нагружает запущенный сервер (команда loadtest) параллельными клиентами,
+ - QUERY_BUDGETS - допустимое количество запросов на страницу при пустом кэше;
+ бюджеты проверяются тестами и командой benchmark"""
+
+"""Год синтетических данных"""
+BENCH_YEAR = 2024
+
+"""Допустимое количество запросов к базе на один запрос страницы"""
+QUERY_BUDGETS = {
+    'years': 0,
+    'year_detail': 1,
+    'monthworks_list': 2,
+    'watertable': 1,
+    'severagetable': 1,
+    'compare': 1,
+    'search': 0,
+    'search_query': 1,
+    'monthworks_export': 1,
+    'watertable_export': 1,
+    'severagetable_export': 1,
+    'api_year_detail': 1,
+    'api_monthworks': 1,
+    'api_watertable': 1,
+    'api_severagetable': 1,
+    'api_compare': 1,
+}
+
+"""Значения параметров адресов"""
+URL_ARGUMENTS = {'year': BENCH_YEAR, 'month': 1, 'fmt': 'csv'}
+
+"""Дополнительные замеры адресов со строкой запроса: имя замера -> (имя адреса, параметры)"""
+URL_QUERIES = {'search_query': ('search', {'q': 'замена'})}
+
+WORK_NAMES = ['Замена задвижки', 'Ремонт колодца', 'Прочистка', 'Замена трубы', 'Ремонт гидранта',
+              'Устранение утечки', 'Замена люка', 'Промывка сети', 'Ремонт насоса', 'Замена счетчика']
+
+
+def seed(rows, year=BENCH_YEAR, names=200, random_seed=0):
+    """Заполнение базы синтетическими работами за год и пересчет итогов"""
+    rnd = random.Random(random_seed)
+    batch = []
+    for number in range(rows):
+        batch.append(MonthWorks(
+            type_work=rnd.choice((1, 2)),
+            year=year,
+            month=rnd.randint(1, 12),
+            completed_works=f"{rnd.choice(WORK_NAMES)} №{rnd.randrange(names)}",
+            description=f"Адрес {rnd.randrange(1000)}, участок {number}",
+            volume=Decimal(rnd.randrange(50, 2000)) / 100,
+            summ=Decimal(rnd.randrange(100, 500000)) / 100,
+        ))
+        if len(batch) == 1000:
+            MonthWorks.objects.bulk_create(Work.objects.assign(batch))
+            batch = []
+    MonthWorks.objects.bulk_create(Work.objects.assign(batch))
+    aggregation.rebuild(year)
+
+
+def url_cases():
+    """Адреса из rembaza_app/urls.py с подставленными параметрами и адреса из URL_QUERIES: (имя, адрес)"""
+    cases = []
+    for pattern in urls.urlpatterns:
+        kwargs = {name: URL_ARGUMENTS[name] for name in pattern.pattern.converters}
+        cases.append((pattern.name, reverse(pattern.name, kwargs=kwargs)))
+    for case, (name, params) in URL_QUERIES.items():
+        cases.append((case, f'{reverse(name)}?{urlencode(params)}'))
+    return cases
+
+
+class QueryCounter:
+    """Счетчик запросов к базе через connection.execute_wrapper
+    (журнал connection.queries ограничен 9000 записями и не годится для долгих замеров)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def _request(client, url, trace=False):
+    """Один запрос страницы: (ответ, количество запросов к базе, время в мс, пиковая память в КБ);
+    память замеряется отдельным запуском (trace), чтобы tracemalloc не искажал время"""
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with count_queries() as queries:
+        response = client.get(url)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return response, queries.count, elapsed, peak
+
+
+def _clear_page_cache():
+    caches[getattr(settings, 'REMBAZA_CACHE_ALIAS', 'default')].clear()
+
+
+def measure_urls(repeat=3):
+    """Замеры каждого адреса при пустом (cold) и заполненном (warm) кэше страниц"""
+    client = Client()
+    results = {}
+    for name, url in url_cases():
+        cold, warm = [], []
+        for _ in range(repeat):
+            _clear_page_cache()
+            cold.append(_request(client, url))
+            warm.append(_request(client, url))
+        _clear_page_cache()
+        peak = _request(client, url, trace=True)[3]
+        response = cold[0][0]
+        results[name] = {
+            'url': url,
+            'status': response.status_code,
+            'queries': cold[0][1],
+            'budget': QUERY_BUDGETS.get(name),
+            'cold_ms': min(item[2] for item in cold),
+            'warm_ms': min(item[2] for item in warm),
+            'warm_queries': warm[0][1],
+            'peak_kb': peak,
+        }
+    return results
+
+
+def measure_signals(operations=200, year=BENCH_YEAR + 1):
+    """Скорость создания, изменения и удаления работ через цепочку сигналов (операций в секунду)
+    и количество запросов к базе на одну операцию"""
+    results = {}
+    works = []
+
+    def run(phase, action, items):
+        started = time.perf_counter()
+        with count_queries() as queries:
+            for item in items:
+                action(item)
+        elapsed = time.perf_counter() - started
+        results[phase] = {
+            'ops_per_sec': len(items) / elapsed if elapsed else None,
+            'queries_per_op': queries.count / len(items) if items else 0,
+        }
+
+    def create(number):
+        works.append(MonthWorks.objects.create(
+            type_work=number % 2 + 1, year=year, month=number % 12 + 1,
+            completed_works=f"Замер №{number % 20}", description='замер', volume=Decimal('1.000'), summ=Decimal('10.00')))
+
+    def update(work):
+        work.summ += 1
+        work.save()
+
+    run('create', create, list(range(operations)))
+    run('update', update, list(works))
+    run('delete', lambda work: work.delete(), list(works))
+    return results
+
+
+def run(sizes, repeat=3, operations=200):
+    """Полный набор замеров для каждого объема данных; база должна быть пустой,
+    данные догружаются до следующего объема без удаления предыдущих"""
+    report = {}
+    seeded = 0
+    for size in sorted(sizes):
+        started = time.perf_counter()
+        seed(size - seeded, random_seed=size)
+        seeded = size
+        report[str(size)] = {
+            'seed_seconds': time.perf_counter() - started,
+            'urls': measure_urls(repeat),
+            'signals': measure_signals(operations),
+        }
+    return report
+
+
+def measure_concurrency(duration=3.0, writers=2, readers=4):
+    """Параллельные писатели (создание и изменение работ через сигналы) и читатели годовой таблицы:
+    количество операций в секунду, задержки чтения и ошибки блокировки базы"""
+    stop = threading.Event()
+    lock = threading.Lock()
+    read_times, errors = [], []
+    counts = {'writes': 0, 'reads': 0}
+
+    def writer(number):
+        try:
+            while not stop.is_set():
+                try:
+                    work = MonthWorks.objects.create(
+                        type_work=WATER, year=BENCH_YEAR, month=number % 12 + 1,
+                        completed_works=f"Параллельная запись №{number}", description='замер',
+                        volume=Decimal('1.000'), summ=Decimal('10.00'))
+                    work.summ += 1
+                    work.save()
+                    with lock:
+                        counts['writes'] += 2
+                except OperationalError as e:
+                    with lock:
+                        errors.append(str(e))
+        finally:
+            connection.close()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    list(year_table(WATER, BENCH_YEAR))
+                except OperationalError as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    read_times.append((time.perf_counter() - started) * 1000)
+                    counts['reads'] += 1
+        finally:
+            connection.close()
+
+    threads = ([threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+               + [threading.Thread(target=reader) for _ in range(readers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {
+        'writes_per_sec': counts['writes'] / duration,
+        'reads_per_sec': counts['reads'] / duration,
+        'read_p50_ms': statistics.median(read_times) if read_times else None,
+        'read_p95_ms': percentile(read_times, 95),
+        'read_max_ms': max(read_times) if read_times else None,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def _table_row(number):
+    """Синтетическая строка годовой таблицы: словарь значений по колонкам"""
+    row = {}
+    for field, _ in tables.YEAR_TABLE_COLUMNS:
+        if field in tables.TEXT_FIELDS:
+            row[field] = f"{WORK_NAMES[number % len(WORK_NAMES)]} №{number}"
+        elif field.endswith('_vol'):
+            row[field] = Decimal(number % 97 * 1000 + 250) / 1000
+        else:
+            row[field] = Decimal(number * 37 % 100000) / 100
+    return row
+
+
+"""Способы отрисовки строк годовой таблицы для сравнения:
+ - dict_template - прежний шаблон с отдельной переменной {{ table.поле }} для каждой колонки,
+ - tuple_template - шаблон с вложенным циклом по значениям кортежа,
+ - row_formatter - шаблон year_table_rows.html с форматтером строк из rembaza_app.tables"""
+RENDERING_TEMPLATES = {
+    'dict_template': ('{% for table in rows %}<tr>'
+                      + ''.join(f'<td>{{{{ table.{field} }}}}</td>' for field, _ in tables.YEAR_TABLE_COLUMNS)
+                      + '</tr>\n{% endfor %}'),
+    'tuple_template': '{% for row in rows %}<tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>\n{% endfor %}',
+}
+
+
+def measure_table_rendering(rows=1000, repeat=5):
+    """Время отрисовки rows строк годовой таблицы каждым способом (лучшее из repeat, мс)"""
+    dicts = [_table_row(number) for number in range(rows)]
+    fields = [field for field, _ in tables.YEAR_TABLE_COLUMNS]
+    tuples = [tuple(row[field] for field in fields) for row in dicts]
+    compiled = {name: engines['django'].from_string(source) for name, source in RENDERING_TEMPLATES.items()}
+    cases = {
+        'dict_template': lambda: compiled['dict_template'].render({'rows': dicts}),
+        'tuple_template': lambda: compiled['tuple_template'].render({'rows': tuples}),
+        'row_formatter': lambda: render_to_string('rembaza_app/year_table_rows.html',
+                                                  {'rows': tuples, 'columns': tables.YEAR_TABLE_COLUMNS}),
+    }
+    results = {}
+    for name, render in cases.items():
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            times.append((time.perf_counter() - started) * 1000)
+        results[name] = {'rows': rows, 'ms': min(times), 'ms_per_1000_rows': min(times) * 1000 / rows}
+    return results
+
+
+"""Профили SQLite для сравнения: журнал отката (как без настройки) и рабочие настройки из settings"""
+SQLITE_PROFILES = {
+    'rollback_journal': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 0},
+    'tuned': None,
+}
+
+
+def compare_sqlite_profiles(duration=3.0, writers=2, readers=4):
+    """Замер measure_concurrency для каждого профиля SQLite; соединения переоткрываются,
+    чтобы новые PRAGMA применились"""
+    results = {}
+    for name, pragmas in SQLITE_PROFILES.items():
+        connections.close_all()
+        if pragmas is None:
+            pragmas = dict(getattr(settings, 'REMBAZA_SQLITE_PRAGMAS', {}),
+                           journal_mode=getattr(settings, 'REMBAZA_SQLITE_JOURNAL_MODE', 'WAL'))
+        with override_settings(REMBAZA_SQLITE_PRAGMAS=pragmas):
+            results[name] = measure_concurrency(duration, writers, readers)
+        connections.close_all()
+    return results
+
+
+async def _load_client(client, host, port, paths, deadline, latencies, errors):
+    """Клиент HTTP/1.1 с постоянным соединением: запрашивает адреса по кругу до deadline"""
+    reader = writer = None
+    number = 0
+    while time.perf_counter() < deadline:
+        path = paths[number % len(paths)]
+        number += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode())
+            await writer.drain()
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+            status = int(head.split(' ', 2)[1])
+            headers = dict(line.split(':', 1) for line in head.split('\r\n')[1:] if ':' in line)
+            if 'content-length' in headers:
+                await reader.readexactly(int(headers['content-length']))
+            else:
+                await reader.read()
+                headers['connection'] = 'close'
+            if headers.get('connection', '').strip() == 'close':
+                writer.close()
+                writer = None
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            errors.append(f'{type(e).__name__}: {e}')
+            if writer is not None:
+                writer.close()
+                writer = None
+            continue
+        if status == 200:
+            latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            errors.append(f'HTTP {status} {path}')
+    if writer is not None:
+        writer.close()
+
+
+def measure_server_load(host, port, paths, clients, duration=10.0):
+    """Нагрузка запущенного сервера: clients параллельных клиентов в течение duration секунд"""
+    latencies, errors = [], []
+
+    async def main():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[_load_client(client, host, port, paths, deadline, latencies, errors)
+                               for client in range(clients)])
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else None,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+    }
@@ -0,0 +1,188 @@
+import csv
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import Http404, StreamingHttpResponse
+
+from .models import MonthWorks
+from .pivot import year_table, year_table_columns
+
+"""Потоковая выгрузка таблиц в CSV и XLSX:
+ - строки читаются из базы порциями через values_list().iterator(chunk_size=...),
+ - каждая строка сразу записывается в ответ StreamingHttpResponse,
+ - итоговая строка по всем числовым колонкам накапливается в том же проходе,
+ - XLSX собирается потоково в zip без сторонних библиотек,
+ поэтому время и память выгрузки не зависят от количества строк"""
+
+"""Размер порции строк, читаемых из базы"""
+CHUNK_SIZE = 2000
+
+"""Колонки выгрузки работ за месяц: (поле, заголовок)"""
+MONTHWORKS_COLUMNS = [
+    ('completed_works', 'Наименование работ'),
+    ('description', 'Описание работ'),
+    ('volume', 'Объем'),
+    ('summ', 'Сумма, тыс.руб'),
+]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def total_zeros(columns, numeric):
+    """Начальные значения итогов колонок с номерами numeric {номер: ноль Decimal}: число знаков берется
+    из поля объема или суммы MonthWorks, поэтому итог колонки из одних нулей выгружается как 0.000 или 0.00"""
+    zeros = {name: Decimal(0).scaleb(-MonthWorks._meta.get_field(name).decimal_places) for name in ('volume', 'summ')}
+    return {index: zeros['volume' if columns[index][0] == 'volume' or columns[index][0].endswith('_vol') else 'summ']
+            for index in numeric}
+
+
+def with_totals(rows, width, zeros):
+    """Строки таблицы и итоговая строка по колонкам из zeros, посчитанная в том же проходе;
+    пустые значения (None) в итог не входят"""
+    totals = dict(zeros)
+    for row in rows:
+        for index in zeros:
+            if row[index] is not None:
+                totals[index] += row[index]
+        yield row
+    yield ('Итого',) + tuple(totals.get(index, '') for index in range(1, width))
+
+
+class _Echo:
+    """Псевдофайл, который возвращает записанную строку вместо ее хранения"""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(header, rows):
+    """Поток строк CSV; BOM в начале нужен Excel для распознавания UTF-8"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '﻿' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _ZipBuffer:
+    """Неперематываемый буфер для zipfile: накопленные байты забираются методом drain"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_workbook(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(row):
+    return ('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>').encode()
+
+
+def xlsx_stream(sheet_name, header, rows, flush_every=500):
+    """Поток байтов файла XLSX с одним листом"""
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _xlsx_workbook(sheet_name))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(header))
+            for number, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row))
+                if number % flush_every == 0:
+                    yield buffer.drain()
+            sheet.write(b'</sheetData></worksheet>')
+        yield buffer.drain()
+    yield buffer.drain()
+
+
+def stream_response(fmt, filename, header, rows, sheet_name='Лист1'):
+    """Потоковый ответ с файлом выгрузки в формате csv или xlsx"""
+    if fmt == 'csv':
+        content = csv_stream(header, rows)
+    elif fmt == 'xlsx':
+        content = xlsx_stream(sheet_name, header, rows)
+    else:
+        raise Http404('Неизвестный формат выгрузки')
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def year_table_response(type_work, year, fmt, filename, sheet_name):
+    """Выгрузка годовой таблицы по виду работ с итоговой строкой"""
+    columns = year_table_columns()
+    rows = year_table(type_work, year).values_list(*[field for field, _ in columns]).iterator(chunk_size=CHUNK_SIZE)
+    zeros = total_zeros(columns, range(1, len(columns)))
+    return stream_response(fmt, filename, [title for _, title in columns],
+                           with_totals(rows, len(columns), zeros), sheet_name)
+
+
+def monthworks_response(year, month, fmt, filename, sheet_name):
+    """Выгрузка работ за месяц с итоговой строкой"""
+    rows = (MonthWorks.objects.filter(year=year, month=month).order_by('pk')
+            .values_list(*[field for field, _ in MONTHWORKS_COLUMNS]).iterator(chunk_size=CHUNK_SIZE))
+    zeros = total_zeros(MONTHWORKS_COLUMNS, (2, 3))
+    return stream_response(fmt, filename, [title for _, title in MONTHWORKS_COLUMNS],
+                           with_totals(rows, len(MONTHWORKS_COLUMNS), zeros), sheet_name)
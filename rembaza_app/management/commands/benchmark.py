@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from rembaza_app import benchmark
+
+"""Команда замеров производительности:
+ - создает отдельную тестовую базу (рабочая база не затрагивается),
+ - для каждого объема синтетических данных замеряет все адреса приложения и цепочку сигналов,
+ - сохраняет результаты в JSON для сравнения между коммитами,
+ - с ключом --check завершается с ошибкой, если страница превысила бюджет запросов,
+ - сравнивает время отрисовки строк годовой таблицы шаблоном и форматтером строк,
+ - с ключом --concurrency сравнивает чтение во время записи с журналом отката и с WAL"""
+
+
+class Command(BaseCommand):
+    help = 'Замеры запросов к базе, времени и памяти для всех страниц и сигналов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Количество синтетических записей MonthWorks')
+        parser.add_argument('--repeat', type=int, default=3, help='Количество повторов замера страницы')
+        parser.add_argument('--operations', type=int, default=200,
+                            help='Количество операций при замере сигналов')
+        parser.add_argument('--output', default='bench_output.json', help='Файл с результатами')
+        parser.add_argument('--check', action='store_true', help='Проверить бюджеты запросов')
+        parser.add_argument('--concurrency', action='store_true',
+                            help='Сравнить задержки чтения при параллельной записи для профилей SQLite '
+                                 '(тестовая база создается во временном файле)')
+        parser.add_argument('--duration', type=float, default=3.0, help='Длительность замера параллельной работы')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        temp_dir = None
+        if options['concurrency'] and connection.vendor == 'sqlite':
+            """Параллельный доступ к базе в памяти не показателен, поэтому нужен файл"""
+            temp_dir = tempfile.TemporaryDirectory()
+            connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir.name, 'benchmark.sqlite3')
+        """Строка журнала на каждый запрос замера не нужна"""
+        logging.getLogger('rembaza_app.perf').setLevel(logging.WARNING)
+        setup_test_environment(debug=settings.DEBUG)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = benchmark.run(options['sizes'], options['repeat'], options['operations'])
+            rendering = benchmark.measure_table_rendering(max(options['sizes']), options['repeat'])
+            concurrency = None
+            if options['concurrency']:
+                concurrency = benchmark.compare_sqlite_profiles(options['duration'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if temp_dir is not None:
+                temp_dir.cleanup()
+
+        data = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'results': report,
+            'rendering': rendering,
+            'concurrency': concurrency,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+        over_budget = []
+        for size, result in report.items():
+            self.stdout.write(f'--- {size} записей (заполнение {result["seed_seconds"]:.1f} с)')
+            for name, item in result['urls'].items():
+                self.stdout.write(f'{name:24} {item["queries"]:3} запр. {item["cold_ms"]:9.1f} мс '
+                                  f'(из кэша {item["warm_ms"]:7.1f} мс) {item["peak_kb"]:9.0f} КБ')
+                if item['budget'] is not None and item['queries'] > item['budget']:
+                    over_budget.append(f'{size}: {name} {item["queries"]} > {item["budget"]}')
+            for phase, item in result['signals'].items():
+                self.stdout.write(f'signals.{phase:16} {item["ops_per_sec"]:9.0f} оп/с '
+                                  f'{item["queries_per_op"]:5.1f} запр./оп')
+        for name, item in rendering.items():
+            self.stdout.write(f'rendering.{name:15} {item["ms_per_1000_rows"]:9.1f} мс на 1000 строк')
+        for profile, item in (concurrency or {}).items():
+            self.stdout.write(f'{profile:18} запись {item["writes_per_sec"]:7.0f} оп/с, '
+                              f'чтение {item["reads_per_sec"]:7.0f} оп/с, '
+                              f'p95 {item["read_p95_ms"] or 0:7.1f} мс, max {item["read_max_ms"] or 0:7.1f} мс, '
+                              f'ошибок {item["errors"]}')
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+        if options['check'] and over_budget:
+            raise CommandError('Превышены бюджеты запросов:\n' + '\n'.join(over_budget))
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,147 @@
+import csv
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rembaza_app import aggregation
+from rembaza_app.models import MonthWorks, Work
+
+"""Команда массовой загрузки выполненных работ из CSV или XLSX:
+ - файл читается потоково порциями по --chunk-size строк,
+ - каждая порция записывается одним bulk_create без сигналов по каждой строке,
+ - наименования работ порции сверяются со справочником Work одним запросом,
+ - после каждой порции затронутые строки итогов пересчитываются одним сгруппированным запросом,
+ - с ключом --dry-run файл только проверяется, в базу ничего не записывается
+
+Первая строка файла - заголовок с названиями колонок:
+ type_work, year, month, completed_works, description, volume, summ.
+Вид работ и месяц можно указывать номером или названием ("Вода", "Январь")."""
+
+COLUMNS = ('type_work', 'year', 'month', 'completed_works', 'description', 'volume', 'summ')
+
+
+class Command(BaseCommand):
+    help = 'Массовая загрузка выполненных работ MonthWorks из CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--format', choices=('csv', 'xlsx'),
+                            help='Формат файла (по умолчанию определяется по расширению)')
+        parser.add_argument('--delimiter', default=',', help='Разделитель колонок CSV')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Кодировка CSV')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Количество строк в порции')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл без записи в базу')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lower().lstrip('.')
+        if file_format == 'csv':
+            rows = self.read_csv(path, options['delimiter'], options['encoding'])
+        elif file_format == 'xlsx':
+            rows = self.read_xlsx(path)
+        else:
+            raise CommandError(f'Неизвестный формат файла: {path.suffix}')
+
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+        total = 0
+        errors = []
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                works = []
+                for line, data in chunk:
+                    try:
+                        works.append(self.build_work(data))
+                    except ValidationError as e:
+                        errors.append(f'Строка {line}: ' + '; '.join(
+                            f'{field}: {" ".join(messages)}' for field, messages in e.message_dict.items()))
+                total += len(chunk)
+                if errors and not dry_run:
+                    raise CommandError('\n'.join(errors))
+                if dry_run:
+                    continue
+                Work.objects.assign(works)
+                MonthWorks.objects.bulk_create(works, batch_size=chunk_size)
+                aggregation.recompute({(w.type_work, w.year, w.work_id) for w in works})
+
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else total
+        if dry_run:
+            for error in errors:
+                self.stderr.write(error)
+            self.stdout.write(f'Проверено строк: {total}, ошибок: {len(errors)} '
+                              f'за {elapsed:.2f} с ({rate:.0f} строк/с)')
+            if errors:
+                raise CommandError('Файл содержит ошибки')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Загружено строк: {total} за {elapsed:.2f} с ({rate:.0f} строк/с)'))
+
+    @staticmethod
+    def read_csv(path, delimiter, encoding):
+        """Потоковое чтение CSV: (номер строки, словарь значений)"""
+        with open(path, newline='', encoding=encoding) as f:
+            reader = csv.DictReader(f, delimiter=delimiter)
+            missing = set(COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f'В файле нет колонок: {", ".join(sorted(missing))}')
+            for line, data in enumerate(reader, start=2):
+                yield line, data
+
+    @staticmethod
+    def read_xlsx(path):
+        """Потоковое чтение XLSX в режиме read_only: (номер строки, словарь значений)"""
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise CommandError('Для загрузки XLSX нужен пакет openpyxl')
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+            missing = set(COLUMNS) - set(header)
+            if missing:
+                raise CommandError(f'В файле нет колонок: {", ".join(sorted(missing))}')
+            for line, values in enumerate(rows, start=2):
+                if not any(value is not None for value in values):
+                    continue
+                yield line, dict(zip(header, values))
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def choice_value(value, choices):
+        """Значение поля с выбором по номеру или по названию"""
+        labels = {str(label).lower(): number for number, label in choices}
+        text = str(value).strip()
+        if text.lower() in labels:
+            return labels[text.lower()]
+        try:
+            return int(float(text))
+        except ValueError:
+            return text
+
+    def build_work(self, data):
+        """Создание и проверка объекта MonthWorks без записи в базу"""
+        work = MonthWorks(
+            type_work=self.choice_value(data.get('type_work', ''), MonthWorks.TYPE_CHOICES),
+            year=self.choice_value(data.get('year', ''), ()),
+            month=self.choice_value(data.get('month', ''), MonthWorks.MONTH_CHOICES),
+            completed_works=str(data.get('completed_works') or '').strip(),
+            description=str(data.get('description') or ''),
+            volume=str(data.get('volume') or 0).replace(',', '.'),
+            summ=str(data.get('summ') or 0).replace(',', '.'),
+        )
+        work.clean_fields(exclude=['work'])
+        return work
@@ -0,0 +1,112 @@
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.urls import reverse
+
+from rembaza_app import benchmark
+from rembaza_app.models import MonthWorks
+
+"""Команда нагрузочного замера страниц отчетов под WSGI и ASGI:
+ - для каждого варианта запускает uvicorn в отдельном процессе: WSGI (rembaza_pr.wsgi, синхронные
+ представления в пуле потоков) и ASGI (rembaza_pr.asgi, асинхронные представления из async_views,
+ включенные для замера переменной REMBAZA_ASYNC_VIEWS),
+ - нагружает страницы выбора года, года, месяца и годовых таблиц заданным числом параллельных клиентов,
+ - выводит запросы в секунду и задержки p50/p95/p99 и сохраняет результаты в JSON,
+ - с ключом --uncached сервер запускается с кэшем страниц 'dummy' (REMBAZA_CACHE_ALIAS),
+ и каждая страница строится заново,
+ - страницы только читаются из рабочей базы; uvicorn устанавливается отдельно (pip install uvicorn)"""
+
+"""Варианты запуска: (приложение, интерфейс uvicorn, значение REMBAZA_ASYNC_VIEWS)"""
+SERVERS = {
+    'wsgi': ('rembaza_pr.wsgi:application', 'wsgi', '0'),
+    'asgi': ('rembaza_pr.asgi:application', 'asgi3', '1'),
+}
+
+"""Страницы нагрузки: (имя адреса, параметры)"""
+DASHBOARD_URLS = [
+    ('years', ()),
+    ('year_detail', ('year',)),
+    ('monthworks_list', ('year', 'month')),
+    ('watertable', ('year',)),
+    ('severagetable', ('year',)),
+]
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный замер страниц отчетов под WSGI и ASGI (uvicorn)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[50, 100, 200],
+                            help='Количество параллельных клиентов')
+        parser.add_argument('--duration', type=float, default=10.0, help='Длительность замера в секундах')
+        parser.add_argument('--servers', nargs='+', choices=list(SERVERS), default=list(SERVERS),
+                            help='Варианты запуска')
+        parser.add_argument('--year', type=int, help='Год отчетов (по умолчанию последний год с работами)')
+        parser.add_argument('--month', type=int, default=1, help='Месяц страницы работ')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--uncached', action='store_true',
+                            help='Строить страницу на каждый запрос, не используя кэш страниц')
+        parser.add_argument('--output', default='loadtest_output.json', help='Файл с результатами')
+
+    def handle(self, *args, **options):
+        if importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('Для нагрузочного замера нужен uvicorn: pip install uvicorn')
+        year = options['year'] or MonthWorks.objects.aggregate(year=Max('year'))['year']
+        if year is None:
+            raise CommandError('В базе нет работ; укажите год ключом --year')
+        values = {'year': year, 'month': options['month']}
+        paths = [reverse(name, args=[values[param] for param in params]) for name, params in DASHBOARD_URLS]
+
+        results = {}
+        for server in options['servers']:
+            process = self.start_server(server, options['host'], options['port'], options['uncached'])
+            try:
+                benchmark.measure_server_load(options['host'], options['port'], paths, 1, 1.0)
+                results[server] = [
+                    benchmark.measure_server_load(options['host'], options['port'], paths, clients,
+                                                  options['duration'])
+                    for clients in options['clients']]
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({'year': year, 'paths': paths, 'uncached': options['uncached'], 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        for server, items in results.items():
+            for item in items:
+                self.stdout.write(f'{server} {item["clients"]:4} клиентов {item["requests_per_sec"]:8.0f} запр./с '
+                                  f'p50 {item["p50_ms"] or 0:7.1f} мс, p95 {item["p95_ms"] or 0:7.1f} мс, '
+                                  f'p99 {item["p99_ms"] or 0:7.1f} мс, ошибок {item["errors"]}')
+        self.stdout.write(f'Результаты сохранены в {options["output"]}')
+
+    @staticmethod
+    def start_server(server, host, port, uncached=False, timeout=30):
+        """Запуск uvicorn и ожидание, пока порт начнет принимать соединения"""
+        app, interface, async_views = SERVERS[server]
+        env = dict(os.environ, REMBAZA_PERF_LOG_LEVEL='WARNING', REMBAZA_ASYNC_VIEWS=async_views)
+        if uncached:
+            env['REMBAZA_CACHE_ALIAS'] = 'dummy'
+        process = subprocess.Popen([sys.executable, '-m', 'uvicorn', app, '--interface', interface,
+                                    '--host', host, '--port', str(port), '--log-level', 'warning',
+                                    '--no-access-log'], cwd=settings.BASE_DIR, env=env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Сервер {server} завершился с кодом {process.returncode}')
+            try:
+                with socket.create_connection((host, port), timeout=1):
+                    return process
+            except OSError:
+                time.sleep(0.2)
+        process.terminate()
+        raise CommandError(f'Сервер {server} не начал принимать соединения за {timeout} с')
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rembaza_app import aggregation
+from rembaza_app.models import Work
+
+"""Команда перестроения свернутых итогов WorkRollup, из которых строятся годовые таблицы,
+по данным MonthWorks:
+ - итоги за год (или за все годы) считаются одним запросом GROUP BY,
+ - вместе с ними перестраиваются годовые итоги YearSummary,
+ - строки обновляются bulk_update, недостающие создаются bulk_create, лишние удаляются,
+ - с ключом --verify только сравнивает сохраненные итоги с пересчитанными и завершается
+ с ошибкой при расхождениях (для ежедневной проверки по расписанию)"""
+
+
+class Command(BaseCommand):
+    help = 'Перестроение годовых таблиц по данным MonthWorks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Отчетный год (по умолчанию все годы)')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только сравнить сохраненные итоги с пересчитанными')
+
+    def handle(self, *args, **options):
+        year = options['year']
+        started = time.perf_counter()
+
+        if options['verify']:
+            differences = aggregation.verify(year)
+            names = dict(Work.objects.filter(id__in={key[2] for key, _, _ in differences})
+                         .values_list('id', 'name'))
+            for (type_work, row_year, work_id, month), stored, expected in differences:
+                period = row_year if month is None else f'{row_year}/{month}'
+                work = 'итог месяца' if work_id is None else f'"{names.get(work_id, work_id)}"'
+                self.stdout.write(f'{period} вид {type_work} {work}: '
+                                  f'сохранено {stored or "нет строки"}, ожидается {expected or "нет строки"}')
+            if differences:
+                raise CommandError(f'Найдено расхождений: {len(differences)}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Расхождений нет ({time.perf_counter() - started:.2f} с)'))
+            return
+
+        updated, created, deleted = aggregation.rebuild(year)
+        self.stdout.write(f'Строк итогов: обновлено {updated}, создано {created}, удалено {deleted}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Годовые таблицы перестроены за {time.perf_counter() - started:.2f} с'))
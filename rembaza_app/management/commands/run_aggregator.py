@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rembaza_app import aggregation
+
+"""Обработчик очереди пересчета итогов (режим REMBAZA_AGGREGATION_MODE = 'queue'):
+ - раз в интервал пересчитывает итоги работ, отмеченных в очереди DirtyWork,
+ каждую работу один раз, сколько бы записей MonthWorks по ней ни изменилось,
+ - с ключом --once обрабатывает очередь один раз и завершается (для запуска по расписанию)"""
+
+
+class Command(BaseCommand):
+    help = 'Пересчет итогов годовых таблиц по очереди измененных работ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0, help='Пауза между проходами, секунды')
+        parser.add_argument('--batch-size', type=int, default=500, help='Размер пакета записи итогов')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            processed = aggregation.process_queue(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Пересчитано работ: {processed} за {time.perf_counter() - started:.2f} с')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
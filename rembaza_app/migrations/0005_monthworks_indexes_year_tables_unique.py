@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_rows(apps, schema_editor):
+    """Удаление дубликатов строк годовых таблиц перед созданием уникального ограничения:
+     - остается строка с наименьшим id,
+     - итоги оставшихся строк восстанавливаются командой rebuild_aggregates"""
+    for model_name in ('WaterTable', 'SeverageTable'):
+        model = apps.get_model('rembaza_app', model_name)
+        seen = set()
+        duplicates = []
+        for pk, year, completed_works in model.objects.order_by('pk').values_list('pk', 'year', 'completed_works'):
+            if (year, completed_works) in seen:
+                duplicates.append(pk)
+            seen.add((year, completed_works))
+        if duplicates:
+            model.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0004_monthworks_year_severagetable_year_watertable_year'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='monthworks',
+            index=models.Index(fields=['year', 'month', 'type_work'], name='monthworks_year_month_type_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='watertable',
+            constraint=models.UniqueConstraint(fields=('year', 'completed_works'), name='watertable_year_work_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='severagetable',
+            constraint=models.UniqueConstraint(fields=('year', 'completed_works'), name='severagetable_year_work_unique'),
+        ),
+    ]
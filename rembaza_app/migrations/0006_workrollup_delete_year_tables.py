@@ -0,0 +1,49 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_rollup(apps, schema_editor):
+    """Заполнение свернутых итогов по данным MonthWorks одним запросом GROUP BY"""
+    MonthWorks = apps.get_model('rembaza_app', 'MonthWorks')
+    WorkRollup = apps.get_model('rembaza_app', 'WorkRollup')
+    rows = (MonthWorks.objects.order_by()
+            .values_list('type_work', 'year', 'completed_works', 'month')
+            .annotate(total_volume=Sum('volume'), total_summ=Sum('summ')))
+    WorkRollup.objects.bulk_create(
+        [WorkRollup(type_work=type_work, year=year, completed_works=completed_works, month=month,
+                    volume=volume or 0.0, summ=summ or 0)
+         for type_work, year, completed_works, month, volume, summ in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0005_monthworks_indexes_year_tables_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_work', models.IntegerField(choices=[(1, 'Вода'), (2, 'Канализация')])),
+                ('year', models.IntegerField()),
+                ('completed_works', models.CharField(max_length=255)),
+                ('month', models.IntegerField(choices=[(1, 'Январь'), (2, 'Февраль'), (3, 'Март'), (4, 'Апрель'), (5, 'Май'), (6, 'Июнь'), (7, 'Июль'), (8, 'Август'), (9, 'Сентябрь'), (10, 'Октябрь'), (11, 'Ноябрь'), (12, 'Декабрь')])),
+                ('volume', models.FloatField(default=0.0)),
+                ('summ', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('type_work', 'year', 'completed_works', 'month'), name='workrollup_key_unique')],
+            },
+        ),
+        migrations.RunPython(fill_rollup, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='SeverageTable',
+        ),
+        migrations.DeleteModel(
+            name='WaterTable',
+        ),
+    ]
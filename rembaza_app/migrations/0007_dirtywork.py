@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0006_workrollup_delete_year_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyWork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_work', models.IntegerField(choices=[(1, 'Вода'), (2, 'Канализация')])),
+                ('year', models.IntegerField()),
+                ('completed_works', models.CharField(max_length=255)),
+            ],
+        ),
+    ]
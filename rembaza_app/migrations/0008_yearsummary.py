@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+
+def fill_summaries(apps, schema_editor):
+    """Заполнение годовых итогов по строкам WorkRollup одним запросом GROUP BY"""
+    WorkRollup = apps.get_model('rembaza_app', 'WorkRollup')
+    YearSummary = apps.get_model('rembaza_app', 'YearSummary')
+    quarters = {'first_quarter': (1, 2, 3), 'second_quarter': (4, 5, 6),
+                'third_quarter': (7, 8, 9), 'fourth_quarter': (10, 11, 12)}
+    rows = (WorkRollup.objects.order_by()
+            .values('type_work', 'year', 'completed_works')
+            .annotate(year_total=Sum('summ'),
+                      **{field: Sum('summ', filter=Q(month__in=months)) for field, months in quarters.items()}))
+    YearSummary.objects.bulk_create(
+        [YearSummary(**{field: value or 0 for field, value in row.items()}) for row in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0007_dirtywork'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YearSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_work', models.IntegerField(choices=[(1, 'Вода'), (2, 'Канализация')])),
+                ('year', models.IntegerField()),
+                ('completed_works', models.CharField(max_length=255)),
+                ('first_quarter', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('second_quarter', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('third_quarter', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('fourth_quarter', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+                ('year_total', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('type_work', 'year', 'completed_works'), name='yearsummary_key_unique')],
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
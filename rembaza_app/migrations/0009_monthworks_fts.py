@@ -0,0 +1,59 @@
+from django.db import migrations
+
+"""Индекс FTS5 и триггеры в том виде, в каком они созданы этой миграцией;
+текущий код поиска (rembaza_app.search) не используется, чтобы миграция не зависела от его изменений"""
+
+CREATE_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS rembaza_app_monthworks_fts USING fts5(
+    completed_works, description,
+    content='rembaza_app_monthworks', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)"""
+
+TRIGGERS = {
+    'rembaza_app_monthworks_fts_insert': """CREATE TRIGGER IF NOT EXISTS rembaza_app_monthworks_fts_insert
+AFTER INSERT ON rembaza_app_monthworks BEGIN
+    INSERT INTO rembaza_app_monthworks_fts(rowid, completed_works, description)
+    VALUES (new.id, new.completed_works, new.description);
+END""",
+    'rembaza_app_monthworks_fts_delete': """CREATE TRIGGER IF NOT EXISTS rembaza_app_monthworks_fts_delete
+AFTER DELETE ON rembaza_app_monthworks BEGIN
+    INSERT INTO rembaza_app_monthworks_fts(rembaza_app_monthworks_fts, rowid, completed_works, description)
+    VALUES ('delete', old.id, old.completed_works, old.description);
+END""",
+    'rembaza_app_monthworks_fts_update': """CREATE TRIGGER IF NOT EXISTS rembaza_app_monthworks_fts_update
+AFTER UPDATE OF completed_works, description ON rembaza_app_monthworks BEGIN
+    INSERT INTO rembaza_app_monthworks_fts(rembaza_app_monthworks_fts, rowid, completed_works, description)
+    VALUES ('delete', old.id, old.completed_works, old.description);
+    INSERT INTO rembaza_app_monthworks_fts(rowid, completed_works, description)
+    VALUES (new.id, new.completed_works, new.description);
+END""",
+}
+
+
+def install(apps, schema_editor):
+    """Создание индекса и триггеров и заполнение индекса по MonthWorks (только SQLite)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE)
+    for sql in TRIGGERS.values():
+        schema_editor.execute(sql)
+    schema_editor.execute("INSERT INTO rembaza_app_monthworks_fts(rembaza_app_monthworks_fts) VALUES ('rebuild')")
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in TRIGGERS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    schema_editor.execute("DROP TABLE IF EXISTS rembaza_app_monthworks_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0008_yearsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
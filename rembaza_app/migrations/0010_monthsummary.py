@@ -0,0 +1,41 @@
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_summaries(apps, schema_editor):
+    """Заполнение итогов месяцев по записям MonthWorks одним запросом GROUP BY"""
+    MonthWorks = apps.get_model('rembaza_app', 'MonthWorks')
+    MonthSummary = apps.get_model('rembaza_app', 'MonthSummary')
+    rows = (MonthWorks.objects.order_by()
+            .values('type_work', 'year', 'month')
+            .annotate(count=Count('pk'), volume=Sum('volume'), summ=Sum('summ')))
+    MonthSummary.objects.bulk_create(
+        [MonthSummary(**{field: value or 0 for field, value in row.items()}) for row in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0009_monthworks_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_work', models.IntegerField(choices=[(1, 'Вода'), (2, 'Канализация')])),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField(choices=[(1, 'Январь'), (2, 'Февраль'), (3, 'Март'), (4, 'Апрель'), (5, 'Май'), (6, 'Июнь'), (7, 'Июль'), (8, 'Август'), (9, 'Сентябрь'), (10, 'Октябрь'), (11, 'Ноябрь'), (12, 'Декабрь')])),
+                ('count', models.IntegerField(default=0)),
+                ('volume', models.FloatField(default=0.0)),
+                ('summ', models.DecimalField(decimal_places=2, default=0.0, max_digits=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('year', 'month', 'type_work'), name='monthsummary_key_unique')],
+            },
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
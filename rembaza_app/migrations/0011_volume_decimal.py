@@ -0,0 +1,76 @@
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Func, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+
+"""Разница, меньше которой отличие от округленного значения считается шумом двоичной дроби"""
+FLOAT_NOISE = 1e-9
+
+
+def round3(expression, output_field=None):
+    return Func(expression, 3, function='ROUND',
+                output_field=output_field or DecimalField(max_digits=20, decimal_places=3))
+
+
+def check_volumes(apps, schema_editor):
+    """Проверка до смены типа поля: объем каждой записи MonthWorks должен помещаться в три знака
+    (с точностью до шума двоичной дроби), иначе миграция останавливается со списком таких записей,
+    чтобы их объем был исправлен вручную, а не округлен незаметно"""
+    MonthWorks = apps.get_model('rembaza_app', 'MonthWorks')
+    lossy = list(MonthWorks.objects
+                 .alias(loss=Abs(F('volume') - round3(F('volume'), models.FloatField())))
+                 .filter(loss__gt=FLOAT_NOISE)
+                 .order_by('pk')
+                 .values_list('pk', 'volume'))
+    if lossy:
+        rows = ', '.join(f'id {pk}: {volume!r}' for pk, volume in lossy)
+        raise ValueError(f'Объем {len(lossy)} записей MonthWorks не помещается в три знака после запятой, '
+                         f'исправьте эти записи и повторите миграцию: {rows}')
+
+
+def round_volumes(apps, schema_editor):
+    """Округление объемов записей MonthWorks до трех знаков и пересчет объемов итогов по округленным записям:
+     - SQLite при смене типа поля копирует значения как есть, вместе с шумом двоичной дроби (0.30000000000000004),
+     записей с большей потерей точности нет (check_volumes),
+     - объемы WorkRollup и MonthSummary не округляются по отдельности, а пересчитываются одним запросом UPDATE
+     на таблицу как суммы округленных записей, поэтому итоги совпадают с записями"""
+    MonthWorks = apps.get_model('rembaza_app', 'MonthWorks')
+    WorkRollup = apps.get_model('rembaza_app', 'WorkRollup')
+    MonthSummary = apps.get_model('rembaza_app', 'MonthSummary')
+
+    MonthWorks.objects.update(volume=round3(F('volume')))
+
+    def total(queryset, *fields):
+        rows = queryset.filter(**{field: OuterRef(field) for field in fields}).order_by().values(*fields)
+        volume = rows.annotate(total=round3(Sum('volume'))).values('total')
+        output_field = DecimalField(max_digits=20, decimal_places=3)
+        return Coalesce(Subquery(volume, output_field=output_field), Value(0), output_field=output_field)
+
+    WorkRollup.objects.update(volume=total(MonthWorks.objects.all(), 'type_work', 'year', 'completed_works', 'month'))
+    MonthSummary.objects.update(volume=total(MonthWorks.objects.all(), 'type_work', 'year', 'month'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0010_monthsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_volumes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='monthworks',
+            name='volume',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='workrollup',
+            name='volume',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='monthsummary',
+            name='volume',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.RunPython(round_volumes, migrations.RunPython.noop),
+    ]
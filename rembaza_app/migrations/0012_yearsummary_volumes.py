@@ -0,0 +1,62 @@
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+"""Поля объемов по кварталам и месяцы кварталов"""
+QUARTERS = {'first_quarter_vol': (1, 2, 3), 'second_quarter_vol': (4, 5, 6),
+            'third_quarter_vol': (7, 8, 9), 'fourth_quarter_vol': (10, 11, 12)}
+
+
+def fill_volumes(apps, schema_editor):
+    """Заполнение объемов по кварталам и за год одним запросом UPDATE к YearSummary:
+    значения берутся подзапросами к строкам WorkRollup той же работы"""
+    WorkRollup = apps.get_model('rembaza_app', 'WorkRollup')
+    YearSummary = apps.get_model('rembaza_app', 'YearSummary')
+    rows = (WorkRollup.objects.order_by()
+            .filter(type_work=OuterRef('type_work'), year=OuterRef('year'),
+                    completed_works=OuterRef('completed_works'))
+            .values('type_work', 'year', 'completed_works'))
+    output_field = DecimalField(max_digits=20, decimal_places=3)
+
+    def total(condition=Q()):
+        volume = rows.annotate(total=Sum('volume', filter=condition or None)).values('total')
+        return Coalesce(Subquery(volume, output_field=output_field), Value(0), output_field=output_field)
+
+    YearSummary.objects.update(year_total_vol=total(),
+                               **{field: total(Q(month__in=months)) for field, months in QUARTERS.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0011_volume_decimal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='yearsummary',
+            name='first_quarter_vol',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='yearsummary',
+            name='second_quarter_vol',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='yearsummary',
+            name='third_quarter_vol',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='yearsummary',
+            name='fourth_quarter_vol',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='yearsummary',
+            name='year_total_vol',
+            field=models.DecimalField(decimal_places=3, default=0.0, max_digits=20),
+        ),
+        migrations.RunPython(fill_volumes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,154 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery, Sum
+
+"""Поля сумм и объемов по кварталам YearSummary и месяцы кварталов"""
+QUARTERS = {'first_quarter': (1, 2, 3), 'second_quarter': (4, 5, 6),
+            'third_quarter': (7, 8, 9), 'fourth_quarter': (10, 11, 12)}
+
+
+def normalize_name(name):
+    return ' '.join(str(name).split())
+
+
+def fill_catalog(apps, schema_editor):
+    """Заполнение справочника работ и ссылок на него:
+     - наименования MonthWorks приводятся к виду без лишних пробелов, одинаковые после этого
+     наименования становятся одной работой справочника,
+     - ссылка MonthWorks.work заполняется одним запросом UPDATE с подзапросом по наименованию,
+     - итоги WorkRollup и YearSummary строятся заново сгруппированными запросами по id работы
+     (после объединения наименований прежние строки итогов могли совпасть по ключу),
+     очередь DirtyWork очищается: все итоги уже пересчитаны"""
+    Work = apps.get_model('rembaza_app', 'Work')
+    MonthWorks = apps.get_model('rembaza_app', 'MonthWorks')
+    WorkRollup = apps.get_model('rembaza_app', 'WorkRollup')
+    YearSummary = apps.get_model('rembaza_app', 'YearSummary')
+    DirtyWork = apps.get_model('rembaza_app', 'DirtyWork')
+
+    names = set(MonthWorks.objects.values_list('completed_works', flat=True).distinct())
+    for name in names:
+        if normalize_name(name) != name:
+            MonthWorks.objects.filter(completed_works=name).update(completed_works=normalize_name(name))
+    Work.objects.bulk_create([Work(name=name) for name in {normalize_name(name) for name in names}],
+                             batch_size=500)
+    MonthWorks.objects.update(
+        work=Subquery(Work.objects.filter(name=OuterRef('completed_works')).values('id')[:1]))
+
+    DirtyWork.objects.all().delete()
+    WorkRollup.objects.all().delete()
+    YearSummary.objects.all().delete()
+    rows = (MonthWorks.objects.order_by()
+            .values('type_work', 'year', 'work', 'month')
+            .annotate(total_volume=Sum('volume'), total_summ=Sum('summ')))
+    WorkRollup.objects.bulk_create(
+        [WorkRollup(type_work=row['type_work'], year=row['year'], work_id=row['work'], month=row['month'],
+                    volume=row['total_volume'] or 0, summ=row['total_summ'] or 0) for row in rows],
+        batch_size=500,
+    )
+    annotations = {'year_total': Sum('summ'), 'year_total_vol': Sum('volume')}
+    for field, months in QUARTERS.items():
+        annotations[field] = Sum('summ', filter=Q(month__in=months))
+        annotations[f'{field}_vol'] = Sum('volume', filter=Q(month__in=months))
+    rows = (WorkRollup.objects.order_by()
+            .values('type_work', 'year', 'work')
+            .annotate(**annotations))
+    YearSummary.objects.bulk_create(
+        [YearSummary(type_work=row['type_work'], year=row['year'], work_id=row['work'],
+                     **{field: row[field] or 0 for field in annotations}) for row in rows],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rembaza_app', '0012_yearsummary_volumes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Work',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='workrollup',
+            name='workrollup_key_unique',
+        ),
+        migrations.RemoveConstraint(
+            model_name='yearsummary',
+            name='yearsummary_key_unique',
+        ),
+        migrations.RemoveField(
+            model_name='workrollup',
+            name='completed_works',
+        ),
+        migrations.RemoveField(
+            model_name='yearsummary',
+            name='completed_works',
+        ),
+        migrations.RemoveField(
+            model_name='dirtywork',
+            name='completed_works',
+        ),
+        migrations.AddField(
+            model_name='monthworks',
+            name='work',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT,
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AddField(
+            model_name='workrollup',
+            name='work',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AddField(
+            model_name='yearsummary',
+            name='work',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AddField(
+            model_name='dirtywork',
+            name='work',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='monthworks',
+            name='work',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT,
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AlterField(
+            model_name='workrollup',
+            name='work',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AlterField(
+            model_name='yearsummary',
+            name='work',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AlterField(
+            model_name='dirtywork',
+            name='work',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                    to='rembaza_app.work'),
+        ),
+        migrations.AddConstraint(
+            model_name='workrollup',
+            constraint=models.UniqueConstraint(fields=('type_work', 'year', 'work', 'month'),
+                                               name='workrollup_key_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='yearsummary',
+            constraint=models.UniqueConstraint(fields=('type_work', 'year', 'work'), name='yearsummary_key_unique'),
+        ),
+    ]
@@ -1,9 +1,56 @@
-from django.db import models
+from django.db import models, transaction
 from datetime import datetime
 
 """Генератор списка отчетных годов"""
 YEAR_CHOICES = [(y, y) for y in range(2024, datetime.now().year + 2)]
 
+def normalize_name(name):
+    """Наименование работы без пробелов по краям и повторных пробелов внутри"""
+    return ' '.join(str(name).split())
+
+
+class WorkManager(models.Manager):
+    def ids_for(self, names):
+        """Идентификаторы работ справочника по наименованиям {наименование: id}:
+         - существующие работы читаются одним запросом по уникальному индексу наименования,
+         - недостающие добавляются одним INSERT ... ON CONFLICT, который возвращает id
+         и для работ, параллельно добавленных другой транзакцией"""
+        names = {normalize_name(name) for name in names}
+        ids = dict(self.filter(name__in=names).values_list('name', 'id'))
+        missing = names - set(ids)
+        if missing:
+            created = self.bulk_create([self.model(name=name) for name in missing],
+                                       update_conflicts=True, unique_fields=['name'], update_fields=['name'])
+            ids.update((work.name, work.id) for work in created)
+        return ids
+
+    def assign(self, works):
+        """Приведение наименований записей MonthWorks к виду справочника и заполнение ссылки work
+        (для bulk_create, который не вызывает MonthWorks.save)"""
+        for work in works:
+            work.completed_works = normalize_name(work.completed_works)
+        ids = self.ids_for(work.completed_works for work in works)
+        for work in works:
+            work.work_id = ids[work.completed_works]
+        return works
+
+
+"""Справочник наименований работ:
+ - одна строка на наименование, заполняется автоматически при сохранении MonthWorks,
+ - итоги WorkRollup, YearSummary и очередь DirtyWork ссылаются на работу по целому id,
+ поэтому поиск строки итогов идет по индексу из чисел, а не по сравнению строк,
+ - наименования, отличающиеся только пробелами, считаются одной работой"""
+
+
+class Work(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    objects = WorkManager()
+
+    def __str__(self):
+        return self.name
+
+
 """Модель для фиксации выполненных работ за каждый месяц
  - заполняется в админ-панели,
  - перед внесением данных нужно выбрать в выпадающем списке год,
@@ -35,93 +82,119 @@ class MonthWorks(models.Model):
     year = models.IntegerField(choices=YEAR_CHOICES, default=datetime.now().year)
     month = models.IntegerField(choices=MONTH_CHOICES)
     completed_works = models.CharField(max_length=255)
+    work = models.ForeignKey(Work, on_delete=models.PROTECT, editable=False)
     description = models.TextField()
-    volume = models.FloatField(default=0.0)
+    volume = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
     summ = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
 
+    class Meta:
+        """Индекс под выборки страниц по году и месяцу и под поиск работ одного вида"""
+        indexes = [
+            models.Index(fields=['year', 'month', 'type_work'], name='monthworks_year_month_type_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Запись и обновление итогов в сигналах выполняются в одной транзакции
+        (удаление Django и так выполняет в транзакции); ссылка на справочник работ
+        заполняется по наименованию перед записью"""
+        with transaction.atomic(savepoint=False):
+            Work.objects.assign([self])
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return self.completed_works
 
 
-"""Модель для агрегации данных по воде за весь год
- - заполняется автоматически при внесении данных в таблицу MonthWorks 
-  в зависимости от установленного отчетного года"""
+"""Модель свернутых итогов выполненных работ:
+ - одна строка на вид работ, год, наименование и месяц с суммарными объемом и суммой,
+ - заполняется автоматически при внесении данных в таблицу MonthWorks,
+ - годовые таблицы по водоснабжению и водоотведению (и по любому новому виду работ)
+ строятся из нее одним запросом (см. pivot.year_table)"""
 
 
-class WaterTable(models.Model):
-    year = models.IntegerField(choices=YEAR_CHOICES, default=datetime.now().year)
-    completed_works = models.CharField(max_length=255)
-    january_vol = models.FloatField(null=True, blank=True, default=0.0)
-    january_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    february_vol = models.FloatField(null=True, blank=True, default=0.0)
-    february_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    march_vol = models.FloatField(null=True, blank=True, default=0.0)
-    march_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    first_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    april_vol = models.FloatField(null=True, blank=True, default=0.0)
-    april_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    may_vol = models.FloatField(null=True, blank=True, default=0.0)
-    may_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    june_vol = models.FloatField(null=True, blank=True, default=0.0)
-    june_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    second_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    july_vol = models.FloatField(null=True, blank=True, default=0.0)
-    july_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    august_vol = models.FloatField(null=True, blank=True, default=0.0)
-    august_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    september_vol = models.FloatField(null=True, blank=True, default=0.0)
-    september_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    third_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    october_vol = models.FloatField(null=True, blank=True, default=0.0)
-    october_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    november_vol = models.FloatField(null=True, blank=True, default=0.0)
-    november_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    december_vol = models.FloatField(null=True, blank=True, default=0.0)
-    december_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    fourth_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    year_total = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
+class WorkRollup(models.Model):
+    type_work = models.IntegerField(choices=MonthWorks.TYPE_CHOICES)
+    year = models.IntegerField()
+    work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='+')
+    month = models.IntegerField(choices=MonthWorks.MONTH_CHOICES)
+    volume = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    summ = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+
+    class Meta:
+        """Уникальный индекс по ключу строки; его начало (type_work, year) обслуживает выборку годовой таблицы"""
+        constraints = [
+            models.UniqueConstraint(fields=['type_work', 'year', 'work', 'month'],
+                                    name='workrollup_key_unique'),
+        ]
 
     def __str__(self):
-        return self.completed_works
+        return str(self.work)
+
+
+"""Модель годовых итогов работ для сравнения лет:
+ - одна строка на вид работ, год и наименование с суммами и объемами по кварталам и за год,
+ - поддерживается вместе с WorkRollup (см. aggregation), вручную не заполняется,
+ - сравнение нескольких лет читает только эти строки по индексу (вид работ, год)"""
+
+
+class YearSummary(models.Model):
+    type_work = models.IntegerField(choices=MonthWorks.TYPE_CHOICES)
+    year = models.IntegerField()
+    work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='+')
+    first_quarter = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    second_quarter = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    third_quarter = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    fourth_quarter = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    year_total = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+    first_quarter_vol = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    second_quarter_vol = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    third_quarter_vol = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    fourth_quarter_vol = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    year_total_vol = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['type_work', 'year', 'work'],
+                                    name='yearsummary_key_unique'),
+        ]
+
+    def __str__(self):
+        return str(self.work)
 
 
-"""Модель для агрегации данных по водоотведению за весь год
- - заполняется автоматически при внесении данных в таблицу MonthWorks
- в зависимости от установленного отчетного года"""
+"""Модель итогов месяца по видам работ:
+ - одна строка на год, месяц и вид работ с количеством работ, суммарным объемом и суммой,
+ - поддерживается вместе с WorkRollup (см. aggregation), вручную не заполняется,
+ - страница работ за месяц и страница года читают итоги отсюда, не суммируя записи MonthWorks;
+ уникальный индекс начинается с года и месяца, поэтому обслуживает обе выборки"""
 
 
-class SeverageTable(models.Model):
-    year = models.IntegerField(choices=YEAR_CHOICES, default=datetime.now().year)
-    completed_works = models.CharField(max_length=255)
-    january_vol = models.FloatField(null=True, blank=True, default=0.0)
-    january_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    february_vol = models.FloatField(null=True, blank=True, default=0.0)
-    february_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    march_vol = models.FloatField(null=True, blank=True, default=0.0)
-    march_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    first_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    april_vol = models.FloatField(null=True, blank=True, default=0.0)
-    april_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    may_vol = models.FloatField(null=True, blank=True, default=0.0)
-    may_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    june_vol = models.FloatField(null=True, blank=True, default=0.0)
-    june_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    second_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    july_vol = models.FloatField(null=True, blank=True, default=0.0)
-    july_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    august_vol = models.FloatField(null=True, blank=True, default=0.0)
-    august_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    september_vol = models.FloatField(null=True, blank=True, default=0.0)
-    september_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    third_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    october_vol = models.FloatField(null=True, blank=True, default=0.0)
-    october_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    november_vol = models.FloatField(null=True, blank=True, default=0.0)
-    november_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    december_vol = models.FloatField(null=True, blank=True, default=0.0)
-    december_summ = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    fourth_quarter = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
-    year_total = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True, default=0.00)
+class MonthSummary(models.Model):
+    type_work = models.IntegerField(choices=MonthWorks.TYPE_CHOICES)
+    year = models.IntegerField()
+    month = models.IntegerField(choices=MonthWorks.MONTH_CHOICES)
+    count = models.IntegerField(default=0)
+    volume = models.DecimalField(max_digits=20, decimal_places=3, default=0.0)
+    summ = models.DecimalField(max_digits=20, decimal_places=2, default=0.00)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month', 'type_work'], name='monthsummary_key_unique'),
+        ]
 
     def __str__(self):
-        return self.completed_works
+        return f"{self.get_type_work_display()} {self.month}.{self.year}"
+
+
+"""Очередь работ, итоги которых нужно пересчитать (режим REMBAZA_AGGREGATION_MODE = 'queue'):
+ - сигналы MonthWorks добавляют строку (вид работ, год, наименование) в той же транзакции, что и запись,
+ - команда run_aggregator пересчитывает каждую работу из очереди один раз и удаляет обработанные строки"""
+
+
+class DirtyWork(models.Model):
+    type_work = models.IntegerField(choices=MonthWorks.TYPE_CHOICES)
+    year = models.IntegerField()
+    work = models.ForeignKey(Work, on_delete=models.CASCADE, related_name='+')
+
+    def __str__(self):
+        return str(self.work)
@@ -0,0 +1,189 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import urlencode
+
+from . import aggregation
+from .pivot import WATER, SEVERAGE
+
+"""Кэш страниц отчетов:
+ - страница кэшируется по ключу (представление, год[, месяц]) в кэше REMBAZA_CACHE_ALIAS,
+ - у каждого ключа есть метка изменения; она входит в ключ кэша и ETag,
+ поэтому при неизменных данных браузер получает ответ 304 без построения страницы;
+ Last-Modified не отправляется: он хранит только секунды, и после второго изменения в ту же секунду
+ клиент с одним If-Modified-Since получил бы 304 со старой страницей,
+ - порции постраничной выдачи кэшируются отдельно; в ключ входят только параметры PAGE_PARAMS,
+ которые читают представления, поэтому произвольные параметры запроса не создают новых копий страницы,
+ - при изменении работ метка сдвигается только для страниц затронутых года, месяца и вида работ,
+ старые копии страниц перестают использоваться и удаляются по истечении таймаута,
+ - в режиме очереди страница не кэшируется, пока работы ее года и вида работ ждут пересчета
+ (aggregation.has_pending): иначе страница со старыми итогами осталась бы в кэше после run_aggregator,
+ - ответ TemplateResponse кладется в кэш после отрисовки (add_post_render_callback),
+ обработчик Django отрисовывает его уже после выхода из представления,
+ - декоратор cached_page подходит и для асинхронных представлений"""
+
+"""Страницы годовых таблиц по видам работ"""
+TABLE_VIEWS = {WATER: 'watertable', SEVERAGE: 'severagetable'}
+
+"""Параметры запроса, от которых зависит страница отчета (курсор и признак порции строк, см. pagination)"""
+PAGE_PARAMS = ('after', 'fragment')
+
+
+def _cache():
+    return caches[getattr(settings, 'REMBAZA_CACHE_ALIAS', 'default')]
+
+
+async def _acall(method, *args):
+    """Вызов метода кэша из асинхронного кода: кэш в памяти процесса вызывается напрямую
+    (он не блокирует цикл событий), остальные бэкенды - через асинхронный API (a-метод)"""
+    cache = _cache()
+    if isinstance(cache, LocMemCache):
+        return getattr(cache, method)(*args)
+    return await getattr(cache, f'a{method}')(*args)
+
+
+def _timeout():
+    return getattr(settings, 'REMBAZA_CACHE_TIMEOUT', 60 * 60)
+
+
+def _key(view_name, year, month=None):
+    return f"rembaza:{view_name}:{year}" if month is None else f"rembaza:{view_name}:{year}:{month}"
+
+
+def get_stamp(view_name, year, month=None):
+    """Метка последнего изменения страницы; создается при первом обращении"""
+    key = f"{_key(view_name, year, month)}:stamp"
+    stamp = _cache().get(key)
+    if stamp is None:
+        stamp = time.time()
+        if not _cache().add(key, stamp, None):
+            stamp = _cache().get(key, stamp)
+    return stamp
+
+
+async def aget_stamp(view_name, year, month=None):
+    """Асинхронный вариант get_stamp"""
+    key = f"{_key(view_name, year, month)}:stamp"
+    stamp = await _acall('get', key)
+    if stamp is None:
+        stamp = time.time()
+        if not await _acall('add', key, stamp, None):
+            stamp = await _acall('get', key, stamp)
+    return stamp
+
+
+def _bump(keys):
+    now = time.time()
+    _cache().set_many({f"{_key(*key)}:stamp": now for key in keys}, None)
+
+
+def page_keys(type_work, year, month):
+    """Страницы, которые зависят от работ с данным видом, годом и месяцем"""
+    keys = {('year_detail', year, None), ('monthworks_list', year, month)}
+    if type_work in TABLE_VIEWS:
+        keys.add((TABLE_VIEWS[type_work], year, None))
+    return keys
+
+
+def invalidate(changes):
+    """Сброс кэша страниц по набору (вид работ, год, месяц):
+     - метки сдвигаются сразу и повторно после фиксации транзакции, чтобы страницы,
+     построенные параллельными запросами до фиксации, тоже не использовались"""
+    keys = set()
+    for type_work, year, month in changes:
+        keys |= page_keys(type_work, year, month)
+    if not keys:
+        return
+    _bump(keys)
+    transaction.on_commit(lambda: _bump(keys))
+
+
+def _page_etag(request, view_name, year, month, stamp):
+    """ETag и ключ кэша страницы; страницы с разными значениями PAGE_PARAMS различаются"""
+    query = urlencode([(name, request.GET[name]) for name in PAGE_PARAMS if name in request.GET])
+    variant = hashlib.md5(query.encode()).hexdigest()[:16] if query else '0'
+    etag = quote_etag(f"{view_name}-{year}-{month or 0}-{stamp:.6f}-{variant}")
+    return etag, f"{_key(view_name, year, month)}:{stamp:.6f}:{variant}"
+
+
+def _is_unrendered(response):
+    """Ответ TemplateResponse, который обработчик Django отрисует после выхода из представления"""
+    return getattr(response, 'is_rendered', True) is False
+
+
+def _view_types(view_name):
+    """Виды работ страницы: у годовой таблицы один, у остальных страниц все (None)"""
+    types = {name: type_work for type_work, name in TABLE_VIEWS.items()}
+    return [types[view_name]] if view_name in types else None
+
+
+def _set_after_render(page_key, response):
+    """Сохранение страницы в кэш после отрисовки ответа"""
+    def store(response):
+        _cache().set(page_key, response, _timeout())
+
+    response.add_post_render_callback(store)
+
+
+def _with_etag(response, etag):
+    response['ETag'] = etag
+    return response
+
+
+def cached_page(view_name):
+    """Декоратор представления отчета с кэшем страницы и ответом 304 для неизмененных данных"""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, year, month=None, **kwargs):
+                if month is not None:
+                    kwargs['month'] = month
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, year, **kwargs)
+
+                stamp = await aget_stamp(view_name, year, month)
+                etag, page_key = _page_etag(request, view_name, year, month, stamp)
+                response = get_conditional_response(request, etag=etag)
+                if response is None:
+                    response = await _acall('get', page_key)
+                    if response is None:
+                        response = await view(request, year, **kwargs)
+                        if (response.status_code == 200
+                                and not await aggregation.ahas_pending(year, _view_types(view_name))):
+                            if _is_unrendered(response):
+                                _set_after_render(page_key, response)
+                            else:
+                                await _acall('set', page_key, response, _timeout())
+                return _with_etag(response, etag)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, year, month=None, **kwargs):
+            if month is not None:
+                kwargs['month'] = month
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, year, **kwargs)
+
+            stamp = get_stamp(view_name, year, month)
+            etag, page_key = _page_etag(request, view_name, year, month, stamp)
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = _cache().get(page_key)
+                if response is None:
+                    response = view(request, year, **kwargs)
+                    if response.status_code == 200 and not aggregation.has_pending(year, _view_types(view_name)):
+                        if _is_unrendered(response):
+                            _set_after_render(page_key, response)
+                        else:
+                            _cache().set(page_key, response, _timeout())
+            return _with_etag(response, etag)
+        return wrapper
+    return decorator
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.template.response import TemplateResponse
+from django.utils.encoding import force_bytes, force_str
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+"""Постраничная выдача по ключу (keyset) для страниц и API:
+ - выборка упорядочена по уникальному ключу, следующая порция начинается после ключа
+ последней строки (WHERE key > курсор LIMIT n + 1), поэтому запрос не зависит от номера страницы
+ и не требует COUNT(*),
+ - курсор - значение ключа в base64, передается параметром ?after= (в API - ?cursor=),
+ - render_page отдает полную страницу или, при ?fragment=1, только строки следующей порции
+ для догрузки по кнопке "Показать еще" (адрес следующей порции - в заголовке X-Next-Page)"""
+
+
+def page_size():
+    return getattr(settings, 'REMBAZA_PAGE_SIZE', 100)
+
+
+def encode_cursor(value):
+    return urlsafe_base64_encode(force_bytes(value))
+
+
+def decode_cursor(cursor):
+    try:
+        return force_str(urlsafe_base64_decode(cursor))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор')
+
+
+class KeysetPage:
+    """Порция строк и курсор следующей порции (None, если порция последняя)"""
+
+    def __init__(self, rows, next_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+
+
+def _after_cursor(queryset, key_field, cursor):
+    if not cursor:
+        return queryset
+    try:
+        return queryset.filter(**{f'{key_field}__gt': decode_cursor(cursor)})
+    except (ValueError, ValidationError):
+        raise ValueError('Некорректный курсор')
+
+
+def _page(rows, key_field, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if isinstance(last, dict):
+            key = last[key_field]
+        elif isinstance(last, tuple):
+            key = last[0]
+        else:
+            key = getattr(last, key_field)
+        next_cursor = encode_cursor(key)
+    return KeysetPage(rows, next_cursor)
+
+
+def keyset_page(queryset, key_field, cursor=None, limit=None):
+    """Порция строк выборки после курсора:
+     - выборка должна быть упорядочена по возрастанию уникального поля key_field,
+     - строки могут быть объектами моделей, словарями values() или кортежами values_list()
+     (у кортежей ключ - первая колонка),
+     - некорректный курсор - ValueError"""
+    limit = limit or page_size()
+    queryset = _after_cursor(queryset, key_field, cursor)
+    return _page(list(queryset[:limit + 1]), key_field, limit)
+
+
+async def akeyset_page(queryset, key_field, cursor=None, limit=None):
+    """Асинхронный вариант keyset_page: строки читаются через асинхронный ORM"""
+    limit = limit or page_size()
+    queryset = _after_cursor(queryset, key_field, cursor)
+    return _page([row async for row in queryset[:limit + 1]], key_field, limit)
+
+
+def page_url(request, cursor, param='after', keep=None):
+    """Адрес следующей порции: текущие параметры запроса с новым курсором;
+    keep - параметры, которые переносятся в адрес (если не задан, переносятся все, кроме fragment)"""
+    if not cursor:
+        return None
+    params = request.GET.copy()
+    for name in list(params):
+        if name == 'fragment' or keep is not None and name not in keep:
+            del params[name]
+    params[param] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+def is_fragment(request):
+    """Запрошены только строки следующей порции (?fragment=1)"""
+    return bool(request.GET.get('fragment'))
+
+
+def render_page(request, template, rows_template, context, page):
+    """Полная страница с первой порцией строк или, при ?fragment=1, только строки порции;
+    строки передаются в шаблоны как rows, адрес следующей порции - как next_url"""
+    next_url = page_url(request, page.next_cursor, keep=())
+    context = dict(context, rows=page.rows, next_url=next_url)
+    if not is_fragment(request):
+        return TemplateResponse(request, template, context)
+    response = TemplateResponse(request, rows_template, context)
+    if next_url:
+        response['X-Next-Page'] = next_url
+    return response
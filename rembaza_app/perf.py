@@ -0,0 +1,195 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+"""Замеры каждого запроса к приложению (PerformanceMiddleware):
+ - время ответа, количество и время запросов к базе (через connection.execute_wrapper),
+ время отрисовки ответа TemplateResponse и размер ответа,
+ - время отрисовки считается от вызова process_template_response до обратного вызова после render,
+ то есть только шаг отрисовки ответа представления; шаблоны вне запросов (письма и т.д.) не замеряются,
+ - результаты отдаются заголовком Server-Timing (виден в инструментах разработчика браузера)
+ и пишутся в журнал rembaza_app.perf строкой JSON,
+ - последние REMBAZA_PERF_BUFFER_SIZE замеров адресов из rembaza_app/urls.py хранятся в памяти процесса
+ и выводятся на странице /_perf/ (только для сотрудников) с перцентилями p50/p95/p99 по имени адреса,
+ - для потоковых выгрузок время включает только построение ответа, без передачи файла,
+ - middleware работает и под WSGI, и под ASGI без перехода в поток"""
+
+logger = logging.getLogger('rembaza_app.perf')
+
+"""Замер текущего запроса; задается на время обработки запроса middleware"""
+_current = ContextVar('rembaza_perf_stats', default=None)
+
+
+def buffer_size():
+    return getattr(settings, 'REMBAZA_PERF_BUFFER_SIZE', 5000)
+
+
+class RequestStats:
+    """Накопитель замеров одного запроса"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_ms += (time.perf_counter() - started) * 1000
+
+
+class RingBuffer:
+    """Последние замеры запросов в памяти процесса"""
+
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def append(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+requests_buffer = RingBuffer(buffer_size())
+
+
+def app_url_names():
+    """Имена адресов приложения в порядке rembaza_app/urls.py"""
+    from . import urls
+    return [pattern.name for pattern in urls.urlpatterns]
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу; None для пустого списка"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def server_timing(entry):
+    """Значение заголовка Server-Timing"""
+    return (f'db;dur={entry["db_ms"]:.1f};desc="{entry["queries"]} queries", '
+            f'tpl;dur={entry["template_ms"]:.1f}, '
+            f'total;dur={entry["total_ms"]:.1f}')
+
+
+def summary(entries=None):
+    """Сводка по адресам приложения: количество запросов, перцентили времени ответа,
+    средние количество и время запросов к базе, время шаблонов и размер ответа"""
+    if entries is None:
+        entries = requests_buffer.snapshot()
+    by_name = {}
+    for entry in entries:
+        by_name.setdefault(entry['url_name'], []).append(entry)
+    rows = []
+    for name in app_url_names():
+        items = by_name.get(name, [])
+        totals = [item['total_ms'] for item in items]
+        count = len(items)
+        sizes = [item['size'] for item in items if item['size'] is not None]
+        rows.append({
+            'url_name': name,
+            'count': count,
+            'p50_ms': percentile(totals, 50),
+            'p95_ms': percentile(totals, 95),
+            'p99_ms': percentile(totals, 99),
+            'queries': sum(item['queries'] for item in items) / count if count else None,
+            'db_ms': sum(item['db_ms'] for item in items) / count if count else None,
+            'template_ms': sum(item['template_ms'] for item in items) / count if count else None,
+            'size': sum(sizes) / len(sizes) if sizes else None,
+        })
+    return rows
+
+
+class PerformanceMiddleware:
+    """Замер запроса, заголовок Server-Timing, строка журнала и запись в буфер /_perf/"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.url_names = None
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, stats, started)
+
+    def process_template_response(self, request, response):
+        """Начало отрисовки ответа: middleware стоит первым в MIDDLEWARE, поэтому метод вызывается
+        последним, непосредственно перед render; конец отрисовки отмечает обратный вызов после render"""
+        stats = _current.get()
+        if stats is not None and not response.is_rendered:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.template_ms += (time.perf_counter() - started) * 1000
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        """Асинхронный вариант process_template_response: обработчик ASGI вызывает его без перехода в поток"""
+        return PerformanceMiddleware.process_template_response(self, request, response)
+
+    def record(self, request, response, stats, started):
+        entry = {
+            'url_name': getattr(request.resolver_match, 'url_name', None),
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': (time.perf_counter() - started) * 1000,
+            'queries': stats.queries,
+            'db_ms': stats.db_ms,
+            'template_ms': stats.template_ms,
+            'size': None if response.streaming else len(response.content),
+        }
+        response['Server-Timing'] = server_timing(entry)
+        logger.info(json.dumps(entry, ensure_ascii=False))
+        if self.url_names is None:
+            self.url_names = set(app_url_names())
+        if entry['url_name'] in self.url_names:
+            requests_buffer.append(entry)
+        return response
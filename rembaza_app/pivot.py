@@ -0,0 +1,197 @@
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+
+from django.db.models import DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import MonthSummary, MonthWorks, WorkRollup, YearSummary
+
+"""Построение годовых таблиц из свернутых итогов WorkRollup:
+ - строки WorkRollup (наименование x месяц) разворачиваются в строку на наименование
+ с объемом и суммой по каждому месяцу, итогами по кварталам и за год,
+ - все значения считаются одним запросом GROUP BY по работе с условными суммами,
+ наименование берется из справочника Work соединением по id работы,
+ - строки возвращаются словарями с теми же ключами, что и поля прежних таблиц
+ WaterTable/SeverageTable, поэтому шаблоны обращаются к ним как раньше (table.january_vol)"""
+
+"""Связывание номера месяца с названием поля"""
+MONTH_NAMES = {1: "january", 2: "february", 3: "march", 4: "april",
+               5: "may", 6: "june", 7: "july", 8: "august",
+               9: "september", 10: "october", 11: "november", 12: "december"}
+
+"""Связывание номера квартала с названием поля"""
+QUARTER_FIELDS = {1: "first_quarter", 2: "second_quarter", 3: "third_quarter", 4: "fourth_quarter"}
+
+"""Связывание номера квартала с названием поля объема"""
+QUARTER_VOL_FIELDS = {quarter: f"{field}_vol" for quarter, field in QUARTER_FIELDS.items()}
+
+"""Виды работ, для которых строятся годовые таблицы"""
+WATER = 1
+SEVERAGE = 2
+
+"""Наибольшее количество лет в сравнении"""
+MAX_COMPARE_YEARS = 10
+
+
+def quarter_of(month):
+    """Номер квартала по номеру месяца"""
+    return (month - 1) // 3 + 1
+
+
+def quarter_months(quarter):
+    """Номера месяцев квартала"""
+    return [month for month in MONTH_NAMES if quarter_of(month) == quarter]
+
+
+CENTS = Decimal('0.01')
+
+"""Точность объема (три знака после запятой, как у полей volume)"""
+THOUSANDTHS = Decimal('0.001')
+
+
+class SummTotal(Coalesce):
+    """Сумма денежного поля с двумя знаками после запятой, как у полей DecimalField
+    (SQLite возвращает результат агрегатной функции без округления)"""
+    places = CENTS
+
+    def get_db_converters(self, connection):
+        return super().get_db_converters(connection) + [self.quantize]
+
+    def quantize(self, value, expression, connection):
+        return None if value is None else Decimal(value).quantize(self.places)
+
+
+class VolumeTotal(SummTotal):
+    """Сумма объема с тремя знаками после запятой"""
+    places = THOUSANDTHS
+
+
+def sum_volume(condition=None):
+    """Сумма объема (0.000 при отсутствии строк), при condition - только по строкам условия"""
+    return VolumeTotal(Sum('volume', filter=condition), Value(Decimal(0)),
+                       output_field=DecimalField(max_digits=20, decimal_places=3))
+
+
+def sum_summ(condition=None):
+    """Сумма денежного поля (0.00 при отсутствии строк), при condition - только по строкам условия"""
+    return SummTotal(Sum('summ', filter=condition), Value(Decimal(0)),
+                     output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def year_table_annotations():
+    """Условные суммы для всех колонок годовой таблицы"""
+    annotations = {}
+    for month, name in MONTH_NAMES.items():
+        annotations[f"{name}_vol"] = sum_volume(Q(month=month))
+        annotations[f"{name}_summ"] = sum_summ(Q(month=month))
+    annotations.update(year_summary_annotations())
+    return annotations
+
+
+def year_summary_annotations():
+    """Суммы и объемы по кварталам и за год для строк YearSummary"""
+    annotations = {field: sum_summ(Q(month__in=quarter_months(quarter))) for quarter, field in QUARTER_FIELDS.items()}
+    annotations['year_total'] = sum_summ()
+    annotations.update({field: sum_volume(Q(month__in=quarter_months(quarter)))
+                        for quarter, field in QUARTER_VOL_FIELDS.items()})
+    annotations['year_total_vol'] = sum_volume()
+    return annotations
+
+
+def year_table_columns():
+    """Колонки годовой таблицы в порядке страницы: (поле, заголовок)"""
+    month_labels = dict(MonthWorks.MONTH_CHOICES)
+    columns = [('completed_works', 'Наименование')]
+    for quarter, field in QUARTER_FIELDS.items():
+        for month in quarter_months(quarter):
+            columns.append((f"{MONTH_NAMES[month]}_vol", f"{month_labels[month]} Объем"))
+            columns.append((f"{MONTH_NAMES[month]}_summ", f"{month_labels[month]} Сумма"))
+        columns.append((QUARTER_VOL_FIELDS[quarter], f"{quarter} квартал объем"))
+        columns.append((field, f"{quarter} квартал сумма"))
+    columns.append(('year_total_vol', 'Годовой объем'))
+    columns.append(('year_total', 'Годовой итог'))
+    return columns
+
+
+def year_table(type_work, year, fields=None):
+    """Годовая таблица по виду работ: строка на наименование работ, упорядоченная по наименованию
+     - fields - список вычисляемых колонок; если не задан, считаются все колонки"""
+    annotations = year_table_annotations()
+    if fields is not None:
+        annotations = {field: annotations[field] for field in fields if field in annotations}
+    return (WorkRollup.objects.filter(type_work=type_work, year=year)
+            .values('year', completed_works=F('work__name'))
+            .annotate(**annotations)
+            .order_by('completed_works'))
+
+
+def year_summary(year):
+    """Количество работ, объем и сумма по видам работ и месяцам года из итогов MonthSummary
+    (не больше 24 строк по индексу (год, месяц, вид работ) вместо суммирования всех работ года)"""
+    return (MonthSummary.objects.filter(year=year)
+            .values('type_work', 'month', 'count', total_volume=F('volume'), total_summ=F('summ'))
+            .order_by('type_work', 'month'))
+
+
+def month_summary(year, month):
+    """Итоги месяца по видам работ из MonthSummary"""
+    return (MonthSummary.objects.filter(year=year, month=month)
+            .values('type_work', 'count', 'volume', 'summ')
+            .order_by('type_work'))
+
+
+def month_subtotals(rows):
+    """Итоги месяца по видам работ с названиями видов и общий итог: (строки, итог)"""
+    type_names = dict(MonthWorks.TYPE_CHOICES)
+    rows = [dict(row, name=type_names.get(row['type_work'], row['type_work'])) for row in rows]
+    total = {'count': sum(row['count'] for row in rows),
+             'volume': sum((row['volume'] for row in rows), Decimal('0.000')),
+             'summ': sum((row['summ'] for row in rows), Decimal('0.00'))}
+    return rows, total
+
+
+def comparison_params(params):
+    """Параметры сравнения лет из GET-параметров ?from=&to=&type=:
+     - по умолчанию последние пять лет по текущий и оба вида работ,
+     - возвращает (первый год, последний год, виды работ), при ошибке - ValueError"""
+    try:
+        year_to = int(params.get('to') or datetime.now().year)
+        year_from = int(params.get('from') or year_to - 4)
+        types = [int(value) for value in params.getlist('type')] or [WATER, SEVERAGE]
+    except ValueError:
+        raise ValueError('Год и вид работ задаются числами')
+    if year_from > year_to or year_to - year_from >= MAX_COMPARE_YEARS:
+        raise ValueError(f'Диапазон лет должен быть от 1 до {MAX_COMPARE_YEARS} лет')
+    unknown = set(types) - {value for value, _ in MonthWorks.TYPE_CHOICES}
+    if unknown:
+        raise ValueError(f"Неизвестный вид работ: {', '.join(map(str, sorted(unknown)))}")
+    return year_from, year_to, types
+
+
+def year_comparison(year_from, year_to, types=(WATER, SEVERAGE)):
+    """Сравнение лет по работам одним запросом к YearSummary по индексу (вид работ, год):
+     - строка на вид работ и наименование, в years - по элементу на каждый год диапазона
+     (None, если работ в этом году не было) с суммами по кварталам, за год, годовым объемом
+     и изменением годовой суммы к предыдущему году в процентах (change)"""
+    fields = tuple(QUARTER_FIELDS.values()) + ('year_total', 'year_total_vol')
+    rows = (YearSummary.objects
+            .filter(type_work__in=types, year__gte=year_from, year__lte=year_to)
+            .values('type_work', 'year', *fields, completed_works=F('work__name'))
+            .order_by('type_work', 'completed_works', 'year'))
+    years = list(range(year_from, year_to + 1))
+    result = []
+    for (type_work, completed_works), group in groupby(rows, key=lambda row: (row['type_work'], row['completed_works'])):
+        by_year = {row['year']: row for row in group}
+        cells, previous = [], None
+        for year in years:
+            row = by_year.get(year)
+            cell = None
+            if row is not None:
+                cell = {'year': year, **{field: row[field] for field in fields}, 'change': None}
+                if previous:
+                    cell['change'] = ((row['year_total'] - previous) / previous * 100).quantize(CENTS)
+            previous = row['year_total'] if row is not None else None
+            cells.append(cell)
+        result.append({'type_work': type_work, 'completed_works': completed_works, 'years': cells})
+    return result
@@ -0,0 +1,110 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import MonthWorks
+
+"""Полнотекстовый поиск работ по наименованию и описанию:
+ - в SQLite используется индекс FTS5 с внешним содержимым: текст хранится только в MonthWorks,
+ индекс хранит токены и обновляется триггерами при любых изменениях таблицы
+ (в том числе bulk_create, update и массовом удалении),
+ - результаты упорядочены по релевантности bm25, совпадение в наименовании весит больше, чем в описании,
+ - каждое слово запроса ищется как префикс ("задвиж" находит "задвижки"), все слова обязательны,
+ - в других СУБД индекса нет, поиск выполняется через LIKE по обоим полям без ранжирования"""
+
+FTS_TABLE = 'rembaza_app_monthworks_fts'
+CONTENT_TABLE = MonthWorks._meta.db_table
+
+"""Веса колонок для bm25: наименование, описание"""
+WEIGHTS = (10.0, 1.0)
+
+"""Наибольшее количество результатов поиска"""
+MAX_RESULTS = 200
+
+CREATE_TABLE = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    completed_works, description,
+    content='{CONTENT_TABLE}', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)"""
+
+TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {CONTENT_TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}(rowid, completed_works, description)
+    VALUES (new.id, new.completed_works, new.description);
+END""",
+    f'{FTS_TABLE}_delete': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {CONTENT_TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, completed_works, description)
+    VALUES ('delete', old.id, old.completed_works, old.description);
+END""",
+    f'{FTS_TABLE}_update': f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+AFTER UPDATE OF completed_works, description ON {CONTENT_TABLE} BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, completed_works, description)
+    VALUES ('delete', old.id, old.completed_works, old.description);
+    INSERT INTO {FTS_TABLE}(rowid, completed_works, description)
+    VALUES (new.id, new.completed_works, new.description);
+END""",
+}
+
+
+def is_available(db=None):
+    return (db or connection).vendor == 'sqlite'
+
+
+def install_index(db, repair=False):
+    """Создание индекса и триггеров, если их нет:
+     - вызывается после каждой миграции (post_migrate, repair=True - только если индекс
+     уже создан миграцией 0009), потому что SQLite при пересоздании таблицы MonthWorks (изменение полей) удаляет ее триггеры,
+     - если индекс или хотя бы один триггер пришлось создать, индекс перестраивается по MonthWorks"""
+    if not is_available(db):
+        return
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s",
+                       [f'{FTS_TABLE}%'])
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing >= {FTS_TABLE, *TRIGGERS} or (repair and FTS_TABLE not in existing):
+            return
+        cursor.execute(CREATE_TABLE)
+        for sql in TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def match_expression(text):
+    """Запрос FTS5 из произвольного текста: каждое слово в кавычках как префикс,
+    поэтому операторы и спецсимволы FTS5 из ввода пользователя не интерпретируются"""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def filter_works(queryset, text):
+    """Отбор записей выборки, подходящих под запрос, без ранжирования (для списка админ-панели)"""
+    if not is_available():
+        return queryset.filter(Q(completed_works__icontains=text) | Q(description__icontains=text))
+    expression = match_expression(text)
+    if not expression:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                                         [expression]))
+
+
+def search(text, year=None, month=None, type_work=None, limit=MAX_RESULTS):
+    """Поиск работ, упорядоченный по релевантности, с отбором по году, месяцу и виду работ:
+     - одним запросом к индексу с соединением с MonthWorks,
+     - у записей результата есть атрибут rank (чем меньше, тем релевантнее; None без индекса)"""
+    filters = {key: value for key, value in
+               (('year', year), ('month', month), ('type_work', type_work)) if value is not None}
+    if not is_available():
+        works = list(filter_works(MonthWorks.objects.filter(**filters), text).order_by('-year', '-month')[:limit])
+        for work in works:
+            work.rank = None
+        return works
+    expression = match_expression(text)
+    if not expression:
+        return []
+    conditions = ''.join(f' AND m.{field} = %s' for field in filters)
+    sql = (f"SELECT m.*, bm25({FTS_TABLE}, {WEIGHTS[0]}, {WEIGHTS[1]}) AS rank "
+           f"FROM {FTS_TABLE} JOIN {CONTENT_TABLE} m ON m.id = {FTS_TABLE}.rowid "
+           f"WHERE {FTS_TABLE} MATCH %s{conditions} ORDER BY rank LIMIT %s")
+    return list(MonthWorks.objects.raw(sql, [expression, *filters.values(), limit]))
@@ -1,187 +1,106 @@
+from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save, pre_delete
-from django.http import HttpResponse
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate, post_save, pre_save, pre_delete
 
-from .models import MonthWorks, WaterTable, SeverageTable
-from decimal import Decimal
+from . import aggregation, page_cache, search
+from .models import MonthWorks
 
-"""Функция создания объектов и изменения значений в годовых таблицах:
+"""Функции поддержания свернутых итогов WorkRollup, из которых строятся годовые таблицы:
  - после записи выполненных работ за месяц в таблице MonthWorks при сохранении отправляется сигнал,
- - данная функция при получении этого сигнала создает объекты в таблицах WaterTable, SeverageTable
- в зависимости от выбранного вида работ (1 или 2),
- -  изменяет значения в таблицах WaterTable, SeverageTable, если такие изменения были произведены 
- в таблице MonthWorks"""
+ - сохранение записи и обновление итогов выполняются в одной транзакции (см. MonthWorks.save),
+ - перед сохранением запоминается прежнее состояние записи, строка записи блокируется,
+ - после сохранения к строке итогов с тем же видом работ, годом, наименованием и месяцем
+ применяется разница между новым и прежним вкладом записи (см. aggregation.apply_change),
+ - несколько записей за один месяц по одному виду работ суммируются,
+ - в отложенных режимах (см. aggregation.mode) работа только отмечается для пересчета,
+ - изменение месяца, года, вида работ или наименования переносит вклад в нужную строку,
+ - сбрасывается кэш только тех страниц, которые зависят от прежних и новых года, месяца и вида работ,
+ - внутри aggregation.suppressed() обработчики ничего не делают (массовое удаление пересчитывает итоги само)"""
+
+
+@receiver(pre_save, sender=MonthWorks)
+def remember_loaded_state(sender, instance, **kwargs):
+    if aggregation.is_suppressed():
+        return
+    instance._aggregate_old = aggregation.stored_state(instance)
 
 
 @receiver(post_save, sender=MonthWorks)
 def update_aggregate_tables(sender, instance, created, **kwargs):
-    """связывание названия месяца с его номером"""
-    month_field = {1: "january", 2: "february", 3: "march", 4: "april",
-                   5: "may", 6: "june", 7: "july", 8: "august",
-                   9: "september", 10: "october", 11: "november", 12: "december"}
-
-    if created:
-        """если объект создается:"""
-        if instance.type_work == 1:  # Вода
-            water_table, _ = WaterTable.objects.get_or_create(
-                completed_works=instance.completed_works,
-                year=instance.year
-            )
-            """динамическое задание значения атрибуту"""
-            setattr(water_table, f"{month_field[instance.month]}_vol", instance.volume)
-            setattr(water_table, f"{month_field[instance.month]}_summ", instance.summ)
-
-            water_table.save()  # Сохраняем изменения в таблице воды
-
-        elif instance.type_work == 2:  # Канализация
-            severage_table, _ = SeverageTable.objects.get_or_create(
-                completed_works=instance.completed_works,
-                year=instance.year
-            )
-            setattr(severage_table, f"{month_field[instance.month]}_vol", instance.volume)
-            setattr(severage_table, f"{month_field[instance.month]}_summ", instance.summ)
-
-            severage_table.save()  # Сохраняем изменения в таблице канализации
+    if aggregation.is_suppressed():
+        return
+    old = None if created else getattr(instance, '_aggregate_old', None)
+    new = aggregation.snapshot(instance)
+    if aggregation.mode() == aggregation.IMMEDIATE:
+        aggregation.apply_change(old, new)
     else:
-        """Обработка изменения существующей записи"""
-        if instance.type_work == 1:
-            water_table = WaterTable.objects.get(completed_works=instance.completed_works, year=instance.year)
-            setattr(water_table, f"{month_field[instance.month]}_vol", instance.volume)
-            setattr(water_table, f"{month_field[instance.month]}_summ", instance.summ)
+        aggregation.mark_dirty({aggregation.work_key(state) for state in (old, new) if state})
+    page_cache.invalidate({(state['type_work'], state['year'], state['month']) for state in (old, new) if state})
 
-            water_table.save()  # Сохраняем изменения в таблице воды
 
-        elif instance.type_work == 2:
-            severage_table = SeverageTable.objects.get(completed_works=instance.completed_works, year=instance.year)
-            setattr(severage_table, f"{month_field[instance.month]}_vol", instance.volume)
-            setattr(severage_table, f"{month_field[instance.month]}_summ", instance.summ)
+"""Функция удаления вклада записи из итогов:
+ - вычитает объем и сумму записи из строки итогов ее месяца,
+ - если по полю completed_works за месяц не осталось записей MonthWorks,
+ то удаляет строку итогов,
+ - сбрасывает кэш страниц года и месяца записи"""
 
-            severage_table.save()  # Сохраняем изменения в таблице канализации
 
+@receiver(pre_delete, sender=MonthWorks)
+def delete_from_aggregate_tables(sender, instance, **kwargs):
+    if aggregation.is_suppressed():
+        return
+    old = aggregation.stored_state(instance) or aggregation.snapshot(instance)
+    if aggregation.mode() == aggregation.IMMEDIATE:
+        aggregation.apply_change(old, None, exclude_pk=instance.pk)
+    else:
+        aggregation.mark_dirty({aggregation.work_key(old)})
+    page_cache.invalidate({(old['type_work'], old['year'], old['month'])})
 
-"""Функция удаления объектов в годовых таблицах:
- - получает значения по полю completed_works за весь требуемый год,
- - проверяет, есть ли в каких-нибудь месяцах значения, отличные от нуля,
- -  если такие значения есть, то обнуляет значения в таблицах WaterTable, SeverageTable 
- только за выбранный месяц,
- - если все значения по полю completed_works за весь требуемый год равны нулю, 
- то полностью удаляет строку с видом работ
-  - вызывает исключения, если таблицы не неайдены"""
 
+"""Функция настройки нового соединения с SQLite:
+ - выполняет PRAGMA из настройки REMBAZA_SQLITE_PRAGMAS (ожидание блокировки, кэш и т.д.),
+ эти PRAGMA действуют только на соединение и не меняют файл базы,
+ - для других СУБД ничего не делает"""
 
-@receiver(pre_delete, sender=MonthWorks)
-def delete_from_aggregate_tables(sender, instance, **kwargs):
-    """связывание названия полей соответствующего месяца с его номером"""
-    month_fields = {
-        1: ('january_vol', 'january_summ'),
-        2: ('february_vol', 'february_summ'),
-        3: ('march_vol', 'march_summ'),
-        4: ('april_vol', 'april_summ'),
-        5: ('may_vol', 'may_summ'),
-        6: ('june_vol', 'june_summ'),
-        7: ('july_vol', 'july_summ'),
-        8: ('august_vol', 'august_summ'),
-        9: ('september_vol', 'september_summ'),
-        10: ('october_vol', 'october_summ'),
-        11: ('november_vol', 'november_summ'),
-        12: ('december_vol', 'december_summ'),
-    }
-
-    if instance.type_work == 1:  # Вода
-        try:
-            """Получение всех значений по полю completed_works за выбранный год"""
-            water_table = WaterTable.objects.get(completed_works=instance.completed_works, year=instance.year)
-
-            is_non_zero = False
-
-            """Проверка значений за другие месяцы"""
-            for month, (vol_field, summ_field) in month_fields.items():
-                if month != instance.month:  # Проверяем только остальные месяцы
-                    if getattr(water_table, vol_field) > 0 or getattr(water_table, summ_field) > 0:
-                        is_non_zero = True
-                        break
-
-            if is_non_zero:
-                """Обнуляем значения за текущий месяц"""
-                if instance.month in month_fields:
-                    vol_field, summ_field = month_fields[instance.month]
-                    setattr(water_table, vol_field, 0.0)  # Обнуляем volume
-                    setattr(water_table, summ_field, 0.00)  # Обнуляем summ
-                    water_table.save()
-            else:
-                """Все значения равны 0, поэтому удаляем запись"""
-                water_table.delete()
-
-        except WaterTable.DoesNotExist:
-            return HttpResponse("Таблица 'Годовая водоснабжение' не найдена.", status=404)
-
-    elif instance.type_work == 2:  # Канализация
-        try:
-            severage_table = SeverageTable.objects.get(completed_works=instance.completed_works, year=instance.year)
-            is_non_zero = False
-
-            """Проверка значений за другие месяцы"""
-            for month, (vol_field, summ_field) in month_fields.items():
-                if month != instance.month:  # Проверяем только остальные месяцы
-                    if getattr(severage_table, vol_field) > 0 or getattr(severage_table, summ_field) > 0:
-                        is_non_zero = True
-                        break
-
-            if is_non_zero:
-                """Обнуляем значения за текущий месяц"""
-                if instance.month in month_fields:
-                    vol_field, summ_field = month_fields[instance.month]
-                    setattr(severage_table, vol_field, 0.0)  # Обнуляем volume
-                    setattr(severage_table, summ_field, 0.00)  # Обнуляем summ
-                    severage_table.save()
-            else:
-                """Все значения равны 0, поэтому удаляем запись"""
-                severage_table.delete()
-        except SeverageTable.DoesNotExist:
-            return HttpResponse("Таблица 'Годовая водоотведение' не найдена.", status=404)
-
-
-"""Функция суммирования значений поля month_summ по кварталам и году 
- в годовых таблицах WaterTable, SeverageTable:
- - как только в поле month_summ появится значение, функция автоматически прибавит 
- это значение к значению соответствующего квартала и года"""
-
-
-@receiver(pre_save, sender=WaterTable)
-@receiver(pre_save, sender=SeverageTable)
-def calculate_totals(sender, instance, **kwargs):
-    """Рассчет первого квартала"""
-    instance.first_quarter = (
-            Decimal(instance.january_summ or 0) +
-            Decimal(instance.february_summ or 0) +
-            Decimal(instance.march_summ or 0)
-    )
-
-    """Рассчет второго квартала"""
-    instance.second_quarter = (
-            Decimal(instance.april_summ or 0)
-            + Decimal(instance.may_summ or 0)
-            + Decimal(instance.june_summ or 0)
-    )
-
-    """Рассчет третьего квартала"""
-    instance.third_quarter = (
-            Decimal(instance.july_summ or 0)
-            + Decimal(instance.august_summ or 0)
-            + Decimal(instance.september_summ or 0)
-    )
-
-    """Рассчет четвертого квартала"""
-    instance.fourth_quarter = (
-            Decimal(instance.october_summ or 0)
-            + Decimal(instance.november_summ or 0)
-            + Decimal(instance.december_summ or 0)
-    )
-
-    """Рассчет общего итога за год"""
-    instance.year_total = (
-            instance.first_quarter +
-            instance.second_quarter +
-            instance.third_quarter +
-            instance.fourth_quarter
-    )
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'REMBAZA_SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(_pragma(name, value))
+
+
+def _pragma(name, value):
+    if not name.isidentifier() or not str(value).lstrip('-').isalnum():
+        raise ValueError(f"Некорректная настройка SQLite: {name} = {value}")
+    return f"PRAGMA {name} = {value}"
+
+
+"""Функция восстановления полнотекстового индекса после миграций:
+ SQLite удаляет триггеры индекса, когда миграция пересоздает таблицу MonthWorks"""
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    if sender.name == 'rembaza_app':
+        search.install_index(connections[using], repair=True)
+
+
+"""Функция перевода базы SQLite в режим журнала REMBAZA_SQLITE_JOURNAL_MODE после миграций:
+ режим хранится в самом файле базы, поэтому переключается один раз командой migrate,
+ а не при каждом соединении (команды только для чтения, например check, файл базы не меняют)"""
+
+
+@receiver(post_migrate)
+def set_journal_mode(sender, using, **kwargs):
+    connection = connections[using]
+    journal_mode = getattr(settings, 'REMBAZA_SQLITE_JOURNAL_MODE', None)
+    if sender.name != 'rembaza_app' or connection.vendor != 'sqlite' or not journal_mode:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_pragma('journal_mode', journal_mode))
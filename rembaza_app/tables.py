@@ -0,0 +1,71 @@
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.formats import get_format, localize
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from .pivot import year_table, year_table_columns
+
+"""Отрисовка строк годовых таблиц по списку колонок:
+ - строки читаются из базы кортежами values_list() в порядке колонок,
+ - для списка колонок и десятичного разделителя текущего языка один раз собирается форматтер строки:
+ шаблон '<tr><td>{}</td>...</tr>' и функция преобразования значения для каждой колонки
+ (экранирование текста, вывод числа с разделителем без повторного чтения настроек локализации),
+ - значения выводятся так же, как {{ value }} в шаблоне Django, но без поиска переменной
+ по цепочке словарь/атрибут/индекс и без отрисовки узлов шаблона для каждой ячейки"""
+
+"""Колонки годовой таблицы: (поле, заголовок)"""
+YEAR_TABLE_COLUMNS = tuple(year_table_columns())
+
+"""Текстовые колонки; остальные колонки числовые"""
+TEXT_FIELDS = {'completed_works', 'description'}
+
+
+def _text(value):
+    return conditional_escape(value)
+
+
+def _number_converter(decimal_separator):
+    """Вывод числа как у localize() при выключенном разделителе разрядов;
+    числа в экспоненциальной записи и прочие значения выводятся через localize()"""
+    def convert(value):
+        if type(value) is float:
+            text = str(value)
+        elif type(value) is Decimal:
+            text = f'{value:f}'
+        else:
+            return localize(value)
+        if 'e' in text:
+            return localize(value)
+        return text if decimal_separator == '.' else text.replace('.', decimal_separator)
+    return convert
+
+
+@lru_cache(maxsize=None)
+def row_formatter(columns, decimal_separator=None):
+    """Функция, которая превращает кортеж значений в HTML строки таблицы с колонками columns;
+    без decimal_separator числа выводятся через localize()"""
+    template = '<tr>' + '<td>{}</td>' * len(columns) + '</tr>\n'
+    number = localize if decimal_separator is None else _number_converter(decimal_separator)
+    converters = tuple(_text if field in TEXT_FIELDS else number for field, _ in columns)
+
+    def format_row(row):
+        return template.format(*[convert(value) for convert, value in zip(converters, row)])
+    return format_row
+
+
+def render_rows(rows, columns=YEAR_TABLE_COLUMNS):
+    """HTML строк таблицы для вставки в шаблон"""
+    decimal_separator = None
+    if not settings.USE_THOUSAND_SEPARATOR:
+        decimal_separator = get_format('DECIMAL_SEPARATOR')
+    format_row = row_formatter(tuple(columns), decimal_separator)
+    return mark_safe(''.join([format_row(row) for row in rows]))
+
+
+def year_table_rows(type_work, year, columns=YEAR_TABLE_COLUMNS):
+    """Строки годовой таблицы кортежами в порядке колонок, упорядоченные по наименованию"""
+    fields = [field for field, _ in columns]
+    return year_table(type_work, year, fields).values_list(*fields)
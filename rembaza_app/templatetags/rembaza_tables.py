@@ -0,0 +1,13 @@
+from django import template
+
+from rembaza_app.tables import render_rows
+
+register = template.Library()
+
+"""Строки таблицы из кортежей значений по списку колонок (см. rembaza_app.tables):
+{% table_rows rows columns %}"""
+
+
+@register.simple_tag
+def table_rows(rows, columns):
+    return render_rows(rows, columns)
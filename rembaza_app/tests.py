@@ -1,9 +1,46 @@
-from django.test import TestCase, Client
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import zipfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import ProtectedError, Sum
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.template import engines
+from django.utils import translation
+from django.utils.http import http_date
 from django.core.cache import cache
 from django.urls import reverse
-from .models import MonthWorks, WaterTable, SeverageTable, YEAR_CHOICES
+from . import aggregation, async_views, benchmark, page_cache, perf, search, signals, tables, views
+from .models import DirtyWork, MonthSummary, MonthWorks, Work, WorkRollup, YearSummary, YEAR_CHOICES
+from .pivot import year_table
 from .views import year_view, year_detail, monthworks_list, severagetable_view
 
+
+def setUpModule():
+    """Строки замеров запросов PerformanceMiddleware в тестах не выводятся (проверяются через assertLogs)"""
+    logging.getLogger('rembaza_app.perf').setLevel(logging.WARNING)
+
+
+def tearDownModule():
+    logging.getLogger('rembaza_app.perf').setLevel(settings.LOGGING['loggers']['rembaza_app.perf']['level'])
+
 """Тест представления year_view"""
 
 
@@ -42,10 +79,10 @@ class YearDetailViewTest(TestCase):
             year=self.year,
             type_work=3,
             month=4)
-        self.watertable_1 = WaterTable.objects.create(
-            year=self.year)
-        self.severagetable_1 = SeverageTable.objects.create(
-            year=self.year)
+        self.water_work = MonthWorks.objects.create(
+            year=self.year, type_work=1, month=4, completed_works='Замена задвижки')
+        self.severage_work = MonthWorks.objects.create(
+            year=self.year, type_work=2, month=4, completed_works='Прочистка')
         """Подключаем тестовый сервер перед вызовом каждой функции"""
         self.client = Client()
 
@@ -60,16 +97,22 @@ class YearDetailViewTest(TestCase):
         url = reverse('year_detail', args=[self.year])
         response = self.client.get(url)
         self.assertContains(response, str(self.year))
-        """Извлекаем значения из контекста представления, преобразуем их в строковые значения 
-        и создаем из них список"""
-        monthworks_values = list(map(repr, response.context['monthworks']))
-        watertable_values = list(map(repr, response.context['watertable']))
-        severagetable_values = list(map(repr, response.context['severagetable']))
+        """Проверяем итоги по месяцам: работы вида 3 в таблицы не попадают"""
+        months = response.context['months']
+        self.assertEqual(len(months), 12)
+        self.assertEqual(months[3]['name'], 'Апрель')
+        self.assertEqual(months[3]['water']['count'], 1)
+        self.assertEqual(months[3]['severage']['count'], 1)
+        self.assertIsNone(months[0]['water'])
+        self.assertEqual(response.context['totals']['water']['count'], 1)
 
-        """Сравниваем полученные списки значений с ожидаемыми значениями"""
-        self.assertSequenceEqual(monthworks_values, [repr(self.monthwork_1)])
-        self.assertSequenceEqual(watertable_values, [repr(self.watertable_1)])
-        self.assertSequenceEqual(severagetable_values, [repr(self.severagetable_1)])
+    def test_year_detail_view_uses_one_query(self):
+        """Проверяем, что страница строится одним запросом независимо от количества работ"""
+        for month in range(1, 13):
+            MonthWorks.objects.create(year=self.year, type_work=1, month=month, completed_works=f'Работа {month}')
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.client.get(reverse('year_detail', args=[self.year]))
 
 
 """Тест представления monthworks_list"""
@@ -90,6 +133,8 @@ class MonthWorksListViewTest(TestCase):
         )
 
     def setUp(self):
+        """Чистим кэш страниц перед каждым тестом"""
+        cache.clear()
         """Подключаем тестовый сервер перед вызовом каждой функции"""
         self.client = Client()
 
@@ -107,6 +152,21 @@ class MonthWorksListViewTest(TestCase):
         self.assertQuerySetEqual(response.context['works'], MonthWorks.objects.filter(year=self.year, month=self.month),
                                  transform=lambda x: x)
 
+    def test_monthworks_list_subtotals(self):
+        """Проверяем итоги месяца по видам работ и общий итог из MonthSummary"""
+        MonthWorks.objects.create(year=self.year, month=self.month, type_work=2, completed_works='Прочистка',
+                                  volume=Decimal('2.125'), summ=Decimal('3.25'))
+        MonthWorks.objects.create(year=self.year, month=self.month, type_work=2, completed_works='Прочистка',
+                                  volume=Decimal('1.001'), summ=Decimal('1.00'))
+        response = self.client.get(reverse('monthworks_list', args=[self.year, self.month]))
+        self.assertEqual([(row['name'], row['count']) for row in response.context['subtotals']],
+                         [('Вода', 1), ('Канализация', 2)])
+        self.assertEqual(response.context['total']['count'], 3)
+        self.assertEqual(response.context['total']['summ'], Decimal('4.25'))
+        self.assertContains(response, '<th>Итого за месяц</th>')
+        self.assertEqual(response.context['total']['volume'], Decimal('3.126'))
+        self.assertContains(response, '<th>3.126</th>')
+
 
 """Тест представления watertable_view"""
 
@@ -118,11 +178,15 @@ class WaterTableViewTest(TestCase):
         cache.clear()
         """Создаем временную тестовую базу данных"""
         cls.year = 2024
-        cls.water_table_2 = WaterTable.objects.create(year=cls.year, completed_works="Sample data 1")
-        cls.water_table_3 = WaterTable.objects.create(year=cls.year, completed_works="Sample data 2")
+        cls.water_work_2 = MonthWorks.objects.create(year=cls.year, type_work=1, month=1,
+                                                     completed_works="Sample data 1")
+        cls.water_work_3 = MonthWorks.objects.create(year=cls.year, type_work=1, month=2,
+                                                     completed_works="Sample data 2")
         cls.invalid_year = 9999  # Год, для которого нет записей
 
     def setUp(self):
+        """Чистим кэш страниц перед каждым тестом"""
+        cache.clear()
         """Подключаем тестовый сервер перед вызовом каждой функции"""
         self.client = Client()
 
@@ -137,10 +201,12 @@ class WaterTableViewTest(TestCase):
         """Проверяем контекст"""
         self.assertIn('watertables', response.context)
         self.assertQuerySetEqual(
-            response.context['watertables'].order_by('id'),
-            WaterTable.objects.filter(year=self.year).order_by('id'),
+            response.context['watertables'],
+            list(tables.year_table_rows(1, self.year)),
             transform=lambda x: x
         )
+        self.assertEqual([row[0] for row in response.context['watertables']],
+                         ["Sample data 1", "Sample data 2"])
 
         """Проверяем, что год в контексте соответствует ожидаемому"""
         self.assertEqual(response.context['year'], self.year)
@@ -164,8 +230,8 @@ class WaterTableViewTest(TestCase):
         self.assertEqual(response.context['year'], self.invalid_year)
 
     def test_watertable_view_exception_handling(self):
-        """Временное удаление всех объектов WaterTable для проверки обработки исключений"""
-        WaterTable.objects.all().delete()
+        """Временное удаление всех работ (и их итогов) для проверки обработки исключений"""
+        MonthWorks.objects.all().delete()
         url = reverse('watertable', args=[self.year])
         response = self.client.get(url)
 
@@ -176,6 +242,21 @@ class WaterTableViewTest(TestCase):
         """Проверяем, что год в контексте соответствует ожидаемому"""
         self.assertEqual(response.context['year'], self.year)
 
+    def test_watertable_view_errors_are_not_served_as_pages(self):
+        """Проверяем, что некорректный курсор дает 400 без записи в кэш,
+        а ошибка базы данных не превращается в страницу с текстом исключения"""
+        url = reverse('watertable', args=[self.year])
+        for _ in range(2):
+            response = self.client.get(url, {'after': '_w'})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        cache.clear()
+        with mock.patch.object(tables, 'year_table_rows', side_effect=DatabaseError('no such table')):
+            with self.assertRaises(DatabaseError):
+                self.client.get(url)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
 
 """Тест представления severagetable_view"""
 
@@ -189,9 +270,14 @@ class SewerageTableViewTest(TestCase):
         """Создаем временную тестовую базу данных"""
         cls.client = Client()
         cls.year = 2024
-        cls.severage_table_entry = SeverageTable.objects.create(year=cls.year, completed_works="Sample data")
+        cls.severage_work = MonthWorks.objects.create(year=cls.year, type_work=2, month=1,
+                                                      completed_works="Sample data")
         cls.invalid_year = 9999
 
+    def setUp(self):
+        """Чистим кэш страниц перед каждым тестом"""
+        cache.clear()
+
     def test_severagetable_view_with_valid_year(self):
         """Проверяем, что представление правильно отображает данные, когда передан корректный год"""
         url = reverse('severagetable', args=[self.year])
@@ -202,7 +288,7 @@ class SewerageTableViewTest(TestCase):
         self.assertIn('severagetables', response.context)
         self.assertQuerySetEqual(
             response.context['severagetables'],
-            SeverageTable.objects.filter(year=self.year),
+            list(tables.year_table_rows(2, self.year)),
             transform=lambda x: x)
 
         """Проверяем, что год в контексте соответствует ожидаемому"""
@@ -228,7 +314,7 @@ class SewerageTableViewTest(TestCase):
     def test_severagetable_view_exception_handling(self):
         """Проверяет обработку исключения в представлении
         Например, мы можем удалить все записи, чтобы увидеть, что вернется"""
-        SeverageTable.objects.all().delete()
+        MonthWorks.objects.all().delete()
 
         """Вызываем представление, которое должно вернуть обработанное значение"""
         url = reverse('severagetable', args=[self.year])
@@ -244,3 +330,937 @@ class SewerageTableViewTest(TestCase):
 
         """Ожидаем 404, так как представление не должно принимать строку вместо года"""
         self.assertEqual(response.status_code, 404)
+
+
+"""Строка годовой таблицы по виду работ и наименованию"""
+
+
+def year_row(type_work, year, completed_works):
+    return year_table(type_work, year).filter(completed_works=completed_works).first()
+
+
+"""Тест инкрементального обновления итогов и построения годовых таблиц"""
+
+
+class AggregationTest(TestCase):
+    def create_work(self, **kwargs):
+        data = {'type_work': 1, 'year': 2024, 'month': 1, 'completed_works': 'Замена задвижки',
+                'description': '', 'volume': 1.0, 'summ': Decimal('10.00')}
+        data.update(kwargs)
+        return MonthWorks.objects.create(**data)
+
+    def test_works_of_same_month_are_summed(self):
+        """Проверяем, что несколько работ за один месяц суммируются, а не перезаписываются"""
+        self.create_work(volume=1.5, summ=Decimal('10.00'))
+        self.create_work(volume=2.5, summ=Decimal('5.50'))
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_vol'], 4.0)
+        self.assertEqual(row['january_summ'], Decimal('15.50'))
+        self.assertEqual(row['first_quarter'], Decimal('15.50'))
+        self.assertEqual(row['year_total'], Decimal('15.50'))
+        self.assertEqual(WorkRollup.objects.count(), 1)
+
+    def test_edit_applies_difference(self):
+        """Проверяем, что при изменении суммы применяется только разница"""
+        self.create_work(summ=Decimal('10.00'))
+        work = self.create_work(summ=Decimal('20.00'))
+        work.summ = Decimal('25.00')
+        work.save()
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_summ'], Decimal('35.00'))
+        self.assertEqual(row['year_total'], Decimal('35.00'))
+
+    def test_edit_moves_contribution(self):
+        """Проверяем перенос вклада при смене месяца, вида работ и наименования"""
+        work = self.create_work(summ=Decimal('10.00'))
+        work.month = 5
+        work.save()
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_summ'], Decimal('0.00'))
+        self.assertEqual(row['may_summ'], Decimal('10.00'))
+        self.assertEqual(row['first_quarter'], Decimal('0.00'))
+        self.assertEqual(row['second_quarter'], Decimal('10.00'))
+
+        work = MonthWorks.objects.get(pk=work.pk)
+        work.type_work = 2
+        work.completed_works = 'Прочистка'
+        work.save()
+        self.assertFalse(year_table(1, 2024).exists())
+        row = year_row(2, 2024, 'Прочистка')
+        self.assertEqual(row['may_summ'], Decimal('10.00'))
+        self.assertEqual(row['year_total'], Decimal('10.00'))
+
+    def test_names_share_catalog_work(self):
+        """Проверяем, что наименования, отличающиеся пробелами, попадают в одну работу справочника
+        и одну строку годовой таблицы"""
+        first = self.create_work(summ=Decimal('10.00'))
+        second = self.create_work(completed_works='  Замена   задвижки ', summ=Decimal('5.00'))
+        self.assertEqual(second.completed_works, 'Замена задвижки')
+        self.assertEqual(first.work_id, second.work_id)
+        self.assertEqual(Work.objects.count(), 1)
+        self.assertEqual(year_table(1, 2024).count(), 1)
+        self.assertEqual(year_row(1, 2024, 'Замена задвижки')['january_summ'], Decimal('15.00'))
+        with self.assertRaises(ProtectedError):
+            first.work.delete()
+
+    def test_volumes_are_summed_exactly(self):
+        """Проверяем, что объемы суммируются без шума двоичной дроби"""
+        for _ in range(30):
+            self.create_work(volume='0.1', summ=Decimal('0.10'))
+        self.create_work(month=2, volume='0.2')
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(str(row['january_vol']), '3.000')
+        self.assertEqual(str(row['february_vol']), '0.200')
+        self.assertEqual(str(MonthSummary.objects.get(month=1).volume), '3.000')
+        self.assertEqual(aggregation.verify(2024), [])
+
+    def test_month_summary_follows_changes(self):
+        """Проверяем количество, объем и сумму месяца по виду работ при создании, переносе и удалении"""
+        first = self.create_work(volume=1.5, summ=Decimal('10.00'))
+        self.create_work(completed_works='Прочистка', volume=2.0, summ=Decimal('4.50'))
+        summary = MonthSummary.objects.get(type_work=1, year=2024, month=1)
+        self.assertEqual((summary.count, summary.volume, summary.summ), (2, 3.5, Decimal('14.50')))
+        first.month = 3
+        first.save()
+        summary.refresh_from_db()
+        self.assertEqual((summary.count, summary.volume, summary.summ), (1, 2.0, Decimal('4.50')))
+        first.delete()
+        self.assertFalse(MonthSummary.objects.filter(month=3).exists())
+        self.assertEqual(aggregation.verify(2024), [])
+
+    def test_delete_subtracts_and_removes_empty_row(self):
+        """Проверяем вычитание при удалении и удаление строки без записей"""
+        first = self.create_work(summ=Decimal('10.00'))
+        second = self.create_work(month=2, summ=Decimal('7.00'))
+        first.delete()
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_summ'], Decimal('0.00'))
+        self.assertEqual(row['year_total'], Decimal('7.00'))
+        second.delete()
+        self.assertFalse(year_table(1, 2024).exists())
+
+
+"""Тест отложенного пересчета итогов"""
+
+
+class DeferredAggregationTest(TestCase):
+    def create_work(self, **kwargs):
+        data = {'type_work': 1, 'year': 2024, 'month': 1, 'completed_works': 'Замена задвижки',
+                'description': '', 'volume': 1.0, 'summ': Decimal('10.00')}
+        data.update(kwargs)
+        return MonthWorks.objects.create(**data)
+
+    def test_on_commit_mode_recomputes_once_after_commit(self):
+        """Проверяем, что в режиме on_commit итоги в транзакции не трогаются, а после фиксации пересчитываются"""
+        moved = self.create_work(month=3)
+        with self.settings(REMBAZA_AGGREGATION_MODE='on_commit'), self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for month in range(1, 13):
+                    self.create_work(month=month, summ=Decimal('5.00'))
+                moved.completed_works = 'Прочистка'
+                moved.save()
+                self.assertEqual(year_row(1, 2024, 'Замена задвижки')['year_total'], Decimal('10.00'))
+                self.assertFalse(year_table(1, 2024).filter(completed_works='Прочистка').exists())
+        self.assertEqual(year_row(1, 2024, 'Замена задвижки')['year_total'], Decimal('60.00'))
+        self.assertEqual(year_row(1, 2024, 'Прочистка')['march_summ'], Decimal('10.00'))
+        self.assertEqual(aggregation.verify(), [])
+
+    def test_queue_mode_and_run_aggregator(self):
+        """Проверяем, что в режиме очереди работы отмечаются в DirtyWork и пересчитываются командой"""
+        with self.settings(REMBAZA_AGGREGATION_MODE='queue'):
+            first = self.create_work()
+            self.create_work(month=2)
+            first.delete()
+            self.assertFalse(WorkRollup.objects.exists())
+            self.assertEqual(DirtyWork.objects.count(), 3)
+        out = StringIO()
+        call_command('run_aggregator', '--once', stdout=out)
+        self.assertIn('Пересчитано работ: 1', out.getvalue())
+        self.assertFalse(DirtyWork.objects.exists())
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_summ'], Decimal('0.00'))
+        self.assertEqual(row['february_summ'], Decimal('10.00'))
+        self.assertEqual(aggregation.verify(), [])
+
+    def test_queue_mode_does_not_cache_pending_pages(self):
+        """Проверяем, что страница с работами в очереди не кэшируется: run_aggregator в отдельном процессе
+        не сбрасывает кэш страниц процесса сайта, и старые итоги иначе оставались бы в кэше"""
+        cache.clear()
+        url = reverse('watertable', args=[2024])
+        with self.settings(REMBAZA_AGGREGATION_MODE='queue'):
+            self.create_work(summ=Decimal('7.00'))
+            self.assertNotContains(self.client.get(url), '7.00')
+            self.assertNotContains(self.client.get(url), '7.00')
+            with mock.patch.object(page_cache, 'invalidate'):
+                call_command('run_aggregator', '--once', stdout=StringIO())
+            self.assertContains(self.client.get(url), '7.00')
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), '7.00')
+
+
+"""Тест списка работ в админ-панели"""
+
+
+class MonthWorksAdminTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for month, summ in ((1, '10.00'), (2, '5.25')):
+            MonthWorks.objects.create(type_work=1, year=2024, month=month, completed_works='Замена задвижки',
+                                      description='Длинное описание ' * 20, volume=1.5, summ=Decimal(summ))
+        MonthWorks.objects.create(type_work=2, year=2024, month=1, completed_works='Прочистка',
+                                  description='Коротко', volume=2.0, summ=Decimal('100.00'))
+
+    def test_changelist_truncates_description_and_shows_totals(self):
+        """Проверяем усечение описания, итоги по фильтру и отсутствие полного COUNT"""
+        url = reverse('admin:rembaza_app_monthworks_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'type_work__exact': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totals'], {'total_volume': 3.0, 'total_summ': Decimal('15.25')})
+        self.assertContains(response, 'Итого по фильтру: объем 3.000, сумма 15.25')
+        self.assertContains(response, 'Длинное описание Длинное описание')
+        self.assertNotContains(response, 'Длинное описание ' * 6)
+        self.assertNotContains(response, 'Прочистка')
+        selects = [q['sql'] for q in queries if 'rembaza_app_monthworks' in q['sql']]
+        self.assertEqual(len([sql for sql in selects if 'COUNT(' in sql]), 1)
+        self.assertFalse(any('"rembaza_app_monthworks"."description", "' in sql for sql in selects))
+        self.assertTrue(any('SUBSTR("rembaza_app_monthworks"."description", 1, 81)' in sql for sql in selects))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'type_work__exact': 1})
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+
+    def bulk_post(self, action, ids, **data):
+        data.update({'action': action, ACTION_CHECKBOX_NAME: ids, 'apply': '1'})
+        return self.client.post(reverse('admin:rembaza_app_monthworks_changelist'), data)
+
+    def test_bulk_actions_recompute_totals_once(self):
+        """Проверяем массовые перенос, смену вида работ и удаление: итоги совпадают с пересчетом,
+        а количество запросов не зависит от количества записей"""
+        works = [MonthWorks.objects.create(type_work=1, year=2024, month=3, completed_works=f'Работа {n % 5}',
+                                           description='', volume=1.0, summ=Decimal('2.00')) for n in range(60)]
+        ids = [work.pk for work in works]
+
+        response = self.client.post(reverse('admin:rembaza_app_monthworks_changelist'),
+                                    {'action': 'move_works', ACTION_CHECKBOX_NAME: ids})
+        self.assertContains(response, 'Выбрано записей: 60')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.bulk_post('move_works', ids, year=2025, month=4)
+        self.assertEqual(response.status_code, 302)
+        self.assertLess(len(queries), 30)
+        self.assertEqual(MonthWorks.objects.filter(year=2025, month=4).count(), 60)
+        self.assertEqual(year_row(1, 2025, 'Работа 0')['april_summ'], Decimal('24.00'))
+        self.assertFalse(year_table(1, 2024).filter(completed_works='Работа 0').exists())
+
+        self.bulk_post('reclassify_works', ids[:30], type_work=2)
+        self.assertEqual(year_row(2, 2025, 'Работа 0')['april_summ'], Decimal('12.00'))
+        self.assertEqual(aggregation.verify(), [])
+
+        self.bulk_post('delete_works', ids[:45])
+        self.assertEqual(MonthWorks.objects.filter(pk__in=ids).count(), 15)
+        self.assertEqual(year_row(1, 2025, 'Работа 0')['year_total'], Decimal('6.00'))
+        self.assertEqual(aggregation.verify(), [])
+        self.assertEqual(LogEntry.objects.filter(action_flag=DELETION).count(), 45)
+
+
+"""Тест команды массовой загрузки import_monthworks"""
+
+
+class ImportMonthWorksCommandTest(TestCase):
+    def write_csv(self, text):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        f.write(text)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def test_import_creates_works_and_year_rows(self):
+        """Проверяем загрузку строк и пересчет годовых таблиц"""
+        path = self.write_csv(
+            'type_work,year,month,completed_works,description,volume,summ\n'
+            '1,2024,1,Замена задвижки,ул. Ленина,1.5,10.00\n'
+            'Вода,2024,Январь,Замена задвижки,ул. Мира,2,"5,50"\n'
+            '2,2024,3,Прочистка,колодец,1,3\n'
+        )
+        out = StringIO()
+        call_command('import_monthworks', path, chunk_size=2, stdout=out)
+        self.assertIn('строк/с', out.getvalue())
+        self.assertEqual(MonthWorks.objects.count(), 3)
+        water = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(water['january_vol'], 3.5)
+        self.assertEqual(water['january_summ'], Decimal('15.50'))
+        self.assertEqual(water['year_total'], Decimal('15.50'))
+        severage = year_row(2, 2024, 'Прочистка')
+        self.assertEqual(severage['first_quarter'], Decimal('3.00'))
+
+    def test_dry_run_reports_errors_without_writing(self):
+        """Проверяем, что --dry-run только проверяет файл"""
+        path = self.write_csv(
+            'type_work,year,month,completed_works,description,volume,summ\n'
+            '1,2024,13,Замена задвижки,ул. Ленина,1.5,10.00\n'
+        )
+        with self.assertRaises(CommandError):
+            call_command('import_monthworks', path, dry_run=True, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(MonthWorks.objects.exists())
+
+
+"""Тест команды перестроения итогов rebuild_aggregates"""
+
+
+class RebuildAggregatesCommandTest(TestCase):
+    def setUp(self):
+        for month, summ in ((1, '10.00'), (1, '5.00'), (4, '2.50')):
+            MonthWorks.objects.create(type_work=1, year=2024, month=month, completed_works='Замена задвижки',
+                                      description='', volume=1.0, summ=Decimal(summ))
+
+    def test_rebuild_repairs_drift(self):
+        """Проверяем, что перестроение исправляет испорченные итоги и удаляет лишние строки"""
+        WorkRollup.objects.filter(month=1).update(summ=0)
+        WorkRollup.objects.create(type_work=1, year=2024, month=2, work=Work.objects.create(name='Лишняя строка'))
+        call_command('rebuild_aggregates', year=2024, stdout=StringIO())
+        self.assertEqual(year_table(1, 2024).count(), 1)
+        row = year_row(1, 2024, 'Замена задвижки')
+        self.assertEqual(row['january_summ'], Decimal('15.00'))
+        self.assertEqual(row['first_quarter'], Decimal('15.00'))
+        self.assertEqual(row['second_quarter'], Decimal('2.50'))
+        self.assertEqual(row['year_total'], Decimal('17.50'))
+        self.assertEqual(row['january_vol'], 2.0)
+
+    def test_rebuild_repairs_month_summary(self):
+        """Проверяем, что проверка находит, а перестроение исправляет итоги месяцев"""
+        MonthSummary.objects.filter(month=1).update(count=5)
+        MonthSummary.objects.create(type_work=2, year=2024, month=7, count=1)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_aggregates', verify=True, stdout=out)
+        self.assertIn('2024/7 вид 2 итог месяца', out.getvalue())
+        call_command('rebuild_aggregates', year=2024, stdout=StringIO())
+        self.assertEqual(list(MonthSummary.objects.order_by('month').values_list('month', 'count', 'summ')),
+                         [(1, 2, Decimal('15.00')), (4, 1, Decimal('2.50'))])
+
+    def test_verify_reports_differences_without_writing(self):
+        """Проверяем, что --verify находит расхождения и ничего не записывает"""
+        call_command('rebuild_aggregates', verify=True, stdout=StringIO())
+        WorkRollup.objects.filter(month=4).update(summ=0)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_aggregates', verify=True, stdout=out)
+        self.assertIn('2024/4', out.getvalue())
+        self.assertEqual(WorkRollup.objects.get(month=4).summ, Decimal('0.00'))
+
+
+"""Тест уникальности строк итогов"""
+
+
+class WorkRollupConstraintTest(TestCase):
+    def test_duplicate_rollup_row_is_rejected(self):
+        """Проверяем, что вторая строка с тем же ключом не создается"""
+        key = {'type_work': 1, 'year': 2024, 'month': 1, 'work': Work.objects.create(name='Замена задвижки')}
+        WorkRollup.objects.create(**key)
+        with self.assertRaises(IntegrityError):
+            WorkRollup.objects.create(**key)
+
+
+"""Тест кэша страниц отчетов"""
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.work = MonthWorks.objects.create(type_work=1, year=2024, month=1, completed_works='Замена задвижки',
+                                              description='', volume=1.0, summ=Decimal('10.00'))
+
+    def test_page_is_served_from_cache(self):
+        """Проверяем, что повторный запрос не обращается к базе"""
+        url = reverse('watertable', args=[2024])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, '10.00')
+
+    def test_change_invalidates_only_affected_pages(self):
+        """Проверяем, что изменение работы сбрасывает кэш только своих страниц"""
+        water_url = reverse('watertable', args=[2024])
+        severage_url = reverse('severagetable', args=[2024])
+        other_month_url = reverse('monthworks_list', args=[2024, 2])
+        for url in (water_url, severage_url, other_month_url):
+            self.client.get(url)
+        self.work.summ = Decimal('12.50')
+        self.work.save()
+        self.assertContains(self.client.get(water_url), '12.50')
+        with self.assertNumQueries(0):
+            self.client.get(severage_url)
+            self.client.get(other_month_url)
+
+    def test_unchanged_page_returns_304(self):
+        """Проверяем ответ 304 по ETag и новый ETag после изменения данных"""
+        url = reverse('monthworks_list', args=[2024, 1])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.work.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_alone_does_not_return_304(self):
+        """Проверяем, что страница не отдает Last-Modified и не отвечает 304 на один If-Modified-Since:
+        метка изменения точнее секунды, и второе изменение в ту же секунду иначе было бы пропущено"""
+        url = reverse('monthworks_list', args=[2024, 1])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        self.work.summ = Decimal('12.50')
+        self.work.save()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '12.50')
+
+    def test_unread_query_parameters_share_cached_page(self):
+        """Проверяем, что параметры, которые страница не читает, не создают новых копий в кэше"""
+        url = reverse('watertable', args=[2024])
+        etag = self.client.get(f'{url}?x=1')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{url}?x=2&utm=mail')
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(self.client.get(f'{url}?fragment=1')['ETag'], etag)
+
+
+"""Тест потоковой выгрузки таблиц"""
+
+
+class ExportViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for month, summ in ((1, '10.00'), (2, '5.50')):
+            MonthWorks.objects.create(type_work=1, year=2024, month=month, completed_works='Замена задвижки',
+                                      description='ул. Ленина', volume=1.5, summ=Decimal(summ))
+        MonthWorks.objects.create(type_work=1, year=2024, month=1, completed_works='Ремонт колодца',
+                                  description='ул. Мира', volume=1.0, summ=Decimal('2.00'))
+
+    def test_watertable_csv(self):
+        """Проверяем заголовок, строки и итоговую строку CSV"""
+        response = self.client.get(reverse('watertable_export', args=[2024, 'csv']))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines(),
+                               delimiter=';'))
+        self.assertEqual(rows[0][:3], ['Наименование', 'Январь Объем', 'Январь Сумма'])
+        self.assertEqual(rows[0][-1], 'Годовой итог')
+        self.assertEqual([row[0] for row in rows[1:]], ['Замена задвижки', 'Ремонт колодца', 'Итого'])
+        self.assertEqual(rows[1][-1], '15.50')
+        self.assertEqual(rows[-1][2], '12.00')
+        self.assertEqual(rows[-1][-1], '17.50')
+        self.assertEqual(rows[-1][5:7], ['0.000', '0.00'])
+
+    def test_monthworks_xlsx(self):
+        """Проверяем, что XLSX является корректным архивом с листом работ"""
+        response = self.client.get(reverse('monthworks_export', args=[2024, 1, 'xlsx']))
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('xl/workbook.xml', archive.namelist())
+        sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('ул. Мира', sheet)
+        self.assertIn('<v>12.00</v>', sheet)
+
+    def test_unknown_format(self):
+        """Проверяем ответ 404 для неизвестного формата"""
+        response = self.client.get(reverse('severagetable_export', args=[2024, 'pdf']))
+        self.assertEqual(response.status_code, 404)
+
+
+"""Тест JSON API отчетов"""
+
+
+class ReportApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(5):
+            MonthWorks.objects.create(type_work=1, year=2024, month=3, completed_works=f'Работа {number}',
+                                      description='описание', volume=1.0, summ=Decimal('2.50'))
+        MonthWorks.objects.create(type_work=2, year=2024, month=3, completed_works='Прочистка',
+                                  description='колодец', volume=2.0, summ=Decimal('4.00'))
+
+    def test_monthworks_projection_and_cursor(self):
+        """Проверяем отбор колонок и постраничную выдачу по курсору"""
+        url = reverse('api_monthworks', args=[2024, 3])
+        data = self.client.get(url, {'fields': 'completed_works,summ', 'limit': 4}).json()
+        self.assertEqual(len(data['results']), 4)
+        self.assertEqual(set(data['results'][0]), {'completed_works', 'summ'})
+        self.assertEqual(data['results'][0]['summ'], '2.50')
+        data = self.client.get(data['next']).json()
+        self.assertEqual([row['completed_works'] for row in data['results']], ['Работа 4', 'Прочистка'])
+        self.assertIsNone(data['next'])
+
+    def test_watertable_computes_only_requested_columns(self):
+        """Проверяем, что в запрос попадают только запрошенные колонки годовой таблицы"""
+        url = reverse('api_watertable', args=[2024])
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {'fields': 'completed_works,year_total', 'limit': 2}).json()
+        self.assertEqual(data['results'], [{'completed_works': 'Работа 0', 'year_total': '2.50'},
+                                           {'completed_works': 'Работа 1', 'year_total': '2.50'}])
+        self.assertNotIn('january', queries[-1]['sql'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['results']), 2)
+
+    def test_year_detail_summary(self):
+        """Проверяем итоги года по видам работ и месяцам"""
+        data = self.client.get(reverse('api_year_detail', args=[2024])).json()
+        self.assertEqual(data['results'], [
+            {'type_work': 1, 'month': 3, 'count': 5, 'total_volume': '5.000', 'total_summ': '12.50'},
+            {'type_work': 2, 'month': 3, 'count': 1, 'total_volume': '2.000', 'total_summ': '4.00'},
+        ])
+
+    def test_gzip_and_errors(self):
+        """Проверяем сжатие ответа и ответ 400 для неизвестного поля"""
+        response = self.client.get(reverse('api_severagetable', args=[2024]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.client.get(reverse('api_severagetable', args=[2024]), {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+
+"""Тест сравнения лет по предрассчитанным годовым итогам"""
+
+
+class YearComparisonTest(TestCase):
+    def setUp(self):
+        for year, month, summ in ((2024, 2, '100.00'), (2024, 11, '20.00'), (2025, 5, '180.00'), (2026, 1, '50.00')):
+            MonthWorks.objects.create(type_work=1, year=year, month=month, completed_works='Замена задвижки',
+                                      description='', volume=1.0, summ=Decimal(summ))
+        MonthWorks.objects.create(type_work=2, year=2025, month=7, completed_works='Прочистка',
+                                  description='', volume=1.0, summ=Decimal('30.00'))
+
+    def test_summaries_follow_changes(self):
+        """Проверяем, что годовые итоги обновляются при изменении и удалении работ"""
+        summary = YearSummary.objects.get(type_work=1, year=2024, work__name='Замена задвижки')
+        self.assertEqual((summary.first_quarter, summary.fourth_quarter, summary.year_total),
+                         (Decimal('100.00'), Decimal('20.00'), Decimal('120.00')))
+        work = MonthWorks.objects.get(year=2024, month=11)
+        work.month = 8
+        work.save()
+        summary.refresh_from_db()
+        self.assertEqual((summary.third_quarter, summary.fourth_quarter), (Decimal('20.00'), Decimal('0.00')))
+        self.assertEqual((summary.third_quarter_vol, summary.fourth_quarter_vol, summary.year_total_vol),
+                         (Decimal('1.000'), Decimal('0.000'), Decimal('2.000')))
+        MonthWorks.objects.filter(year=2024).delete()
+        self.assertFalse(YearSummary.objects.filter(year=2024).exists())
+        self.assertEqual(aggregation.verify(), [])
+
+    def test_comparison_is_one_query(self):
+        """Проверяем сравнение трех лет и двух видов работ одним запросом и изменение к предыдущему году"""
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('compare'), {'from': 2024, 'to': 2026})
+        self.assertEqual(response.status_code, 200)
+        water, severage = response.context['groups']
+        cells = water['rows'][0]['years']
+        self.assertEqual([cell['year_total'] for cell in cells],
+                         [Decimal('120.00'), Decimal('180.00'), Decimal('50.00')])
+        self.assertEqual([cell['change'] for cell in cells], [None, Decimal('50.00'), Decimal('-72.22')])
+        self.assertEqual(severage['rows'][0]['years'][0], None)
+        self.assertEqual(severage['rows'][0]['years'][1]['third_quarter'], Decimal('30.00'))
+
+    def test_comparison_api(self):
+        """Проверяем ответ API сравнения и отказ при некорректном диапазоне"""
+        data = self.client.get(reverse('api_compare'), {'from': 2025, 'to': 2025, 'type': 2}).json()
+        self.assertEqual(data['results'][0]['completed_works'], 'Прочистка')
+        self.assertEqual(data['results'][0]['years'][0]['year_total'], '30.00')
+        self.assertEqual(self.client.get(reverse('api_compare'), {'from': 2026, 'to': 2024}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('compare'), {'from': 'x'}).status_code, 400)
+
+
+"""Тест полнотекстового поиска работ"""
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.valve = MonthWorks.objects.create(type_work=1, year=2024, month=3, completed_works='Замена задвижки',
+                                               description='ул. Ленина, колодец 5', volume=1.0, summ=Decimal('1.00'))
+        self.well = MonthWorks.objects.create(type_work=2, year=2025, month=3, completed_works='Ремонт колодца',
+                                              description='замена задвижки на выпуске', volume=1.0,
+                                              summ=Decimal('1.00'))
+        MonthWorks.objects.bulk_create(Work.objects.assign([
+            MonthWorks(type_work=1, year=2025, month=1, completed_works='Прочистка',
+                       description='засор у колодца', volume=1.0, summ=Decimal('1.00'))]))
+
+    def test_ranked_prefix_search_with_filters(self):
+        """Проверяем поиск по началу слов, порядок по релевантности и отбор по году"""
+        if not search.is_available():
+            self.skipTest('Полнотекстовый индекс есть только в SQLite')
+        self.assertEqual([work.pk for work in search.search('ЗАДВИЖ')], [self.valve.pk, self.well.pk])
+        self.assertEqual([work.completed_works for work in search.search('колодц', year=2025)],
+                         ['Ремонт колодца', 'Прочистка'])
+        self.assertEqual(search.search('колодц', year=2025, type_work=1)[0].completed_works, 'Прочистка')
+        self.assertEqual(search.search('"; DROP TABLE x; --'), [])
+
+    def test_index_follows_changes(self):
+        """Проверяем, что индекс следует за изменением, массовым изменением и удалением записей"""
+        self.valve.description = 'переулок Садовый'
+        self.valve.save()
+        self.assertEqual([work.pk for work in search.search('садов')], [self.valve.pk])
+        MonthWorks.objects.filter(pk=self.well.pk).update(completed_works='Промывка сети')
+        self.assertEqual([work.pk for work in search.search('промыв')], [self.well.pk])
+        aggregation.bulk_delete(MonthWorks.objects.filter(pk=self.valve.pk))
+        self.assertEqual(search.search('садов'), [])
+
+    def test_index_is_restored_after_table_rebuild(self):
+        """Проверяем восстановление триггеров, которые SQLite удаляет при пересоздании таблицы"""
+        if not search.is_available():
+            self.skipTest('Полнотекстовый индекс есть только в SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.FTS_TABLE}_insert')
+        MonthWorks.objects.create(type_work=1, year=2024, month=1, completed_works='Установка гидранта',
+                                  description='', volume=1.0, summ=Decimal('1.00'))
+        self.assertEqual(search.search('гидрант'), [])
+        search.install_index(connection, repair=True)
+        self.assertEqual(len(search.search('гидрант')), 1)
+
+    def test_search_page_and_admin(self):
+        """Проверяем страницу поиска и поиск в списке админ-панели по описанию"""
+        response = self.client.get(reverse('search'), {'q': 'задвижки', 'year': 2025})
+        self.assertEqual([work.pk for work in response.context['results']], [self.well.pk])
+        self.assertContains(response, 'Ремонт колодца')
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'x', 'month': 'май'}).status_code, 400)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('admin:rembaza_app_monthworks_changelist'), {'q': 'засор'})
+        self.assertEqual([work.pk for work in response.context['cl'].result_list],
+                         [MonthWorks.objects.get(completed_works='Прочистка').pk])
+
+
+"""Тест постраничной выдачи таблиц"""
+
+
+class PaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for number in range(5):
+            MonthWorks.objects.create(type_work=1, year=2024, month=6, completed_works=f'Работа {number}',
+                                      description=f'описание {number}', volume=1.0, summ=Decimal('1.00'))
+
+    def test_monthworks_list_pages_and_fragments(self):
+        """Проверяем порции страницы работ за месяц, догрузку строк и некорректный курсор"""
+        url = reverse('monthworks_list', args=[2024, 6])
+        with self.settings(REMBAZA_PAGE_SIZE=2):
+            response = self.client.get(url)
+            self.assertEqual([work.completed_works for work in response.context['works']], ['Работа 0', 'Работа 1'])
+            self.assertContains(response, 'Показать еще')
+            next_url = response.context['next_url']
+
+            response = self.client.get(next_url + '&fragment=1')
+            self.assertTemplateUsed(response, 'rembaza_app/monthworks_rows.html')
+            self.assertTemplateNotUsed(response, 'rembaza_app/monthworks_list.html')
+            self.assertContains(response, 'Работа 3')
+            self.assertNotContains(response, 'Работа 1')
+            self.assertNotContains(response, '<table')
+
+            response = self.client.get(response['X-Next-Page'] + '&fragment=1')
+            self.assertContains(response, 'Работа 4')
+            self.assertFalse(response.has_header('X-Next-Page'))
+            self.assertEqual(self.client.get(url, {'after': '!!'}).status_code, 400)
+
+    def test_year_table_pages_by_name(self):
+        """Проверяем порции годовой таблицы по наименованию работ"""
+        with self.settings(REMBAZA_PAGE_SIZE=3):
+            response = self.client.get(reverse('watertable', args=[2024]))
+            self.assertEqual([row[0] for row in response.context['watertables']],
+                             ['Работа 0', 'Работа 1', 'Работа 2'])
+            response = self.client.get(response.context['next_url'])
+            self.assertEqual([row[0] for row in response.context['watertables']],
+                             ['Работа 3', 'Работа 4'])
+            self.assertIsNone(response.context['next_url'])
+            self.assertNotContains(response, 'Показать еще')
+
+
+"""Тест отрисовки строк годовых таблиц форматтером строк"""
+
+
+class TableRenderingTest(TestCase):
+    def test_formatter_matches_template(self):
+        """Проверяем, что форматтер выводит значения так же, как {{ value }} в шаблоне Django"""
+        columns = (('completed_works', 'Наименование'), ('january_vol', 'Объем'), ('january_summ', 'Сумма'),
+                   ('year_total', 'Итог'))
+        rows = [('Замена <задвижки> & "люка"', 2.5, Decimal('-1234.50'), Decimal('0.00')),
+                ('Прочистка', 1e-07, Decimal('10'), None)]
+        template = engines['django'].from_string(
+            '{% for row in rows %}<tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>\n{% endfor %}')
+        for language in ('en-us', 'ru'):
+            with self.subTest(language=language), translation.override(language):
+                self.assertEqual(tables.render_rows(rows, columns), template.render({'rows': rows}))
+
+    def test_year_table_page_renders_rows(self):
+        """Проверяем заголовки и строки общей страницы годовой таблицы"""
+        cache.clear()
+        MonthWorks.objects.create(type_work=2, year=2024, month=4, completed_works='Ремонт <колодца>',
+                                  volume=1.5, summ=Decimal('10.25'))
+        response = self.client.get(reverse('severagetable', args=[2024]))
+        self.assertTemplateUsed(response, 'rembaza_app/year_table.html')
+        self.assertContains(response, '<th>Апрель Объем</th>')
+        self.assertContains(response, '<td>Ремонт &lt;колодца&gt;</td>')
+        self.assertContains(response, '<td>1.500</td><td>10.25</td>')
+        self.assertContains(response, '<th>2 квартал объем</th><th>2 квартал сумма</th>')
+        self.assertContains(response, '<td>1.500</td><td>10.25</td></tr>')
+        self.assertContains(response, reverse('severagetable_export', args=[2024, 'csv']))
+
+    def test_rendering_benchmark(self):
+        """Проверяем замер отрисовки строк всеми способами"""
+        result = benchmark.measure_table_rendering(rows=10, repeat=1)
+        self.assertEqual(set(result), {'dict_template', 'tuple_template', 'row_formatter'})
+
+
+"""Тест замеров запросов PerformanceMiddleware и страницы /_perf/"""
+
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        perf.requests_buffer.clear()
+        MonthWorks.objects.create(type_work=1, year=2024, month=1, completed_works='Замер', summ=Decimal('5.00'))
+
+    def test_request_is_measured(self):
+        """Проверяем заголовок Server-Timing, строку журнала и запись в буфер"""
+        with self.assertLogs('rembaza_app.perf', 'INFO') as logs:
+            response = self.client.get(reverse('watertable', args=[2024]))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", tpl;dur=[\d.]+, total;dur=')
+        logged = json.loads(logs.records[0].getMessage())
+        self.assertEqual((logged['url_name'], logged['status'], logged['queries']), ('watertable', 200, 1))
+        entry, = perf.requests_buffer.snapshot()
+        self.assertEqual(entry['size'], len(response.content))
+        self.assertGreater(entry['template_ms'], 0)
+        self.assertLessEqual(entry['template_ms'] + entry['db_ms'], entry['total_ms'])
+
+    async def test_template_time_under_asgi(self):
+        """Проверяем время отрисовки ответа под ASGI и то, что шаблоны вне запроса не замеряются"""
+        await self.async_client.get(reverse('watertable', args=[2024]))
+        entry, = perf.requests_buffer.snapshot()
+        self.assertGreater(entry['template_ms'], 0)
+        with mock.patch.object(perf, '_current') as current:
+            engines['django'].from_string('{{ value }}').render({'value': 1})
+        current.get.assert_not_called()
+
+    def test_perf_page_is_staff_only(self):
+        """Проверяем доступ к странице замеров и перцентили по имени адреса"""
+        url = reverse('perf')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        for _ in range(3):
+            self.client.get(reverse('watertable', args=[2024]))
+        self.client.force_login(User.objects.create_user('staff', password='pass', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rows = {row['url_name']: row for row in response.context['rows']}
+        self.assertEqual(list(rows), perf.app_url_names())
+        self.assertEqual(rows['watertable']['count'], 3)
+        self.assertLessEqual(rows['watertable']['p50_ms'], rows['watertable']['p99_ms'])
+        self.assertEqual(rows['years']['count'], 0)
+        self.assertEqual(len(perf.requests_buffer.snapshot()), 3)
+
+
+"""Тест асинхронных представлений страниц отчетов"""
+
+
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            MonthWorks.objects.create(type_work=number % 2 + 1, year=2024, month=number + 1,
+                                      completed_works=f'Работа {number}', volume=1.5, summ=Decimal('2.50'))
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_async_views_match_sync_views(self):
+        """Проверяем, что асинхронные представления отдают те же страницы, что и синхронные"""
+        factory = AsyncRequestFactory()
+        cases = [('year_view', '/', ()), ('year_detail', '/year_detail/2024', (2024,)),
+                 ('monthworks_list', '/month/2024/1/', (2024, 1)), ('watertable_view', '/water/2024/', (2024,)),
+                 ('severagetable_view', '/severage/2024', (2024,))]
+        for name, path, args in cases:
+            with self.subTest(view=name):
+                await cache.aclear()
+                response = await getattr(async_views, name)(factory.get(path), *args)
+                response = await sync_to_async(response.render)()
+                await cache.aclear()
+                expected = await sync_to_async(getattr(views, name))(factory.get(path), *args)
+                expected = await sync_to_async(expected.render)()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+    async def test_async_page_cache(self):
+        """Проверяем кэш страницы и ответ 304 асинхронного представления"""
+        factory = AsyncRequestFactory()
+        response = await async_views.watertable_view(factory.get('/water/2024/'), 2024)
+        self.assertContains(response, 'Работа 0')
+        response = await async_views.watertable_view(
+            factory.get('/water/2024/', headers={'If-None-Match': response['ETag']}), 2024)
+        self.assertEqual(response.status_code, 304)
+        response = await async_views.monthworks_list(factory.get('/month/2024/1/', {'after': '!!'}), 2024, 1)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_async_year_table_errors(self):
+        """Проверяем, что некорректный курсор дает 400, а ошибка базы данных не отдается страницей"""
+        factory = AsyncRequestFactory()
+        response = await async_views.watertable_view(factory.get('/water/2024/', {'after': '_w'}), 2024)
+        self.assertEqual(response.status_code, 400)
+        with mock.patch.object(tables, 'year_table_rows', side_effect=DatabaseError('no such table')):
+            with self.assertRaises(DatabaseError):
+                await async_views.watertable_view(factory.get('/water/2024/'), 2024)
+
+
+"""Тест нагрузочного клиента на простом HTTP-сервере"""
+
+
+class ServerLoadTest(TestCase):
+    def test_measure_server_load(self):
+        """Проверяем, что клиенты переиспользуют соединения и считают ответы и ошибки"""
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = b'ok'
+                self.send_response(200 if self.path.startswith('/ok') else 404)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            port = server.server_address[1]
+            result = benchmark.measure_server_load('127.0.0.1', port, ['/ok'], clients=3, duration=0.3)
+            self.assertGreater(result['requests'], 0)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['max_ms'])
+            result = benchmark.measure_server_load('127.0.0.1', port, ['/missing'], clients=1, duration=0.1)
+            self.assertEqual(result['requests'], 0)
+            self.assertTrue(result['first_error'].startswith('HTTP 404'))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+"""Тест бюджетов запросов к базе для всех страниц и цепочки сигналов"""
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(300)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_url_has_budget(self):
+        """Проверяем, что для каждого адреса приложения задан бюджет запросов"""
+        self.assertEqual({name for name, _ in benchmark.url_cases()}, set(benchmark.QUERY_BUDGETS))
+
+    def test_urls_within_budget(self):
+        """Проверяем количество запросов каждой страницы при пустом и заполненном кэше"""
+        for name, url in benchmark.url_cases():
+            with self.subTest(name=name):
+                response, queries, _, _ = benchmark._request(self.client, url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(queries, benchmark.QUERY_BUDGETS[name])
+
+    def test_signal_chain_budget(self):
+        """Проверяем количество запросов на создание, изменение и удаление работы"""
+        with self.assertNumQueries(15):
+            work = MonthWorks.objects.create(type_work=1, year=2030, month=1, completed_works='Замер',
+                                             description='', volume=1.0, summ=Decimal('10.00'))
+        work.summ = Decimal('11.00')
+        with self.assertNumQueries(6):
+            work.save()
+        with self.assertNumQueries(10):
+            work.delete()
+
+
+class SqliteSettingsTest(TestCase):
+    def test_pragmas_applied(self):
+        """Проверяем, что настройки REMBAZA_SQLITE_PRAGMAS выполняются при открытии соединения"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Только для SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.REMBAZA_SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_journal_mode_set_by_migrate(self):
+        """Проверяем, что режим журнала записан в файл базы командой migrate, а не настройкой соединения"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Только для SQLite')
+        self.assertNotIn('journal_mode', settings.REMBAZA_SQLITE_PRAGMAS)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], settings.REMBAZA_SQLITE_JOURNAL_MODE.lower())
+
+    def test_invalid_pragma_rejected(self):
+        """Проверяем, что некорректное значение настройки не подставляется в запрос"""
+        with self.settings(REMBAZA_SQLITE_PRAGMAS={'journal_mode': 'WAL; DROP TABLE x'}):
+            with self.assertRaises(ValueError):
+                signals.configure_sqlite(sender=None, connection=connection)
+
+
+class ConcurrentUpdateTest(TransactionTestCase):
+    """Параллельные писатели в отдельных соединениях; итоги должны совпасть с пересчетом по MonthWorks"""
+    writers = 6
+    operations = 15
+
+    def run_writers(self, target):
+        errors = []
+
+        def run(number):
+            try:
+                target(number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(number,)) for number in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_writers_keep_totals_exact(self):
+        """Проверяем точность итогов после параллельного создания, изменения и удаления работ одного наименования"""
+        def write(number):
+            for step in range(self.operations):
+                work = MonthWorks.objects.create(type_work=1, year=2024, month=step % 3 + 1,
+                                                 completed_works='Параллельная работа', description='',
+                                                 volume=1.0, summ=Decimal('10.00'))
+                work.month = number % 3 + 1
+                work.summ = Decimal('15.50')
+                work.save()
+                if step % 5 == 0:
+                    work.delete()
+
+        self.run_writers(write)
+        self.assertEqual(aggregation.verify(), [])
+        total = WorkRollup.objects.filter(work__name='Параллельная работа').aggregate(Sum('summ'))['summ__sum']
+        self.assertEqual(total, Decimal('15.50') * self.writers * (self.operations - 3))
+
+    def test_parallel_edits_of_one_record(self):
+        """Проверяем, что параллельные изменения одной записи из устаревших объектов не удваивают разницу"""
+        work = MonthWorks.objects.create(type_work=1, year=2024, month=1, completed_works='Общая запись',
+                                         description='', volume=1.0, summ=Decimal('10.00'))
+
+        def edit(number):
+            for step in range(self.operations):
+                stale = MonthWorks.objects.get(pk=work.pk)
+                stale.summ = Decimal(number * 100 + step)
+                stale.save()
+
+        self.run_writers(edit)
+        work.refresh_from_db()
+        self.assertEqual(WorkRollup.objects.get(work__name='Общая запись').summ, work.summ)
+        self.assertEqual(aggregation.verify(), [])
@@ -1,10 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from .views import year_view, year_detail, monthworks_list, watertable_view, severagetable_view
+from . import async_views, views
+from .api import year_detail_api, monthworks_api, watertable_api, severagetable_api, compare_api
+from .views import (compare_view, search_view, watertable_export, severagetable_export, monthworks_export)
+
+"""Страницы отчетов: асинхронные представления, если включена настройка REMBAZA_ASYNC_VIEWS, иначе синхронные"""
+reports = async_views if getattr(settings, 'REMBAZA_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
-    path('', year_view, name='years'),
-    path('year_detail/<int:year>', year_detail, name='year_detail'),
-    path('month/<int:year>/<int:month>/', monthworks_list, name='monthworks_list'),
-    path('water/<int:year>/', watertable_view, name='watertable'),
-    path('severage/<int:year>', severagetable_view, name='severagetable'),
+    path('', reports.year_view, name='years'),
+    path('year_detail/<int:year>', reports.year_detail, name='year_detail'),
+    path('month/<int:year>/<int:month>/', reports.monthworks_list, name='monthworks_list'),
+    path('water/<int:year>/', reports.watertable_view, name='watertable'),
+    path('severage/<int:year>', reports.severagetable_view, name='severagetable'),
+    path('compare/', compare_view, name='compare'),
+    path('search/', search_view, name='search'),
+    path('month/<int:year>/<int:month>/export.<str:fmt>', monthworks_export, name='monthworks_export'),
+    path('water/<int:year>/export.<str:fmt>', watertable_export, name='watertable_export'),
+    path('severage/<int:year>/export.<str:fmt>', severagetable_export, name='severagetable_export'),
+    path('api/year/<int:year>/', year_detail_api, name='api_year_detail'),
+    path('api/month/<int:year>/<int:month>/', monthworks_api, name='api_monthworks'),
+    path('api/water/<int:year>/', watertable_api, name='api_watertable'),
+    path('api/severage/<int:year>/', severagetable_api, name='api_severagetable'),
+    path('api/compare/', compare_api, name='api_compare'),
 ]
@@ -1,6 +1,13 @@
-from django.http import HttpResponse
-from django.shortcuts import render, get_object_or_404
-from .models import MonthWorks, WaterTable, SeverageTable, YEAR_CHOICES
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from . import export, perf, search, tables
+from .pagination import is_fragment, keyset_page, render_page
+from .models import MonthWorks, YEAR_CHOICES
+from .page_cache import cached_page
+from .pivot import (WATER, SEVERAGE, comparison_params, month_subtotals, month_summary, year_comparison,
+                    year_summary)
 
 """Представление для страницы выбора отчетного года:
  - отображает ссылки для перенаправления на страницу с данными по выбранному году"""
@@ -9,61 +16,194 @@ from .models import MonthWorks, WaterTable, SeverageTable, YEAR_CHOICES
 def year_view(request):
     years = [year[0] for year in YEAR_CHOICES]
     context = {'years': years}
-    return render(request, 'rembaza_app/year_page.html', context)
+    return TemplateResponse(request, 'rembaza_app/year_page.html', context)
 
 
 """Представление для страницы выбора отчетного месяца и таблицы годового итога 
 по водоснабжению или водоотведению
- - отображает ссылки для перенаправления на страницу с таблицами значений по отчетному месяцу или по году"""
+ - отображает ссылки для перенаправления на страницу с таблицами значений по отчетному месяцу или по году,
+ - по каждому месяцу показывает количество и сумму работ по водоснабжению и водоотведению,
+ - все числа считаются одним запросом GROUP BY вида работ и месяца, страница кэшируется по году"""
+
+
+def year_detail_context(year, rows):
+    """Контекст страницы года по строкам year_summary (общий для синхронного и асинхронного представления)"""
+    months = [{'number': number, 'name': name, 'water': None, 'severage': None}
+              for number, name in MonthWorks.MONTH_CHOICES]
+    totals = {'water': {'count': 0, 'total_summ': 0}, 'severage': {'count': 0, 'total_summ': 0}}
+    for row in rows:
+        kind = {WATER: 'water', SEVERAGE: 'severage'}.get(row['type_work'])
+        if kind is None:
+            continue
+        months[row['month'] - 1][kind] = row
+        totals[kind]['count'] += row['count']
+        totals[kind]['total_summ'] += row['total_summ']
+    return {
+        'year': year,
+        'months': months,
+        'totals': totals
+    }
 
 
+@cached_page('year_detail')
 def year_detail(request, year):
-    monthworks = MonthWorks.objects.filter(year=year)
-    watertable = WaterTable.objects.filter(year=year)
-    severagetable = SeverageTable.objects.filter(year=year)
+    return TemplateResponse(request, 'rembaza_app/year_detail.html', year_detail_context(year, year_summary(year)))
+
+
+"""Представление для отображения страницы с таблицей работ по выбранному месяцу
+ - работы выводятся порциями по REMBAZA_PAGE_SIZE в порядке внесения (см. pagination),
+ - итоги по видам работ и общий итог месяца читаются из MonthSummary (только для полной страницы)"""
+
+
+def monthworks_queryset(year, month):
+    return MonthWorks.objects.filter(year=year, month=month).order_by('id')
+
+
+def render_monthworks_page(request, year, month, page, summary_rows):
+    subtotals, total = month_subtotals(summary_rows)
     context = {
+        'works': page.rows,
+        'subtotals': subtotals,
+        'total': total,
+        'month_name': dict(MonthWorks.MONTH_CHOICES)[month],
         'year': year,
-        'monthworks': monthworks,
-        'watertable': watertable,
-        'severagetable': severagetable
+        'month': month
     }
-    return render(request, 'rembaza_app/year_detail.html', context)
+    return render_page(request, 'rembaza_app/monthworks_list.html', 'rembaza_app/monthworks_rows.html',
+                       context, page)
+
+
+@cached_page('monthworks_list')
+def monthworks_list(request, year, month):
+    try:
+        page = keyset_page(monthworks_queryset(year, month), 'id', request.GET.get('after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    summary_rows = [] if is_fragment(request) else list(month_summary(year, month))
+    return render_monthworks_page(request, year, month, page, summary_rows)
 
 
-"""Представление для отображения страницы с таблицей работ по выбранному месяцу"""
+"""Годовые таблицы по видам работ: (ключ строк в контексте, шаблон, выгрузка)"""
+YEAR_TABLE_PAGES = {
+    WATER: ('watertables', 'rembaza_app/watertable.html', 'watertable_export'),
+    SEVERAGE: ('severagetables', 'rembaza_app/severagetable.html', 'severagetable_export'),
+}
 
 
-def monthworks_list(request, year, month):
-    works = MonthWorks.objects.filter(year=year, month=month)
+def render_year_table_page(request, type_work, year, page):
+    """Порция строк годовой таблицы по наименованию работ:
+     - строки читаются кортежами в порядке колонок tables.YEAR_TABLE_COLUMNS
+     и выводятся общим шаблоном year_table.html через собранный заранее форматтер строк"""
+    key, template, export_view = YEAR_TABLE_PAGES[type_work]
     context = {
-        'works': works,
-        'month_name': dict(MonthWorks.MONTH_CHOICES)[month]
-    }
-    return render(request, 'rembaza_app/monthworks_list.html', context)
+        key: page.rows,
+        'columns': tables.YEAR_TABLE_COLUMNS,
+        'export_view': export_view,
+        'year': year}
+    return render_page(request, template, 'rembaza_app/year_table_rows.html', context, page)
+
+
+"""Порция годовой таблицы по виду работ: некорректный курсор - ответ 400, который не кэшируется;
+ошибки базы данных не перехватываются и обрабатываются Django как ошибка сервера"""
+
+
+def year_table_view(request, type_work, year):
+    try:
+        page = keyset_page(tables.year_table_rows(type_work, year), 'completed_works', request.GET.get('after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return render_year_table_page(request, type_work, year, page)
 
 
 """Представление для отображения страницы с суммарной таблицей годовых работ по водоснабжению"""
 
 
+@cached_page('watertable')
 def watertable_view(request, year):
-    try:
-        watertables = WaterTable.objects.filter(year=year)
-    except Exception as e:
-        return HttpResponse(e)
-    context = {
-        'watertables': watertables,
-        'year': year}
-    return render(request, 'rembaza_app/watertable.html', context)
+    return year_table_view(request, WATER, year)
 
 
 """Представление для отображения страницы с суммарной таблицей годовых работ по водотведению"""
 
 
+@cached_page('severagetable')
 def severagetable_view(request, year):
+    return year_table_view(request, SEVERAGE, year)
+
+
+"""Представление для страницы сравнения лет:
+ - по каждой работе суммы по кварталам и за год за диапазон лет (?from=&to=&type=)
+ и изменение годовой суммы к предыдущему году,
+ - данные читаются одним запросом из предрассчитанных годовых итогов YearSummary"""
+
+
+def compare_view(request):
     try:
-        severagetables = SeverageTable.objects.filter(year=year)
-    except Exception as e:
-        return HttpResponse(e)
-    context = {'severagetables': severagetables,
-               'year': year}
-    return render(request, 'rembaza_app/severagetable.html', context)
+        year_from, year_to, types = comparison_params(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    type_names = dict(MonthWorks.TYPE_CHOICES)
+    rows = year_comparison(year_from, year_to, types)
+    groups = [{'name': type_names[type_work], 'rows': [row for row in rows if row['type_work'] == type_work]}
+              for type_work in types]
+    context = {
+        'year_from': year_from,
+        'year_to': year_to,
+        'years': list(range(year_from, year_to + 1)),
+        'groups': groups,
+    }
+    return TemplateResponse(request, 'rembaza_app/compare.html', context)
+
+
+"""Представление для страницы поиска работ:
+ - ищет слова запроса (?q=) в наименовании и описании работ через полнотекстовый индекс,
+ - результаты упорядочены по релевантности, отбор по году, месяцу и виду работ (?year=&month=&type=)"""
+
+
+def search_view(request):
+    try:
+        filters = {name: int(request.GET[param]) if request.GET.get(param) else None
+                   for name, param in (('year', 'year'), ('month', 'month'), ('type_work', 'type'))}
+    except ValueError:
+        return HttpResponseBadRequest('Год, месяц и вид работ задаются числами')
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'filters': filters,
+        'results': search.search(query, **filters) if query else [],
+        'years': [year[0] for year in YEAR_CHOICES],
+        'months': MonthWorks.MONTH_CHOICES,
+        'types': MonthWorks.TYPE_CHOICES,
+    }
+    return TemplateResponse(request, 'rembaza_app/search.html', context)
+
+
+"""Представления потоковой выгрузки таблиц в CSV и XLSX (формат задается расширением в адресе)"""
+
+
+def watertable_export(request, year, fmt):
+    return export.year_table_response(WATER, year, fmt, f'water_{year}', f'Водоснабжение {year}')
+
+
+def severagetable_export(request, year, fmt):
+    return export.year_table_response(SEVERAGE, year, fmt, f'severage_{year}', f'Водоотведение {year}')
+
+
+def monthworks_export(request, year, month, fmt):
+    return export.monthworks_response(year, month, fmt, f'works_{year}_{month:02d}', f'Работы {month:02d}.{year}')
+
+
+"""Представление для страницы замеров производительности (только для сотрудников):
+ - по каждому адресу приложения перцентили времени ответа и средние показатели
+ по последним запросам из буфера PerformanceMiddleware"""
+
+
+@staff_member_required
+def perf_view(request):
+    entries = perf.requests_buffer.snapshot()
+    context = {
+        'rows': perf.summary(entries),
+        'total': len(entries),
+        'buffer_size': perf.buffer_size(),
+    }
+    return TemplateResponse(request, 'rembaza_app/perf.html', context)
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rembaza_app.perf.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,9 +79,91 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Соединение переиспользуется между запросами (секунды), PRAGMA выполняются один раз на соединение
+        'CONN_MAX_AGE': int(os.environ.get('REMBAZA_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Транзакция сразу берет блокировку записи, а не повышает ее посреди транзакции
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Тестовая база в файле: в общей базе в памяти параллельные соединения
+        # блокируют таблицы целиком и не ждут busy_timeout
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Режим журнала SQLite (см. signals.set_journal_mode): WAL позволяет читать во время записи.
+# Режим записывается в файл базы командой migrate; рядом с базой появляются файлы db.sqlite3-wal
+# и db.sqlite3-shm (они в .gitignore)
+REMBAZA_SQLITE_JOURNAL_MODE = 'WAL'
+
+# Настройки соединения SQLite (см. signals.configure_sqlite):
+# busy_timeout - ожидание блокировки в миллисекундах
+REMBAZA_SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('REMBAZA_SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+# Обновление итогов WorkRollup при сохранении MonthWorks (см. aggregation.mode):
+# 'immediate' - разница сразу в транзакции сохранения, 'on_commit' - пересчет работы после фиксации,
+# 'queue' - очередь DirtyWork, которую обрабатывает команда run_aggregator
+REMBAZA_AGGREGATION_MODE = os.environ.get('REMBAZA_AGGREGATION_MODE', 'immediate')
+
+# Асинхронные представления страниц отчетов (rembaza_app.async_views); включаются переменной окружения
+# REMBAZA_ASYNC_VIEWS=1 при запуске через ASGI, по умолчанию выключены
+REMBAZA_ASYNC_VIEWS = os.environ.get('REMBAZA_ASYNC_VIEWS', '0') == '1'
+
+# Количество строк в одной порции таблиц monthworks_list и годовых таблиц (см. pagination)
+REMBAZA_PAGE_SIZE = 100
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Кэш, который ничего не хранит: страницы строятся на каждый запрос (loadtest --uncached)
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+# Кэш страниц отчетов: псевдоним кэша из CACHES и время хранения страницы в секундах
+REMBAZA_CACHE_ALIAS = os.environ.get('REMBAZA_CACHE_ALIAS', 'default')
+REMBAZA_CACHE_TIMEOUT = 60 * 60
+
+# Замеры запросов (см. perf.PerformanceMiddleware): количество последних запросов для страницы /_perf/
+REMBAZA_PERF_BUFFER_SIZE = 5000
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # Строка JSON с замерами на каждый запрос
+        'rembaza_app.perf': {
+            'handlers': ['console'],
+            'level': os.environ.get('REMBAZA_PERF_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -16,8 +16,10 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from rembaza_app.views import perf_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('_perf/', perf_view, name='perf'),
     path('', include('rembaza_app.urls') )
 ]